@@ -1,3 +1,24 @@
+import os
+from typing import Callable, Mapping, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Seconds a lease outlives the function timeout, a run holding it has been
+# killed by then
+LEASE_MARGIN = 30
+# Share of the function timeout a run spends processing tweets, the rest
+# is left for the last batch running over and for sending replies
+TIME_BUDGET_SHARE = 0.75
+
+
+def env_or_none(
+    environ: Mapping[str, str], name: str, parse: Callable[[str], T]
+) -> Optional[T]:
+    """Returns the parsed environment variable, None if not set"""
+    value = environ.get(name)
+    return None if value is None else parse(value)
+
+
 class SMVConfig(object):
     def __init__(
         self,
@@ -6,7 +27,30 @@ class SMVConfig(object):
         twitter_reply_message_success: str,
         twitter_reply_message_invalid_format: str,
         twitter_reply_message_invalid_signature: str,
-        twitter_reply_delay: float,
+        verification_workers: int = 0,
+        verification_pool_min_tweets: int = 100,
+        signature_backend: str = "nacl",
+        tweet_record_batch_size: int = 20,
+        todo_tweets_limit: int = 500,
+        twitter_reply_limit: int = 300,
+        twitter_reply_limit_window: int = 3 * 60 * 60,
+        twitter_reply_max_attempts: int = 5,
+        twitter_reply_retry_delay: float = 60,
+        retry_tweets_limit: int = 100,
+        retry_max_attempts: int = 5,
+        retry_delay: float = 60,
+        function_timeout: float = 60,
+        processing_lease: Optional[int] = None,
+        lease_ttl: Optional[float] = None,
+        shard_count: int = 1,
+        shard_index: int = 0,
+        time_budget: Optional[float] = None,
+        stream_queue_size: int = 4,
+        filter_stream_url: str = (
+            "https://stream.twitter.com/1.1/statuses/filter.json"
+        ),
+        filter_stream_reconnect_delay: float = 5,
+        filter_stream_max_reconnect_delay: float = 320,
     ) -> None:
         self.twitter_search_text = twitter_search_text
         self.twitter_reply_message_success = twitter_reply_message_success
@@ -16,7 +60,134 @@ class SMVConfig(object):
         self.twitter_reply_message_invalid_signature = (
             twitter_reply_message_invalid_signature
         )
-        self.twitter_reply_delay = twitter_reply_delay
+        # Number of worker processes verifying signatures, 0 - no workers
+        self.verification_workers = verification_workers
+        # Smaller batches of tweets are verified without the workers, it
+        # would take longer to send them to the workers
+        self.verification_pool_min_tweets = verification_pool_min_tweets
+        # Crypto library verifying signatures: nacl (default), ed25519 or
+        # cryptography
+        self.signature_backend = signature_backend
+        # Number of tweets which records are written in one bulk write
+        self.tweet_record_batch_size = tweet_record_batch_size
+        # Max number of todo tweets fetched in one run (100 per API call)
+        self.todo_tweets_limit = todo_tweets_limit
+        # Max number of replies sent in `twitter_reply_limit_window` seconds
+        self.twitter_reply_limit = twitter_reply_limit
+        self.twitter_reply_limit_window = twitter_reply_limit_window
+        # Failed replies are retried after `twitter_reply_retry_delay`
+        # seconds, doubled with every attempt
+        self.twitter_reply_max_attempts = twitter_reply_max_attempts
+        self.twitter_reply_retry_delay = twitter_reply_retry_delay
+        # Tweets failed with unexpected error are retried after `retry_delay`
+        # seconds, doubled with every attempt, up to `retry_max_attempts`
+        # attempts; max `retry_tweets_limit` retries in one run
+        self.retry_tweets_limit = retry_tweets_limit
+        self.retry_max_attempts = retry_max_attempts
+        self.retry_delay = retry_delay
+        # Timeout of the Cloud Function (`timeout` of the deployment), a run
+        # is killed after `function_timeout` seconds
+        self.function_timeout = function_timeout
+        # Tweets in PROCESSING status for longer than `processing_lease`
+        # seconds have been interrupted and are retried, default: just
+        # after the run has been killed
+        self.processing_lease = (
+            int(function_timeout + LEASE_MARGIN)
+            if processing_lease is None
+            else processing_lease
+        )
+        # Only one run at a time holds the lease, it expires after
+        # `lease_ttl` seconds if not renewed (e.g. the run has crashed),
+        # default: just after the run has been killed
+        self.lease_ttl = (
+            function_timeout + LEASE_MARGIN if lease_ttl is None else lease_ttl
+        )
+        # Tweets are split between `shard_count` instances by user_id. Todo
+        # tweets (user not known yet) are looked up by shard 0. Shard 0
+        # fetches tweets from Twitter and passes tweets of other shards via
+        # inbox.
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+        # A run stops processing tweets at the first checkpoint that would
+        # not fit into `time_budget` seconds (0 - no limit), the rest of
+        # tweets is processed in the next run. Default: safely below
+        # `function_timeout`, so a run is not killed mid-batch
+        self.time_budget = (
+            function_timeout * TIME_BUDGET_SHARE
+            if time_budget is None
+            else time_budget
+        )
+        # Shard 0 stores fetched pages into inboxes while next pages are
+        # fetched, at most `stream_queue_size` fetched pages wait
+        self.stream_queue_size = stream_queue_size
+        # Long-running ingestion from the filtered stream (see `stream.py`)
+        # reconnects after `filter_stream_reconnect_delay` seconds, doubled
+        # with every failed connection, up to
+        # `filter_stream_max_reconnect_delay` seconds
+        self.filter_stream_url = filter_stream_url
+        self.filter_stream_reconnect_delay = filter_stream_reconnect_delay
+        self.filter_stream_max_reconnect_delay = (
+            filter_stream_max_reconnect_delay
+        )
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "SMVConfig":
+        """Reads the config from environment variables"""
+        if "TWITTER_REPLY_DELAY" in environ:
+            print(
+                "TWITTER_REPLY_DELAY is ignored, replies are sent by "
+                "/process-replies within TWITTER_REPLY_LIMIT per "
+                "TWITTER_REPLY_LIMIT_WINDOW"
+            )
+        return cls(
+            twitter_search_text=environ["TWITTER_SEARCH_TEXT"],
+            twitter_reply_message_success=environ["TWITTER_REPLY_SUCCESS"],
+            twitter_reply_message_invalid_format=environ[
+                "TWITTER_REPLY_INVALID_FORMAT"
+            ],
+            twitter_reply_message_invalid_signature=environ[
+                "TWITTER_REPLY_INVALID_SIGNATURE"
+            ],
+            verification_workers=int(environ.get("VERIFICATION_WORKERS", "0")),
+            verification_pool_min_tweets=int(
+                environ.get("VERIFICATION_POOL_MIN_TWEETS", "100")
+            ),
+            signature_backend=environ.get("SIGNATURE_BACKEND", "nacl"),
+            tweet_record_batch_size=int(
+                environ.get("TWEET_RECORD_BATCH_SIZE", "20")
+            ),
+            todo_tweets_limit=int(environ.get("TODO_TWEETS_LIMIT", "500")),
+            twitter_reply_limit=int(environ.get("TWITTER_REPLY_LIMIT", "300")),
+            twitter_reply_limit_window=int(
+                environ.get("TWITTER_REPLY_LIMIT_WINDOW", "10800")
+            ),
+            twitter_reply_max_attempts=int(
+                environ.get("TWITTER_REPLY_MAX_ATTEMPTS", "5")
+            ),
+            twitter_reply_retry_delay=float(
+                environ.get("TWITTER_REPLY_RETRY_DELAY", "60")
+            ),
+            retry_tweets_limit=int(environ.get("RETRY_TWEETS_LIMIT", "100")),
+            retry_max_attempts=int(environ.get("RETRY_MAX_ATTEMPTS", "5")),
+            retry_delay=float(environ.get("RETRY_DELAY", "60")),
+            function_timeout=float(environ.get("FUNCTION_TIMEOUT", "60")),
+            processing_lease=env_or_none(environ, "PROCESSING_LEASE", int),
+            lease_ttl=env_or_none(environ, "LEASE_TTL", float),
+            shard_count=int(environ.get("SHARD_COUNT", "1")),
+            shard_index=int(environ.get("SHARD_INDEX", "0")),
+            time_budget=env_or_none(environ, "TIME_BUDGET", float),
+            stream_queue_size=int(environ.get("STREAM_QUEUE_SIZE", "4")),
+            filter_stream_url=environ.get(
+                "FILTER_STREAM_URL",
+                "https://stream.twitter.com/1.1/statuses/filter.json",
+            ),
+            filter_stream_reconnect_delay=float(
+                environ.get("FILTER_STREAM_RECONNECT_DELAY", "5")
+            ),
+            filter_stream_max_reconnect_delay=float(
+                environ.get("FILTER_STREAM_MAX_RECONNECT_DELAY", "320")
+            ),
+        )
 
 
 class SMVError(Exception):
@@ -33,3 +204,11 @@ class TweetInvalidSignatureError(SMVError):
 
 class BlocklistPartyError(SMVError):
     pass
+
+
+class LeaseLostError(SMVError):
+    pass
+
+
+class FetchError(SMVError):
+    pass
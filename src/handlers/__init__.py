@@ -1,11 +1,16 @@
 from .parties import handle_parties
+from .process_replies import handle_process_replies, send_replies_after_run
 from .process_tweets import handle_process_tweets
 from .statistics import handle_statistics
+from .stream_tweets import run_filter_stream
 from .tweet import handle_tweet
 
 __all__ = [
     "handle_parties",
+    "handle_process_replies",
     "handle_process_tweets",
     "handle_statistics",
     "handle_tweet",
+    "run_filter_stream",
+    "send_replies_after_run",
 ]
@@ -1,12 +1,128 @@
+from typing import Any, Dict, Iterator, Optional
+from datetime import datetime, timezone
+import math
 import flask
+from flask import current_app as app
 from services.smv_storage import SMVStorage
+from services.gzip_response import accepts_gzip, gzip_response
+from services.json_stream import iter_json_array
+from services.parties_snapshot import PartiesSnapshot
 from services.onelog import onelog_json, OneLog
 
 
+@onelog_json
+def log_streamed_parties(parties_count: int, onelog: OneLog = None):
+    onelog.info(parties_count=parties_count)
+
+
+def count_streamed_parties(
+    parties: Iterator[Dict[str, Any]],
+) -> Iterator[Dict[str, Any]]:
+    """Logs number of parties once all have been sent"""
+    parties_count = 0
+    for party in parties:
+        parties_count += 1
+        yield party
+    log_streamed_parties(parties_count)
+
+
+def parse_since(since: str) -> Optional[datetime]:
+    """Parses `since` argument: seconds since the epoch, as
+    `last_modified` of parties. Returns None if invalid."""
+    try:
+        timestamp = float(since)
+    except ValueError:
+        return None
+    if not math.isfinite(timestamp) or timestamp < 0:
+        return None
+    try:
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        # out of range of datetime or of the platform
+        return None
+
+
+def parties_etag(last_modified: Optional[datetime], pretty: bool) -> str:
+    """ETag of parties: the last change of parties (in milliseconds) and
+    the format. Responses differing in encoding only are equivalent,
+    the ETag is weak."""
+    version = 0 if last_modified is None else last_modified.timestamp()
+    return f"{int(version * 1000)}-{'pretty' if pretty else 'compact'}"
+
+
 @onelog_json
 def handle_parties(
-    storage: SMVStorage, onelog: OneLog = None
+    storage: SMVStorage,
+    snapshot: PartiesSnapshot = None,
+    since: str = None,
+    onelog: OneLog = None,
 ) -> flask.Response:
-    parties = storage.get_parties()
-    onelog.info(parties_count=len(parties))
-    return flask.jsonify(parties)
+    """Returns parties formatted as by `flask.jsonify`: from the in-memory
+    snapshot if given, otherwise streamed as they are read from
+    the database, without building the whole list in memory.
+
+    With `since` (seconds since the epoch) returns only parties created,
+    changed or blocked after that time, for incremental sync: every party
+    has `removed` flag, removed parties (blocked, or pub keys replaced by
+    a new sign-up of the user) are to be removed. The newest
+    `last_modified` is `since` of the next request (parties modified in
+    the same second may be returned again).
+
+    Responses have ETag of the last change of parties, a request with
+    the same ETag in If-None-Match gets 304 Not Modified without a body.
+    Responses are compressed with gzip if the client accepts it.
+    """
+    request = flask.request
+    pretty = app.config["JSONIFY_PRETTYPRINT_REGULAR"] or app.debug
+    since_time = None
+    if since is not None:
+        onelog.info(since=since)
+        since_time = parse_since(since)
+        if since_time is None:
+            return (
+                flask.jsonify(
+                    {
+                        "status": "failed",
+                        "error": (
+                            "since argument must be seconds since the epoch"
+                        ),
+                    }
+                ),
+                400,
+            )
+
+    if snapshot is not None and since_time is None:
+        # ETag of the snapshot, a fresh one answers without the database
+        entry = snapshot.get(pretty=pretty)
+        last_modified = entry.last_modified
+    else:
+        entry = None
+        # before reading parties, so it is not newer than them
+        last_modified = storage.get_parties_last_modified()
+    etag = parties_etag(last_modified, pretty)
+
+    if request.if_none_match.contains_weak(etag):
+        onelog.info(not_modified=True)
+        response = app.response_class(status=304)
+        response.vary.add("Accept-Encoding")
+    elif entry is not None:
+        gzip = accepts_gzip(request)
+        body = entry.gzip_body() if gzip else entry.body
+        onelog.info(snapshot=True, response_size=len(body), gzip=gzip)
+        response = app.response_class(
+            body, mimetype=app.config["JSONIFY_MIMETYPE"]
+        )
+        if gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    else:
+        if since_time is not None:
+            parties = storage.iter_party_changes(since_time)
+        else:
+            parties = storage.iter_parties()
+        onelog.info(streamed=True)
+        response = app.response_class(
+            iter_json_array(count_streamed_parties(parties), pretty=pretty),
+            mimetype=app.config["JSONIFY_MIMETYPE"],
+        )
+    response.set_etag(etag, weak=True)
+    return gzip_response(request, response)
@@ -0,0 +1,128 @@
+import flask
+import traceback
+from typing import Any, Optional
+from datetime import datetime, timezone, timedelta
+from twython.exceptions import TwythonError, TwythonRateLimitError
+from services.twitter import TwitterClient, Tweet
+from services.smv_storage import SMVStorage
+from services.lease import Lease
+from common import SMVConfig
+from services.onelog import onelog_json, OneLog
+
+
+def next_reply_attempt(
+    config: SMVConfig, attempts: int, now: datetime
+) -> Optional[datetime]:
+    """Returns when to retry the reply after `attempts` failed attempts,
+    None if it should not be retried"""
+    if attempts >= config.twitter_reply_max_attempts:
+        return None
+    return now + timedelta(
+        seconds=config.twitter_reply_retry_delay * 2 ** (attempts - 1)
+    )
+
+
+@onelog_json
+def handle_process_replies(
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    onelog: OneLog = None,
+) -> flask.Response:
+    """Sends replies from the outbox.
+
+    Sends as many replies as fit into the reply rate limit:
+    `twitter_reply_limit` replies per `twitter_reply_limit_window` seconds,
+    the rest is left for the next run. Failed replies are retried later,
+    the tweet is not processed again.
+    """
+    # Only one run at a time, so replies are not sent twice
+    lease = Lease(storage, "process-replies", config.lease_ttl)
+    if not lease.acquire():
+        onelog.info(lease=lease.name, status="SKIP")
+        return flask.jsonify(
+            {"status": "skipped", "error": "Another run is in progress."}
+        )
+
+    now = datetime.utcnow().replace(tzinfo=timezone.utc)
+    sent_count = 0
+    failed_count = 0
+    try:
+        window_sent_count = storage.get_sent_reply_count(
+            since=now - timedelta(seconds=config.twitter_reply_limit_window)
+        )
+        budget = config.twitter_reply_limit - window_sent_count
+        onelog.info(reply_budget=max(budget, 0))
+
+        for item in storage.get_pending_replies(limit=budget):
+            tweet = Tweet(
+                tweet_id=item["tweet_id"],
+                user_id=item["user_id"],
+                user_screen_name=item["screen_name"],
+                full_text=item["text"],
+            )
+            try:
+                twclient.reply(item["message"], tweet)
+            except TwythonRateLimitError as err:
+                # not an attempt, try again in the next run
+                onelog.info(rate_limited=True, error=str(err))
+                break
+            except TwythonError as err:
+                attempts = item["attempts"] + 1
+                storage.mark_reply_failed(
+                    tweet.tweet_id,
+                    str(err),
+                    next_reply_attempt(config, attempts, now),
+                )
+                failed_count += 1
+                continue
+
+            storage.mark_reply_sent(tweet.tweet_id)
+            sent_count += 1
+            if twclient.rate_limit_remaining() == 0:
+                onelog.info(rate_limited=True)
+                break
+
+        onelog.info(sent_count=sent_count, failed_count=failed_count)
+    except Exception as err:
+        onelog.info(
+            sent_count=sent_count,
+            failed_count=failed_count,
+            error=str(err),
+            status="FAILED",
+        )
+        traceback.print_exc()
+        print(err)
+        return flask.jsonify({"status": "failed", "error": str(err)}), 500
+    finally:
+        lease.release()
+
+    return flask.jsonify(
+        {"status": "success", "sent": sent_count, "failed": failed_count}
+    )
+
+
+def send_replies_after_run(
+    rv: Any,
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+) -> Any:
+    """Sends pending replies after a `/process-tweets` run, so replies are
+    sent on its schedule. Not if the run has used up its time budget
+    (tweets remaining), the next run sends them. Failure to send them does
+    not fail the run, it is logged only.
+
+    Returns:
+        Response of the `/process-tweets` run
+    """
+    response = rv[0] if isinstance(rv, tuple) else rv
+    if not response.get_json().get("remaining_count"):
+        try:
+            handle_process_replies(
+                storage=storage, twclient=twclient, config=config
+            )
+        except Exception:
+            # e.g. the lease not acquired, logged by `handle_process_replies`
+            traceback.print_exc()
+    return rv
@@ -1,74 +1,480 @@
-from typing import Tuple
-import ed25519
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 import hashlib
 import base64
 import flask
 import traceback
 import re
-import time
+from timeit import default_timer as timer
+from twython.exceptions import TwythonRateLimitError
 from services.twitter import TwitterClient, Tweet
 from services.smv_storage import SMVStorage
+from services.verification_cache import VerificationCache
+from services.lease import Lease
+from services.prefetch import Prefetcher
+from services.verifier import (
+    DEFAULT_VERIFIER,
+    SignatureVerifier,
+    get_verifier,
+    is_strict_signature,
+)
 from common import (
     SMVConfig,
     TweetInvalidFormatError,
     TweetInvalidSignatureError,
     BlocklistPartyError,
+    LeaseLostError,
+    FetchError,
 )
 from services.onelog import onelog_json, OneLog
 
+# A signature check: (hex pubkey, message digest, base64 signature)
+SignatureEntry = Tuple[str, bytes, str]
+
+# Twitter API sources of new tweets, each with its own ingestion cursor
+INGESTION_SOURCES = ["search", "mentions"]
+
+
+def message_digest(msg: str) -> bytes:
+    s = hashlib.sha3_256()
+    s.update(bytes(msg, "UTF-8"))
+    return s.digest()
+
+
+# Message variants a user could have signed, by name: (prefix, case, suffix)
+# Check different cases:
+# - start with @ or without
+# - end with whitespace
+# - handle upper and lowercase
+SIGNATURE_VARIANTS: Dict[str, Tuple[str, str, str]] = {
+    f"{prefix}{case}{suffix_name}": (prefix, case, suffix)
+    for suffix, suffix_name in [
+        ("", ""),
+        (" ", "+space"),
+        ("\n", "+LF"),
+        ("\r\n", "+CRLF"),
+        ("\t", "+tab"),
+    ]
+    for case in ["handle", "lower", "upper"]
+    for prefix in ["@", ""]
+}
+
+
+def order_signature_variants(variant_counts: Dict[str, int]) -> List[str]:
+    """Orders message variants from the most often matched one.
+
+    Args:
+        variant_counts (dict): Number of sign-ups matched per variant name
+
+    Returns:
+        List of variant names, variants never matched keep default order
+    """
+    return sorted(
+        SIGNATURE_VARIANTS,
+        key=lambda name: -variant_counts.get(name, 0),
+    )
+
+
+@lru_cache(maxsize=4096)
+def candidate_digests(twitter_handle: str) -> Dict[str, bytes]:
+    """Digests of all messages a user could have signed.
 
-def is_sig_valid(sig, msg, pub_key):
+    Args:
+        twitter_handle (str): User's twitter handle (without @)
+
+    Returns:
+        SHA3-256 digest per variant name (see `SIGNATURE_VARIANTS`)
+    """
+    handles = {
+        "handle": twitter_handle,
+        "lower": twitter_handle.lower(),
+        "upper": twitter_handle.upper(),
+    }
+    return {
+        name: message_digest(f"{prefix}{handles[case]}{suffix}")
+        for name, (prefix, case, suffix) in SIGNATURE_VARIANTS.items()
+    }
+
+
+def load_signature(
+    sig: str, pub_key: str, verifier: SignatureVerifier = None
+) -> Optional[Tuple[Any, bytes]]:
+    """Decodes hex pubkey and base64 signature.
+
+    Returns:
+        (verifier's key, signature bytes) or None if any of them is malformed
+    """
+    if verifier is None:
+        verifier = get_verifier()
     try:
-        verifying_key = ed25519.VerifyingKey(bytes.fromhex(pub_key))
-        s = hashlib.sha3_256()
-        s.update(bytes(msg, "UTF-8"))
-        msg = s.digest()
+        pub_key_bytes = bytes.fromhex(pub_key)
         bytesig = base64.b64decode(sig)
-        verifying_key.verify(bytesig, msg)
-        return True
-    except (ed25519.BadSignatureError, Exception):
+    except Exception:
+        return None
+    if not is_strict_signature(pub_key_bytes, bytesig):
+        return None
+    verifying_key = verifier.load_key(pub_key_bytes)
+    if verifying_key is None:
+        return None
+    return verifying_key, bytesig
+
+
+def is_loaded_sig_valid(
+    verifying_key: Any,
+    bytesig: bytes,
+    digest: bytes,
+    verifier: SignatureVerifier = None,
+) -> bool:
+    if verifier is None:
+        verifier = get_verifier()
+    return verifier.verify(verifying_key, bytesig, digest)
+
+
+def is_digest_sig_valid(
+    sig: str, digest: bytes, pub_key: str, verifier: SignatureVerifier = None
+) -> bool:
+    loaded = load_signature(sig, pub_key, verifier)
+    if loaded is None:
         return False
-    return False
+    return is_loaded_sig_valid(*loaded, digest, verifier)
 
 
-def parse_tweet_message(msg: str, twitter_handle: str) -> Tuple[str, str]:
-    # Twitter handle starts with @, so .* is ok
-    # Twitter handle allowed characters are alphanumeric and underscore
-    if not re.search(fr"(^|.*){twitter_handle}([^a-zA-Z0-9_]|$)", msg):
-        raise TweetInvalidFormatError("Missing twitter handle.")
+def is_sig_valid(sig, msg, pub_key, verifier: SignatureVerifier = None):
+    return is_digest_sig_valid(sig, message_digest(msg), pub_key, verifier)
+
+
+class TweetParser(object):
+    """Extracts pubkey and signature from sign-up tweets.
+
+    Patterns are compiled once per twitter handle (see `get_tweet_parser`),
+    and the tweet is scanned once for all: the handle, pubkey and signature.
+    """
 
     # pubkey is a hex value
-    m = re.search(r"(^|[^0-9a-fA-F])([0-9a-fA-F]{64,64})([^0-9a-fA-F]|$)", msg)
-    if not m:
-        raise TweetInvalidFormatError("Missing pubkey.")
-    pubkey = m.group(2)
-
-    # Signature is alphanumeric and forward-slash and plus characters.
-    # It ends with double equal sign.
-    m = re.search(r"(^|[^a-zA-Z0-9/+])([a-zA-Z0-9/+]{60,}==)(.*|$)", msg)
-    if not m:
-        raise TweetInvalidFormatError("Missing signature.")
-    sig = m.group(2)
-
-    return pubkey, sig
-
-
-def validate_signature(pubkey: str, signed_message: str, twitter_handle: str):
-    # Check different cases:
-    # - start with @ or without
-    # - end with whitespace
-    # - handle upper and lowercase
-    for whitechar in ["", " ", "\n", "\r\n", "\t"]:
-        for handle in set(
-            [twitter_handle, twitter_handle.upper(), twitter_handle.lower()]
-        ):
-            for prefix in ["", "@"]:
-                msg = f"{prefix}{handle}{whitechar}"
-                if is_sig_valid(sig=signed_message, msg=msg, pub_key=pubkey):
-                    return
+    _PUBKEY = re.compile(r"(?<![0-9a-fA-F])[0-9a-fA-F]{64}(?![0-9a-fA-F])")
+
+    def __init__(self, twitter_handle: str) -> None:
+        self.twitter_handle = twitter_handle
+        self._scanner = re.compile(
+            # Twitter handle allowed characters are alphanumeric and
+            # underscore. Lookahead only, so it does not consume
+            # characters a signature can start with.
+            rf"(?P<handle>(?={re.escape(twitter_handle)}(?![a-zA-Z0-9_])))"
+            # Signature is alphanumeric and forward-slash and plus
+            # characters. It ends with double equal sign.
+            # Hex is a subset of these characters, so pubkey is always
+            # inside a run of at least 64 such characters.
+            r"|(?<![a-zA-Z0-9/+])(?P<token>[a-zA-Z0-9/+]{60,})(?P<eq>==)?"
+        )
+
+    def parse(self, msg: str) -> Tuple[str, str]:
+        has_handle = False
+        pubkey = None
+        sig = None
+        for m in self._scanner.finditer(msg):
+            token = m.group("token")
+            if token is None:
+                has_handle = True
+            else:
+                if pubkey is None and len(token) >= 64:
+                    pubkey_match = self._PUBKEY.search(token)
+                    if pubkey_match:
+                        pubkey = pubkey_match.group()
+                if sig is None and m.group("eq"):
+                    sig = f"{token}=="
+            if has_handle and pubkey and sig:
+                break
+
+        if not has_handle:
+            raise TweetInvalidFormatError("Missing twitter handle.")
+        if not pubkey:
+            raise TweetInvalidFormatError("Missing pubkey.")
+        if not sig:
+            raise TweetInvalidFormatError("Missing signature.")
+        return pubkey, sig
+
+
+@lru_cache(maxsize=64)
+def get_tweet_parser(twitter_handle: str) -> TweetParser:
+    return TweetParser(twitter_handle)
+
+
+def parse_tweet_message(msg: str, twitter_handle: str) -> Tuple[str, str]:
+    return get_tweet_parser(twitter_handle).parse(msg)
+
+
+def validate_signature(
+    pubkey: str,
+    signed_message: str,
+    twitter_handle: str,
+    variants: List[str] = None,
+    verifier: SignatureVerifier = None,
+) -> str:
+    """Checks signature against all message variants of the handle.
+
+    Args:
+        pubkey (str): Hex public key
+        signed_message (str): Base64 signature
+        twitter_handle (str): User's twitter handle (without @)
+        variants (list): Order in which to try variant names,
+            default order if not provided
+        verifier (SignatureVerifier): Crypto backend, default if not provided
+
+    Returns:
+        Name of the matched variant
+
+    Raises:
+        TweetInvalidSignatureError: If none of the variants match.
+    """
+    # Key and signature are decoded once, every distinct message is checked
+    # once
+    if verifier is None:
+        verifier = get_verifier()
+    loaded = load_signature(signed_message, pubkey, verifier)
+    if loaded is not None:
+        verifying_key, bytesig = loaded
+        digests = candidate_digests(twitter_handle)
+        checked = set()
+        for name in variants or SIGNATURE_VARIANTS:
+            digest = digests[name]
+            if digest in checked:
+                continue
+            checked.add(digest)
+            if verifier.verify(verifying_key, bytesig, digest):
+                return name
     raise TweetInvalidSignatureError("Invalid signature")
 
 
+# Pool of processes verifying signatures: (number of workers, pool),
+# created once per process, see `get_verification_pool`
+_verification_pool: Optional[Tuple[int, ProcessPoolExecutor]] = None
+
+
+def get_verification_pool(workers: int) -> ProcessPoolExecutor:
+    """Returns pool of `workers` processes verifying signatures. The pool
+    is created on first use and reused by the next runs, so processes are
+    not started for every run."""
+    global _verification_pool
+    if _verification_pool is None or _verification_pool[0] != workers:
+        shutdown_verification_pool()
+        _verification_pool = (workers, ProcessPoolExecutor(workers))
+    return _verification_pool[1]
+
+
+def shutdown_verification_pool():
+    """Stops worker processes, the next run starts a new pool"""
+    global _verification_pool
+    if _verification_pool is not None:
+        _verification_pool[1].shutdown(wait=False)
+        _verification_pool = None
+
+
+def verify_tweet_signatures(
+    tweets: List[Tuple[str, str, str]],
+    variants: List[str],
+    verifier_name: str = DEFAULT_VERIFIER,
+) -> List[Optional[Tuple[str, str, Optional[str]]]]:
+    """Parses tweets and validates their signatures.
+
+    Note: It is a top-level function, so it can run in a worker process.
+
+    Args:
+        tweets (list): (tweet text, user's twitter handle, twitter handle
+            the tweet must contain)
+        variants (list): Order in which to try message variant names
+        verifier_name (str): Crypto backend name (see `get_verifier`)
+
+    Returns:
+        List with one item per tweet: None if tweet has invalid format,
+        otherwise (pubkey, signed message, matched variant or None)
+    """
+    verifier = get_verifier(verifier_name)
+    results = []
+    for text, screen_name, twitter_handle in tweets:
+        try:
+            pubkey, signed_message = parse_tweet_message(text, twitter_handle)
+        except TweetInvalidFormatError:
+            results.append(None)
+            continue
+        try:
+            variant = validate_signature(
+                pubkey, signed_message, screen_name, variants, verifier
+            )
+        except TweetInvalidSignatureError:
+            variant = None
+        results.append((pubkey, signed_message, variant))
+    return results
+
+
+class SignatureBatch(object):
+    """Verifies signatures of a whole processing run together.
+
+    None of the crypto backends provides batch ed25519 verification (and
+    one built from libsodium point operations is slower than verifying
+    signatures one by one), so signatures are verified one by one.
+
+    Message variants are tried from the most often matched one (see
+    `order_signature_variants`). Only the first variant is checked in the
+    batch. Sign-ups that fail it fall back to `validate_signature`, which
+    tries all the other variants, so results are exactly the same as
+    verifying tweets one by one.
+
+    With a process pool, tweets are parsed and fully verified in worker
+    processes instead.
+
+    With a cache, sign-ups verified before (e.g. reposted tweets) are not
+    verified again.
+
+    Matched variants are counted in `variant_hits`.
+    """
+
+    def __init__(
+        self,
+        variant_counts: Dict[str, int] = None,
+        verifier: SignatureVerifier = None,
+        cache: VerificationCache = None,
+    ) -> None:
+        self.variants = order_signature_variants(variant_counts or {})
+        self.variant_hits = Counter()
+        self.verifier = verifier or get_verifier()
+        self.cache = cache
+        self._tweets: List[Tuple[str, str, str]] = []
+        self._entries: Dict[Tuple[str, str, str], SignatureEntry] = {}
+        # (pubkey, signed message, handle) -> matched variant or None
+        self._verified: Dict[Tuple[str, str, str], Optional[str]] = {}
+        self._failed = set()
+
+    def add(self, pubkey: str, signed_message: str, twitter_handle: str):
+        key = (pubkey, signed_message, twitter_handle)
+        if key not in self._entries:
+            self._entries[key] = (
+                pubkey,
+                candidate_digests(twitter_handle)[self.variants[0]],
+                signed_message,
+            )
+
+    def add_tweet(self, tweet: Tweet, twitter_handle: str):
+        self._tweets.append(
+            (tweet.full_text, tweet.user_screen_name, twitter_handle)
+        )
+
+    def verify(self, pool: Executor = None, chunk_size: int = 20) -> int:
+        """Verifies all added signatures.
+
+        Args:
+            pool (Executor): Optional process pool to verify tweets in
+            chunk_size (int): Number of tweets sent to a worker at once
+
+        Returns:
+            Number of valid signatures
+        """
+        tweets, self._tweets = self._tweets, []
+        if self.cache is not None and tweets:
+            tweets = self._verify_from_cache(tweets)
+        if pool is not None and tweets:
+            chunks = []
+            for start in range(0, len(tweets), chunk_size):
+                end = start + chunk_size
+                chunks.append(tweets[start:end])
+            for chunk, results in zip(
+                chunks,
+                pool.map(
+                    verify_tweet_signatures,
+                    chunks,
+                    [self.variants] * len(chunks),
+                    [self.verifier.name] * len(chunks),
+                ),
+            ):
+                for (_, screen_name, _), result in zip(chunk, results):
+                    if result is not None:
+                        pubkey, signed_message, variant = result
+                        self._set_verified(
+                            (pubkey, signed_message, screen_name), variant
+                        )
+        else:
+            for text, screen_name, twitter_handle in tweets:
+                try:
+                    pubkey, signed_message = parse_tweet_message(
+                        text, twitter_handle
+                    )
+                except TweetInvalidFormatError:
+                    continue
+                self.add(pubkey, signed_message, screen_name)
+
+        entries, self._entries = self._entries, {}
+        for key, (pubkey, digest, sig) in entries.items():
+            if is_digest_sig_valid(sig, digest, pubkey, self.verifier):
+                self._set_verified(key, self.variants[0])
+            else:
+                self._failed.add(key)
+
+        return len([v for v in self._verified.values() if v is not None])
+
+    def _set_verified(self, key: Tuple[str, str, str], variant: Optional[str]):
+        self._verified[key] = variant
+        if self.cache is not None:
+            self.cache.put(key, variant)
+
+    def _verify_from_cache(
+        self, tweets: List[Tuple[str, str, str]]
+    ) -> List[Tuple[str, str, str]]:
+        """Takes results from the cache.
+
+        Returns:
+            Tweets not found in the cache
+        """
+        keys = {}
+        for tweet in tweets:
+            text, screen_name, twitter_handle = tweet
+            try:
+                pubkey, signed_message = parse_tweet_message(
+                    text, twitter_handle
+                )
+            except TweetInvalidFormatError:
+                continue
+            keys[tweet] = (pubkey, signed_message, screen_name)
+        cached = self.cache.get_many(keys.values())
+        self._verified.update(cached)
+        return [
+            tweet
+            for tweet in tweets
+            if tweet in keys and keys[tweet] not in cached
+        ]
+
+    def validate_signature(
+        self, pubkey: str, signed_message: str, twitter_handle: str
+    ) -> str:
+        key = (pubkey, signed_message, twitter_handle)
+        if key in self._verified:
+            variant = self._verified[key]
+            if variant is None:
+                raise TweetInvalidSignatureError("Invalid signature")
+        else:
+            try:
+                # the first variant has already failed in the batch
+                variant = validate_signature(
+                    pubkey,
+                    signed_message,
+                    twitter_handle,
+                    (
+                        self.variants[1:]
+                        if key in self._failed
+                        else self.variants
+                    ),
+                    self.verifier,
+                )
+            except TweetInvalidSignatureError:
+                self._set_verified(key, None)
+                raise
+            self._set_verified(key, variant)
+        self.variant_hits[variant] += 1
+        return variant
+
+
 @onelog_json
 def process_tweet(
     tweet: Tweet,
@@ -77,6 +483,8 @@ def process_tweet(
     config: SMVConfig,
     tweet_prefix: str,
     twitter_handle: str,  # starts with @ character
+    signature_batch: SignatureBatch = None,
+    check_processed: bool = True,
     onelog: OneLog = None,
 ):
     onelog.info(
@@ -87,7 +495,11 @@ def process_tweet(
         twitter_handle=twitter_handle,
     )
 
-    if storage.get_tweet_record(tweet.tweet_id) is not None:
+    # check_processed=False: caller has already dropped processed tweets
+    if (
+        check_processed
+        and storage.get_tweet_record(tweet.tweet_id) is not None
+    ):
         onelog.info(tweet_processed=True, status="SKIP")
     else:
         storage.upsert_tweet_record(
@@ -102,7 +514,12 @@ def process_tweet(
                 tweet.full_text, twitter_handle
             )
             onelog.info(pubkey=pubkey, signed_message=signed_message)
-            validate_signature(
+            validate = (
+                signature_batch.validate_signature
+                if signature_batch
+                else validate_signature
+            )
+            validate(
                 pubkey,
                 signed_message,
                 twitter_handle=tweet.user_screen_name,
@@ -133,11 +550,13 @@ def process_tweet(
             )
         except TweetInvalidSignatureError:
             onelog.info(error="Invalid Signature", status="FAILED")
-            # reply on twitter
-            time.sleep(config.twitter_reply_delay)
-            twclient.reply(
-                config.twitter_reply_message_invalid_signature,
-                tweet,
+            # reply on twitter (sent by `/process-replies`)
+            storage.enqueue_reply(
+                tweet_id=tweet.tweet_id,
+                user_id=tweet.user_id,
+                screen_name=tweet.user_screen_name,
+                text=tweet.full_text,
+                message=config.twitter_reply_message_invalid_signature,
             )
             # update DB
             storage.upsert_tweet_record(
@@ -158,30 +577,514 @@ def process_tweet(
             )
 
 
+def next_retry_attempt(
+    config: SMVConfig, attempts: int, now: datetime = None
+) -> Optional[datetime]:
+    """Returns when to process the tweet again after `attempts` failed
+    attempts, None if it should not be retried"""
+    if attempts >= config.retry_max_attempts:
+        return None
+    if now is None:
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+    return now + timedelta(seconds=config.retry_delay * 2 ** (attempts - 1))
+
+
+def retry_tweet(
+    storage: SMVStorage,
+    config: SMVConfig,
+    tweet_id: int,
+    attempts: int,
+    error: str,
+    user_id: int = None,
+) -> bool:
+    """Schedules processing of a failed tweet again (by the shard of
+    `user_id`).
+
+    Returns:
+        True if the tweet is not going to be retried (dead letter)
+    """
+    next_attempt = next_retry_attempt(config, attempts)
+    status = "RETRY" if next_attempt else "DEAD_LETTER"
+    storage.upsert_retry_tweet(
+        tweet_id, attempts, error, next_attempt, user_id=user_id
+    )
+    storage.upsert_tweet_record(
+        tweet_id=tweet_id,
+        status=status,
+        description=error,
+    )
+    return next_attempt is None
+
+
+def requeue_stale_tweets(storage: SMVStorage, config: SMVConfig) -> int:
+    """Moves tweets which processing has been interrupted (left in
+    PROCESSING status for longer than `config.processing_lease`) to the
+    retry queue.
+
+    Returns:
+        Number of re-queued tweets
+    """
+    older_than = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(
+        seconds=config.processing_lease
+    )
+    stale_tweets = storage.get_stale_processing_tweets(
+        older_than, limit=config.retry_tweets_limit, shard=config_shard(config)
+    )
+    attempts = storage.get_retry_attempts(list(stale_tweets))
+    for tweet_id, user_id in stale_tweets.items():
+        retry_tweet(
+            storage,
+            config,
+            tweet_id,
+            attempts.get(tweet_id, 0) + 1,
+            "Processing not finished",
+            user_id=user_id,
+        )
+    return len(stale_tweets)
+
+
+def config_shard(config: SMVConfig) -> Tuple[int, int]:
+    """Returns (shard count, shard index) of this instance"""
+    return (config.shard_count, config.shard_index)
+
+
+def tweet_shard(tweet: Tweet, shard_count: int) -> int:
+    """Returns index of the shard processing the tweet"""
+    return tweet.user_id % shard_count
+
+
+def ingest_pages(
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    twitter_search_text: str,
+    onelog: OneLog,
+) -> Iterator[List[Tweet]]:
+    """Fetches new tweets from Twitter API into inboxes of shards.
+
+    Every source (search, mentions) has its own cursor. Pages are fetched
+    from newest to oldest, the cursor is advanced after each page has been
+    stored, so an interrupted pagination continues with the next page.
+    Sources are fetched concurrently, at most `stream_queue_size` pages
+    ahead of storing.
+
+    Returns:
+        Iterator with stored pages of Tweets
+    """
+    sources = []
+    for source in INGESTION_SOURCES:
+        cursor = storage.get_ingestion_cursor(source)
+        if "since_id" not in cursor:
+            # start after tweets processed before cursors were introduced
+            storage.advance_ingestion_cursor(
+                source, storage.get_last_tweet_id()
+            )
+            cursor = storage.get_ingestion_cursor(source)
+        since_tweet_id = cursor["since_id"]
+        max_tweet_id = cursor.get("max_id")
+        onelog.info(
+            **{
+                f"{source}_since_tweet_id": since_tweet_id,
+                f"{source}_max_tweet_id": max_tweet_id,
+            }
+        )
+        if source == "search":
+            pages = twclient.search_pages(
+                twitter_search_text, since_tweet_id, max_tweet_id
+            )
+        else:
+            pages = twclient.mentions_pages(since_tweet_id, max_tweet_id)
+        sources.append((source, cursor.get("next_since_id"), pages))
+
+    # Sources are fetched concurrently, and stored one after another
+    prefetchers = [
+        Prefetcher(pages, config.stream_queue_size) for _, _, pages in sources
+    ]
+    try:
+        for (source, newest_tweet_id, _), pages in zip(sources, prefetchers):
+            try:
+                for page in pages:
+                    storage.add_inbox_tweets(
+                        [
+                            inbox_item(
+                                twt, tweet_shard(twt, config.shard_count)
+                            )
+                            for twt in page
+                        ]
+                    )
+                    page_tweet_ids = [twt.tweet_id for twt in page]
+                    newest_tweet_id = max(
+                        filter(None, [newest_tweet_id, *page_tweet_ids])
+                    )
+                    storage.save_ingestion_page(
+                        source, min(page_tweet_ids) - 1, newest_tweet_id
+                    )
+                    yield page
+            except TwythonRateLimitError as err:
+                # the next run continues with the next page
+                onelog.info(**{f"{source}_error": str(err)})
+                continue
+
+            storage.advance_ingestion_cursor(source, newest_tweet_id)
+    finally:
+        for pages in prefetchers:
+            pages.close()
+
+
+def ingest_tweets(
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    twitter_search_text: str,
+    onelog: OneLog,
+) -> int:
+    """Fetches all new tweets from Twitter API into inboxes of shards.
+
+    Returns:
+        Number of fetched tweets
+    """
+    return sum(
+        len(page)
+        for page in ingest_pages(
+            storage, twclient, config, twitter_search_text, onelog
+        )
+    )
+
+
+def fetch_tweets(
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    twitter_search_text: str,
+    onelog: OneLog,
+) -> Tuple[List[Tweet], List[int]]:
+    """Returns new tweets of this shard.
+
+    Shard 0 fetches new tweets from Twitter API into inboxes of shards
+    first. Tweets are then read from the inbox of the shard (oldest first).
+
+    Returns:
+        Tweets and ids of tweets read from the inbox
+    """
+    if config.shard_index == 0:
+        onelog.info(
+            ingested_count=ingest_tweets(
+                storage, twclient, config, twitter_search_text, onelog
+            )
+        )
+    tweets = read_inbox(storage, config.shard_index)
+    onelog.info(inbox_count=len(tweets))
+    return tweets, [twt.tweet_id for twt in tweets]
+
+
+def read_inbox(storage: SMVStorage, shard_index: int) -> List[Tweet]:
+    """Returns tweets waiting in the inbox of the shard, oldest first"""
+    return [
+        Tweet(
+            tweet_id=item["tweet_id"],
+            user_id=item["user_id"],
+            user_screen_name=item["screen_name"],
+            full_text=item["text"],
+        )
+        for item in storage.get_inbox_tweets(shard_index)
+    ]
+
+
+def inbox_item(tweet: Tweet, shard_index: int) -> Dict[str, Any]:
+    return {
+        "tweet_id": tweet.tweet_id,
+        "user_id": tweet.user_id,
+        "screen_name": tweet.user_screen_name,
+        "text": tweet.full_text,
+        "shard": shard_index,
+    }
+
+
+def processing_lease_name(config: SMVConfig) -> str:
+    if config.shard_count > 1:
+        return f"process-tweets-{config.shard_index}-of-{config.shard_count}"
+    return "process-tweets"
+
+
+class TweetProcessor(object):
+    """Processes tweets of one run, keeps its counters and time budget.
+
+    Tweets are processed one by one from oldest to newest.
+    Tweet records are written in bulk: `PROCESSING` status of the next
+    `tweet_record_batch_size` tweets together with final statuses of the
+    previous ones. If the process is killed, at most one batch of tweets
+    is left in `PROCESSING` status.
+    A tweet failed with an unexpected error is retried later, the rest of
+    tweets is processed.
+    Processing stops before a batch that would likely not fit into the
+    time budget (the first batch is always processed).
+    A processor can be reused for several runs (e.g. by the stream), see
+    `start`.
+    """
+
+    def __init__(
+        self,
+        storage: SMVStorage,
+        twclient: TwitterClient,
+        config: SMVConfig,
+        lease: Lease,
+        verification_cache: VerificationCache,
+        twitter_search_text: str,
+        onelog: OneLog,
+    ) -> None:
+        self.storage = storage
+        self.twclient = twclient
+        self.config = config
+        self.verification_cache = verification_cache
+        self.twitter_search_text = twitter_search_text
+        self.start(lease, onelog)
+        self.variant_counts = storage.get_signature_variant_counts()
+        variants = order_signature_variants(self.variant_counts)
+        onelog.info(signature_variants=variants[:3])
+
+    def start(self, lease: Lease, onelog: OneLog):
+        """Starts a run: counters and time budget start again, signature
+        variant counts are kept (with matches of previous runs)"""
+        self.lease = lease
+        self.onelog = onelog
+        self.start_time = timer()
+        self.batch_time = 0.0
+        self.batch_count = 0
+        # retry attempts of retried tweets
+        self.retry_attempts: Dict[int, int] = {}
+        self.done_retry_tweet_ids: List[int] = []
+        self.processed_before_count = 0
+        self.new_count = 0
+        self.verified_count = 0
+        self.processed_count = 0
+        self.failed_count = 0
+        self.dead_letter_count = 0
+        self.out_of_time = False
+
+    def retry(
+        self,
+        tweet_id: int,
+        error: str,
+        user_id: int = None,
+        storage: SMVStorage = None,
+    ):
+        """Schedules the tweet to be retried, its record is written by
+        `storage` (e.g. the run's buffer), by default immediately"""
+        self.failed_count += 1
+        self.dead_letter_count += retry_tweet(
+            storage or self.storage,
+            self.config,
+            tweet_id,
+            self.retry_attempts.get(tweet_id, 0) + 1,
+            error,
+            user_id=user_id,
+        )
+
+    def process(self, tweets: List[Tweet]) -> List[Tweet]:
+        """Processes tweets which have not been processed before.
+
+        Returns:
+            Not started tweets (out of time budget)
+        """
+        storage = self.storage
+        config = self.config
+        twitter_handle = f"@{self.twclient.account_name}"
+
+        # Drop duplicates and already processed tweets (in one query)
+        unique_tweets: Dict[int, Tweet] = {}
+        for twt in tweets:
+            unique_tweets.setdefault(twt.tweet_id, twt)
+        processed_tweet_ids = storage.get_processed_tweet_ids(
+            list(unique_tweets.keys())
+        )
+        tweets = [
+            twt
+            for twt in unique_tweets.values()
+            if twt.tweet_id not in processed_tweet_ids
+        ]
+        self.processed_before_count += len(processed_tweet_ids)
+        self.new_count += len(tweets)
+        self.onelog.info(
+            processed_before_count=self.processed_before_count,
+            new_count=self.new_count,
+        )
+        # retried tweets processed in the meantime
+        self.done_retry_tweet_ids.extend(
+            tweet_id
+            for tweet_id in self.retry_attempts
+            if tweet_id in processed_tweet_ids
+        )
+
+        # Signatures are verified together, a chunk of batches at a time
+        # (one batch per worker), as part of the batch the chunk starts
+        # with, so verification is charged to the time budget
+        signature_batch = SignatureBatch(
+            self.variant_counts,
+            verifier=get_verifier(config.signature_backend),
+            cache=self.verification_cache,
+        )
+        batch_size = max(1, config.tweet_record_batch_size)
+        pool = None
+        verify_size = batch_size
+        if config.verification_workers > 0 and len(tweets) >= max(
+            2, config.verification_pool_min_tweets
+        ):
+            pool = get_verification_pool(config.verification_workers)
+            verify_size = batch_size * config.verification_workers
+        verified_before_count = self.verified_count
+        verified_end = 0
+
+        tweets.sort(key=lambda twt: twt.tweet_id)
+        started_count = 0
+        try:
+            with storage.buffer_tweet_records() as records:
+                for start in range(0, len(tweets), batch_size):
+                    end = start + batch_size
+                    batch_start_time = timer()
+                    if (
+                        self.batch_count > 0
+                        and config.time_budget > 0
+                        and batch_start_time
+                        + self.batch_time
+                        - self.start_time
+                        > config.time_budget
+                    ):
+                        self.out_of_time = True
+                        return tweets[start:]
+                    self.batch_count += 1
+                    # stop if another run has taken over
+                    self.lease.renew()
+                    if start >= verified_end:
+                        verified_end = start + verify_size
+                        for twt in tweets[start:verified_end]:
+                            signature_batch.add_tweet(twt, twitter_handle)
+                        try:
+                            self.verified_count = (
+                                verified_before_count
+                                + signature_batch.verify(
+                                    pool, chunk_size=batch_size
+                                )
+                            )
+                        except BrokenProcessPool:
+                            # e.g. a worker killed, the next run starts a
+                            # new pool
+                            shutdown_verification_pool()
+                            raise
+                        self.onelog.info(
+                            batch_verified_count=self.verified_count
+                        )
+                    for twt in tweets[start:end]:
+                        records.upsert_tweet_record(
+                            tweet_id=twt.tweet_id,
+                            user_id=twt.user_id,
+                            screen_name=twt.user_screen_name,
+                            text=twt.full_text,
+                            status="PROCESSING",
+                        )
+                    records.flush_tweet_records()
+                    for twt in tweets[start:end]:
+                        started_count += 1
+                        try:
+                            process_tweet(
+                                twt,
+                                records,
+                                self.twclient,
+                                config,
+                                tweet_prefix=self.twitter_search_text,
+                                twitter_handle=twitter_handle,
+                                signature_batch=signature_batch,
+                                check_processed=False,
+                            )
+                        except Exception as err:
+                            traceback.print_exc()
+                            self.retry(
+                                twt.tweet_id, str(err), twt.user_id, records
+                            )
+                            continue
+                        self.processed_count += 1
+                        if twt.tweet_id in self.retry_attempts:
+                            self.done_retry_tweet_ids.append(twt.tweet_id)
+                    self.batch_time = max(
+                        self.batch_time, timer() - batch_start_time
+                    )
+        except LeaseLostError:
+            # not started tweets are processed by the current lease holder
+            raise
+        except Exception:
+            # not started tweets will be fetched again
+            storage.remove_processing_tweet_records(
+                [twt.tweet_id for twt in tweets[started_count:]]
+            )
+            raise
+        finally:
+            storage.increment_signature_variant_counts(
+                signature_batch.variant_hits
+            )
+            # the next run of a reused processor tries them in this order
+            for variant, hits in signature_batch.variant_hits.items():
+                self.variant_counts[variant] = (
+                    self.variant_counts.get(variant, 0) + hits
+                )
+        return []
+
+
 @onelog_json
 def handle_process_tweets(
     storage: SMVStorage,
     twclient: TwitterClient,
     config: SMVConfig,
+    verification_cache: VerificationCache = None,
     onelog: OneLog = None,
 ):
-    # Fetch all tweets from Twitter API
+    # Only one run (per shard) at a time
+    lease = Lease(storage, processing_lease_name(config), config.lease_ttl)
+    if not lease.acquire():
+        onelog.info(lease=lease.name, status="SKIP")
+        return flask.jsonify(
+            {"status": "skipped", "error": "Another run is in progress."}
+        )
+    onelog.info(lease=lease.name, lease_token=lease.token)
     try:
-        # twitter_search_text = (
-        #    f"{config.twitter_search_text} @{twclient.account_name}"
-        # )
-        twitter_search_text = f"@{twclient.account_name}"
-        onelog.info(twitter_search_text=twitter_search_text)
-        since_tweet_id = storage.get_last_tweet_id()
-        onelog.info(since_tweet_id=since_tweet_id)
-        tweets = list(
-            twclient.get_tweets(
-                twitter_search_text,
-                since_tweet_id,
-            )
+        return process_new_tweets(
+            storage, twclient, config, lease, verification_cache, onelog
         )
-        onelog.info(total_count=len(tweets))
-    except Exception as err:
+    finally:
+        lease.release()
+
+
+def process_new_tweets(
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    lease: Lease,
+    verification_cache: VerificationCache,
+    onelog: OneLog,
+):
+    # twitter_search_text = (
+    #    f"{config.twitter_search_text} @{twclient.account_name}"
+    # )
+    twitter_search_text = f"@{twclient.account_name}"
+    onelog.info(twitter_search_text=twitter_search_text)
+    processor = TweetProcessor(
+        storage,
+        twclient,
+        config,
+        lease,
+        verification_cache,
+        twitter_search_text,
+        onelog,
+    )
+    try:
+        remaining_count = process_queued_tweets(
+            processor, storage, twclient, config, onelog
+        )
+        onelog.info(
+            processed_count=processor.processed_count,
+            failed_count=processor.failed_count,
+            dead_letter_count=processor.dead_letter_count,
+            remaining_count=remaining_count,
+        )
+    except FetchError as err:
         onelog.info(error=str(err), status="FAILED")
         traceback.print_exc()
         print(err)
@@ -191,36 +1094,132 @@ def handle_process_tweets(
             ),
             500,
         )
-
-    storage.cleanup_todo_tweets()
-    todo_tweets = storage.get_todo_tweets()
-    for tweet_id in todo_tweets:
-        new_tweet = twclient.get_by_id(tweet_id)
-        if new_tweet:
-            tweets.append(new_tweet)
-
-    # Process tweets one by one from oldest to newest
-    try:
-        processed_count = 0
-        for twt in reversed(tweets):
-            process_tweet(
-                twt,
-                storage,
-                twclient,
-                config,
-                tweet_prefix=twitter_search_text,
-                twitter_handle=f"@{twclient.account_name}",
-            )
-            processed_count += 1
-        onelog.info(processed_count=processed_count)
+    except LeaseLostError as err:
+        onelog.info(
+            processed_count=processor.processed_count,
+            failed_count=processor.failed_count,
+            error=str(err),
+            status="FAILED",
+        )
+        return flask.jsonify({"status": "failed", "error": str(err)}), 409
     except Exception as err:
         onelog.info(
-            processed_count=processed_count, error=str(err), status="FAILED"
+            processed_count=processor.processed_count,
+            failed_count=processor.failed_count,
+            error=str(err),
+            status="FAILED",
         )
         traceback.print_exc()
         print(err)
         return flask.jsonify({"status": "failed", "error": str(err)}), 500
+    finally:
+        if verification_cache is not None:
+            verification_cache.flush()
+            onelog.info(verification_cache=verification_cache.stats())
+
+    return flask.jsonify(
+        {
+            "status": "partial" if processor.failed_count else "success",
+            "processed_count": processor.processed_count,
+            "failed_count": processor.failed_count,
+            "dead_letter_count": processor.dead_letter_count,
+            "remaining_count": remaining_count,
+        }
+    )
 
-    storage.remove_todo_tweets(todo_tweets)
 
-    return flask.jsonify({"status": "success"})
+def process_queued_tweets(
+    processor: TweetProcessor,
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    onelog: OneLog,
+) -> int:
+    """Processes tweets from the inbox, todo and retry queues.
+
+    Returns:
+        Number of tweets left for the next run: in the inbox of the shard
+        (also those beyond the page read) and not started (out of time
+        budget) todo and retried tweets
+    """
+    # Fetch all tweets from Twitter API
+    try:
+        tweets, inbox_tweet_ids = fetch_tweets(
+            storage, twclient, config, processor.twitter_search_text, onelog
+        )
+        onelog.info(total_count=len(tweets))
+    except Exception as err:
+        raise FetchError(str(err)) from err
+
+    onelog.info(stale_count=requeue_stale_tweets(storage, config))
+    storage.cleanup_todo_tweets()
+    todo_tweets = storage.get_todo_tweets(
+        limit=config.todo_tweets_limit, shard=config_shard(config)
+    )
+    processor.retry_attempts = storage.get_due_retry_tweets(
+        limit=config.retry_tweets_limit, shard=config_shard(config)
+    )
+    onelog.info(retry_count=len(processor.retry_attempts))
+    try:
+        looked_up_tweets = twclient.get_by_ids(
+            todo_tweets + list(processor.retry_attempts)
+        )
+    except TwythonRateLimitError as err:
+        # todo and retried tweets are left for the next run
+        onelog.info(lookup_error=str(err))
+        looked_up_tweets = []
+        todo_tweets = []
+        processor.retry_attempts = {}
+    # The author of a tweet added by id is not known before the lookup
+    # (by shard 0), tweets of other shards are passed to their inbox
+    other_shard_tweets = [
+        twt
+        for twt in looked_up_tweets
+        if tweet_shard(twt, config.shard_count) != config.shard_index
+    ]
+    if other_shard_tweets:
+        storage.add_inbox_tweets(
+            [
+                inbox_item(twt, tweet_shard(twt, config.shard_count))
+                for twt in other_shard_tweets
+            ]
+        )
+        processor.done_retry_tweet_ids.extend(
+            twt.tweet_id
+            for twt in other_shard_tweets
+            if twt.tweet_id in processor.retry_attempts
+        )
+        onelog.info(handed_over_count=len(other_shard_tweets))
+    tweets.extend(
+        twt
+        for twt in looked_up_tweets
+        if tweet_shard(twt, config.shard_count) == config.shard_index
+    )
+    found_tweet_ids = {twt.tweet_id for twt in tweets + other_shard_tweets}
+    for tweet_id in processor.retry_attempts:
+        if tweet_id not in found_tweet_ids:
+            processor.retry(tweet_id, "Tweet not found")
+
+    remaining_tweets = processor.process(tweets)
+
+    # Not started tweets stay in their todo/retry/inbox queue
+    remaining_tweet_ids = {twt.tweet_id for twt in remaining_tweets}
+    storage.remove_todo_tweets(
+        [
+            tweet_id
+            for tweet_id in todo_tweets
+            if tweet_id not in remaining_tweet_ids
+        ]
+    )
+    storage.remove_retry_tweets(processor.done_retry_tweet_ids)
+    storage.remove_inbox_tweets(
+        [
+            tweet_id
+            for tweet_id in inbox_tweet_ids
+            if tweet_id not in remaining_tweet_ids
+        ]
+    )
+    remaining_tweet_ids.difference_update(inbox_tweet_ids)
+    return storage.get_inbox_tweet_count(config.shard_index) + len(
+        remaining_tweet_ids
+    )
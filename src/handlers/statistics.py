@@ -1,25 +1,52 @@
 import flask
 from datetime import datetime, timezone
 from services.smv_storage import SMVStorage
+from services.twitter import TwitterClient
+from services.verification_cache import VerificationCache
+from services.parties_snapshot import PartiesSnapshot
+from services.gzip_response import gzip_response
 from services.onelog import onelog_json, OneLog
 
 
 @onelog_json
 def handle_statistics(
-    storage: SMVStorage, onelog: OneLog = None
+    storage: SMVStorage,
+    verification_cache: VerificationCache = None,
+    twclient: TwitterClient = None,
+    parties_snapshot: PartiesSnapshot = None,
+    onelog: OneLog = None,
 ) -> flask.Response:
     try:
-        return flask.jsonify(
+        ingestion_cursors = storage.get_ingestion_cursors()
+        response = flask.jsonify(
             {
                 "time": datetime.utcnow()
                 .replace(tzinfo=timezone.utc)
                 .isoformat(),
                 "tweet_status_count": storage.get_tweet_count_by_status(),
-                "last_tweet_id": storage.get_last_tweet_id(),
+                "last_tweet_id": max(
+                    filter(None, ingestion_cursors.values()), default=None
+                ),
+                "ingestion_cursors": ingestion_cursors,
                 "total_tweets": storage.get_tweet_count(),
+                "retry_status_count": storage.get_retry_count_by_status(),
+                "reply_status_count": storage.get_reply_count_by_status(),
+                "signature_variant_count": (
+                    storage.get_signature_variant_counts()
+                ),
+                "verification_cache": (
+                    verification_cache.stats() if verification_cache else None
+                ),
+                "parties_snapshot": (
+                    parties_snapshot.stats() if parties_snapshot else None
+                ),
+                "twitter_rate_limits": (
+                    twclient.rate_limits.stats() if twclient else None
+                ),
                 "status": "success",
             }
         )
+        return gzip_response(flask.request, response)
     except Exception as err:
         return flask.jsonify(
             {
@@ -0,0 +1,261 @@
+from typing import Callable
+import time
+import traceback
+from twython.exceptions import TwythonError
+from services.twitter import TwitterClient, Tweet
+from services.twitter_stream import TwitterStream
+from services.smv_storage import SMVStorage
+from services.verification_cache import VerificationCache
+from services.lease import Lease
+from common import SMVConfig, LeaseLostError
+from services.onelog import onelog_json, OneLog
+from .process_tweets import (
+    INGESTION_SOURCES,
+    TweetProcessor,
+    handle_process_tweets,
+    inbox_item,
+    processing_lease_name,
+    read_inbox,
+    tweet_shard,
+)
+
+
+def next_reconnect_delay(
+    config: SMVConfig, delay: float, err: Exception
+) -> float:
+    """Returns seconds to wait before reconnecting to the stream after
+    a failed connection, `delay` - the previous wait (0 - connected).
+    Twitter asks to wait at least a minute when rate limited (420, 429)."""
+    min_delay = config.filter_stream_reconnect_delay
+    if isinstance(err, TwythonError) and err.error_code in (420, 429):
+        min_delay = max(min_delay, 60)
+    return min(
+        max(min_delay, delay * 2), config.filter_stream_max_reconnect_delay
+    )
+
+
+def backfill_tweets(
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    verification_cache: VerificationCache,
+) -> bool:
+    """Fetches and processes tweets missed while the stream was not
+    connected, the same way as `/process-tweets` does.
+
+    Returns:
+        True if the missed tweets have been fetched
+    """
+    rv = handle_process_tweets(
+        storage=storage,
+        twclient=twclient,
+        config=config,
+        verification_cache=verification_cache,
+    )
+    response = rv[0] if isinstance(rv, tuple) else rv
+    return response.get_json()["status"] in ["success", "partial"]
+
+
+@onelog_json
+def process_stream_tweet(
+    tweet: Tweet,
+    storage: SMVStorage,
+    processor: TweetProcessor,
+    config: SMVConfig,
+    verification_cache: VerificationCache,
+    bump_cursors: bool,
+    onelog: OneLog = None,
+):
+    """Processes a tweet received from the stream, by the processor of
+    the connection.
+
+    The tweet is stored in the inbox first, it is processed (with the rest
+    of the inbox, oldest first) under the lease of `/process-tweets`, so
+    never by both at once. While a `/process-tweets` run holds the lease,
+    the tweet waits in the inbox for the next run, as do tweets of other
+    shards for their shard.
+    """
+    shard_index = tweet_shard(tweet, config.shard_count)
+    onelog.info(tweet_id=tweet.tweet_id, shard=shard_index)
+    storage.add_inbox_tweets([inbox_item(tweet, shard_index)])
+    if shard_index == config.shard_index:
+        lease = Lease(storage, processing_lease_name(config), config.lease_ttl)
+        if lease.acquire():
+            try:
+                process_inbox_tweets(
+                    storage,
+                    processor,
+                    config,
+                    lease,
+                    verification_cache,
+                    onelog,
+                )
+            finally:
+                lease.release()
+        else:
+            onelog.info(lease=lease.name, status="QUEUED")
+    if bump_cursors:
+        # the next backfill starts after the tweet
+        for source in INGESTION_SOURCES:
+            storage.bump_ingestion_cursor(source, tweet.tweet_id)
+
+
+def process_inbox_tweets(
+    storage: SMVStorage,
+    processor: TweetProcessor,
+    config: SMVConfig,
+    lease: Lease,
+    verification_cache: VerificationCache,
+    onelog: OneLog,
+):
+    """Processes tweets in the inbox of the shard, the lease of
+    `/process-tweets` must be held"""
+    tweets = read_inbox(storage, config.shard_index)
+    processor.start(lease, onelog)
+    try:
+        remaining_tweets = processor.process(tweets)
+    finally:
+        if verification_cache is not None:
+            verification_cache.flush()
+    remaining_tweet_ids = {twt.tweet_id for twt in remaining_tweets}
+    storage.remove_inbox_tweets(
+        [
+            twt.tweet_id
+            for twt in tweets
+            if twt.tweet_id not in remaining_tweet_ids
+        ]
+    )
+    onelog.info(
+        inbox_count=len(tweets),
+        processed_count=processor.processed_count,
+        failed_count=processor.failed_count,
+        remaining_count=len(remaining_tweets),
+    )
+
+
+@onelog_json
+def stream_tweets(
+    stream: TwitterStream,
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    lease: Lease,
+    verification_cache: VerificationCache,
+    onelog: OneLog = None,
+):
+    """Processes tweets from a connected stream, until disconnected.
+
+    The stream is connected before the backfill, so no tweet is missed
+    in between: tweets received during the backfill wait in the connection
+    buffers, tweets received twice are skipped as processed.
+    Ingestion cursors follow streamed tweets, so the next backfill does
+    not fetch them again. Not when the backfill has failed or Twitter has
+    dropped some tweets (limit notice), the next backfill fetches them.
+    Tweets are processed by one processor per connection, each under
+    the lease of `/process-tweets` (see `process_stream_tweet`).
+    """
+    received_count = 0
+    try:
+        backfilled = backfill_tweets(
+            storage, twclient, config, verification_cache
+        )
+        onelog.info(backfilled=backfilled)
+        processor = TweetProcessor(
+            storage,
+            twclient,
+            config,
+            lease,
+            verification_cache,
+            f"@{twclient.account_name}",
+            onelog,
+        )
+        for tweet in stream:
+            # stop if another stream has taken over
+            lease.renew()
+            if tweet is None:
+                continue
+            received_count += 1
+            process_stream_tweet(
+                tweet,
+                storage,
+                processor,
+                config,
+                verification_cache,
+                bump_cursors=backfilled and stream.dropped_count == 0,
+            )
+    finally:
+        onelog.info(
+            received_count=received_count,
+            dropped_count=stream.dropped_count,
+        )
+        stream.close()
+
+
+def run_filter_stream(
+    storage: SMVStorage,
+    twclient: TwitterClient,
+    config: SMVConfig,
+    verification_cache: VerificationCache = None,
+    open_stream: Callable[[], TwitterStream] = None,
+    sleep: Callable[[float], None] = time.sleep,
+    max_connections: int = None,
+) -> bool:
+    """Long-running ingestion from Twitter filtered stream: processes
+    mentions of the account as they arrive, an alternative to polling
+    with `/process-tweets`.
+
+    Reconnects when the stream is disconnected, with backoff
+    (see `next_reconnect_delay`). Every connection starts with
+    a backfill of tweets missed in the meantime, fetched with search.
+    Only one stream runs at a time.
+
+    Args:
+        open_stream: Returns a connected stream, default: filtered stream
+        from `config.filter_stream_url`
+        max_connections: Stops after this number of connection attempts,
+        default: runs until killed
+
+    Returns:
+        False if another stream is running, True once stopped
+    """
+    if config.shard_index != 0:
+        raise ValueError("Tweets are ingested by shard 0.")
+    if open_stream is None:
+
+        def open_stream() -> TwitterStream:
+            return TwitterStream(
+                twclient,
+                f"@{twclient.account_name}",
+                config.filter_stream_url,
+            ).connect()
+
+    lease = Lease(storage, "filter-stream", config.lease_ttl)
+    if not lease.acquire():
+        print("Another stream is running.")
+        return False
+    delay = 0.0
+    connection_count = 0
+    try:
+        while max_connections is None or connection_count < max_connections:
+            connection_count += 1
+            try:
+                stream = open_stream()
+                delay = 0.0
+                stream_tweets(
+                    stream,
+                    storage,
+                    twclient,
+                    config,
+                    lease,
+                    verification_cache,
+                )
+            except LeaseLostError:
+                raise
+            except Exception as err:
+                traceback.print_exc()
+                delay = next_reconnect_delay(config, delay, err)
+                print(f"Reconnecting in {delay} seconds.")
+                sleep(delay)
+    finally:
+        lease.release()
+    return True
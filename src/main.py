@@ -5,38 +5,60 @@ from common import SMVConfig
 from services.smv_storage import SMVStorage
 from handlers import (
     handle_parties,
+    handle_process_replies,
     handle_process_tweets,
+    send_replies_after_run,
     handle_statistics,
     handle_tweet,
 )
 from services.twitter import TwitterClient
+from services.verification_cache import VerificationCache
+from services.parties_snapshot import PartiesSnapshot
 
-app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
-
-CONFIG = SMVConfig(
-    twitter_search_text=os.environ["TWITTER_SEARCH_TEXT"],
-    twitter_reply_message_success=os.environ["TWITTER_REPLY_SUCCESS"],
-    twitter_reply_message_invalid_format=os.environ[
-        "TWITTER_REPLY_INVALID_FORMAT"
-    ],
-    twitter_reply_message_invalid_signature=os.environ[
-        "TWITTER_REPLY_INVALID_SIGNATURE"
-    ],
-    twitter_reply_delay=float(os.getenv("TWITTER_REPLY_DELAY", "0.25")),
+# JSON_PRETTY=false - compact JSON responses
+app.config["JSONIFY_PRETTYPRINT_REGULAR"] = (
+    os.getenv("JSON_PRETTY", "true") == "true"
 )
 
+CONFIG = SMVConfig.from_env()
+
 STORAGE = SMVStorage.get_storage(
     gcp_secret_name=os.environ["MONGO_SECRET_NAME"],
 )
+STORAGE.ensure_indexes()
 
 TWCLIENT = TwitterClient(
     gcp_secret_name=os.environ["TWITTER_SECRET_NAME"],
+    rate_limit_max_wait=float(os.getenv("TWITTER_RATE_LIMIT_MAX_WAIT", "60")),
+)
+
+VERIFICATION_CACHE = VerificationCache(
+    max_size=int(os.getenv("VERIFICATION_CACHE_SIZE", "10000")),
+    storage=(
+        STORAGE
+        if os.getenv("VERIFICATION_CACHE_PERSISTENT", "false") == "true"
+        else None
+    ),
+)
+
+PARTIES_SNAPSHOT = (
+    PartiesSnapshot(
+        STORAGE,
+        ttl=float(os.getenv("PARTIES_SNAPSHOT_TTL", "60")),
+        watch=os.getenv("PARTIES_SNAPSHOT_WATCH", "true") == "true",
+    )
+    if os.getenv("PARTIES_SNAPSHOT", "true") == "true"
+    else None
 )
 
 
 def router(request: flask.Request):
     if request.path.endswith("/parties"):
-        return handle_parties(storage=STORAGE)
+        return handle_parties(
+            storage=STORAGE,
+            snapshot=PARTIES_SNAPSHOT,
+            since=request.args.get("since"),
+        )
     elif request.path.endswith("/tweet"):
         tweet_id: str = request.args.get("id")
         return handle_tweet(
@@ -44,12 +66,29 @@ def router(request: flask.Request):
             tweet_id=tweet_id,
         )
     elif request.path.endswith("/process-tweets"):
-        return handle_process_tweets(
+        return send_replies_after_run(
+            handle_process_tweets(
+                storage=STORAGE,
+                twclient=TWCLIENT,
+                config=CONFIG,
+                verification_cache=VERIFICATION_CACHE,
+            ),
+            storage=STORAGE,
+            twclient=TWCLIENT,
+            config=CONFIG,
+        )
+    elif request.path.endswith("/process-replies"):
+        return handle_process_replies(
             storage=STORAGE,
             twclient=TWCLIENT,
             config=CONFIG,
         )
     elif request.path.endswith("/statistics"):
-        return handle_statistics(storage=STORAGE)
+        return handle_statistics(
+            storage=STORAGE,
+            verification_cache=VERIFICATION_CACHE,
+            twclient=TWCLIENT,
+            parties_snapshot=PARTIES_SNAPSHOT,
+        )
     else:
         flask.abort(404, description="Resource not found")
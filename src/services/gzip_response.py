@@ -0,0 +1,50 @@
+from typing import Iterable, Iterator
+import gzip
+import zlib
+import flask
+
+COMPRESS_LEVEL = 6
+
+
+def accepts_gzip(request: flask.Request) -> bool:
+    """Returns True if the client accepts gzip encoded responses"""
+    return request.accept_encodings["gzip"] > 0
+
+
+def gzip_bytes(data: bytes) -> bytes:
+    """Compresses data, the same data gives the same bytes (no mtime)"""
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compresses a streamed response chunk by chunk"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def gzip_response(
+    request: flask.Request, response: flask.Response, min_size: int = 512
+) -> flask.Response:
+    """Compresses a successful response with gzip if the client accepts it.
+
+    Streamed responses stay streamed. Responses already encoded, or
+    smaller than `min_size` bytes, are left as they are.
+    """
+    if response.status_code != 200:
+        return response
+    response.vary.add("Accept-Encoding")
+    if "Content-Encoding" in response.headers or not accepts_gzip(request):
+        return response
+    if response.is_streamed:
+        response.response = iter_gzip(response.iter_encoded())
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(gzip_bytes(data))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
@@ -0,0 +1,41 @@
+from typing import Any, Iterable, Iterator
+import json
+
+
+def iter_json_array(
+    items: Iterable[Any], pretty: bool = False, chunk_size: int = 1000
+) -> Iterator[str]:
+    """Serializes items into a JSON array chunk by chunk, so only
+    `chunk_size` items are held in memory.
+
+    The output is the same as of `flask.jsonify(list(items))`: sorted keys,
+    pretty printed with 2 spaces indent, or compact.
+
+    Usage:
+    ```
+    flask.Response(iter_json_array(storage.iter_parties()))
+    ```
+    """
+    if pretty:
+        encoder = json.JSONEncoder(
+            indent=2, separators=(", ", ": "), sort_keys=True
+        )
+        start, item_separator, end = "[\n  ", ", \n  ", "\n]"
+    else:
+        encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True)
+        start, item_separator, end = "[", ",", "]"
+
+    # array items encoded at once, without the brackets
+    head, tail = len(start), -len(end)
+    prefix = start
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield prefix + encoder.encode(chunk)[head:tail]
+            prefix = item_separator
+            chunk = []
+    if chunk:
+        yield prefix + encoder.encode(chunk)[head:tail]
+        prefix = item_separator
+    yield "[]\n" if prefix == start else end + "\n"
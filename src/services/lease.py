@@ -0,0 +1,52 @@
+from uuid import uuid4
+
+from .smv_storage import SMVStorage
+from common import LeaseLostError
+
+
+class Lease(object):
+    """Lease (lock with expiry) stored in MongoDB, so only one instance at
+    a time does the job.
+
+    Every acquisition gets a new fencing token. Renew the lease before each
+    step which must not be done by two instances: if it has expired and
+    someone else has acquired it, `renew` raises `LeaseLostError`.
+
+    Usage:
+    ```
+    lease = Lease(storage, "process-tweets", ttl=600)
+    if lease.acquire():
+        try:
+            ...
+            lease.renew()
+            ...
+        finally:
+            lease.release()
+    ```
+    """
+
+    def __init__(self, storage: SMVStorage, name: str, ttl: float) -> None:
+        self.storage = storage
+        self.name = name
+        self.ttl = ttl
+        self.owner = uuid4().hex
+        self.token = None
+
+    def acquire(self) -> bool:
+        self.token = self.storage.acquire_lease(
+            self.name, self.owner, self.ttl
+        )
+        return self.token is not None
+
+    def renew(self):
+        if self.token is None or not self.storage.renew_lease(
+            self.name, self.owner, self.token, self.ttl
+        ):
+            raise LeaseLostError(
+                f'Lease "{self.name}" (token: {self.token}) has been lost'
+            )
+
+    def release(self):
+        if self.token is not None:
+            self.storage.release_lease(self.name, self.owner, self.token)
+            self.token = None
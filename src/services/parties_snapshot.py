@@ -0,0 +1,163 @@
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from pymongo.errors import OperationFailure
+
+from .gzip_response import gzip_bytes
+from .json_stream import iter_json_array
+from .smv_storage import SMVStorage
+
+
+class SnapshotEntry(object):
+    """Serialized parties of one snapshot, `last_modified` - the newest
+    `last_modified` of identities when it was built"""
+
+    def __init__(
+        self,
+        version: int,
+        built_at: float,
+        body: bytes,
+        last_modified: Optional[datetime],
+    ) -> None:
+        self.version = version
+        self.built_at = built_at
+        self.body = body
+        self.last_modified = last_modified
+        self._gzip_body: Optional[bytes] = None
+
+    def gzip_body(self) -> bytes:
+        """Returns body compressed with gzip (once)"""
+        if self._gzip_body is None:
+            self._gzip_body = gzip_bytes(self.body)
+        return self._gzip_body
+
+    def size(self) -> int:
+        return len(self.body) + len(self._gzip_body or b"")
+
+
+class PartiesSnapshot(object):
+    """Process-level snapshot of `/parties` response: the parties list
+    serialized once and kept in memory, so a read does not touch MongoDB.
+
+    A background thread watches `identities` with a change stream, any
+    change invalidates the snapshot and the next read rebuilds it. Change
+    streams need a replica set. The snapshot also expires `ttl` seconds
+    after it was built: without a replica set, while the stream
+    reconnects, or when the thread gets no CPU between requests (e.g.
+    Cloud Functions), `ttl` bounds how stale a read can be.
+
+    Usage:
+    ```
+    snapshot = PartiesSnapshot(storage, ttl=60)
+    body = snapshot.get(pretty=True).body
+    ```
+    """
+
+    def __init__(
+        self,
+        storage: SMVStorage,
+        ttl: float = 60,
+        watch: bool = True,
+        retry_delay: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.storage = storage
+        self.ttl = ttl
+        self.watch = watch
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.watching = False
+        # bumped by every change, a snapshot of an older version is stale
+        self._version = 0
+        # pretty -> serialized parties
+        self._entries: Dict[bool, SnapshotEntry] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watch_attempted = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, pretty: bool = False) -> SnapshotEntry:
+        """Returns parties serialized as by `flask.jsonify`, from memory
+        unless the snapshot is stale.
+
+        The first call starts watching changes, it waits (a few seconds at
+        most) for the change stream, so the first snapshot is not rebuilt
+        right after it is opened.
+        """
+        if self.watch and self._thread is None:
+            self._start_watching()
+        with self._lock:
+            entry = self._entries.get(pretty)
+            if entry is not None and self._is_fresh(entry):
+                self.hits += 1
+                return entry
+            self.misses += 1
+            version, built_at = self._version, self.clock()
+            # before reading parties, so it is not newer than them
+            last_modified = self.storage.get_parties_last_modified()
+            body = "".join(
+                iter_json_array(self.storage.iter_parties(), pretty=pretty)
+            ).encode()
+            entry = SnapshotEntry(version, built_at, body, last_modified)
+            self._entries[pretty] = entry
+            return entry
+
+    def _is_fresh(self, entry: SnapshotEntry) -> bool:
+        if entry.version != self._version:
+            return False
+        return self.clock() - entry.built_at < self.ttl
+
+    def invalidate(self):
+        """Makes snapshot stale, the next read rebuilds it"""
+        self._version += 1
+        self.invalidations += 1
+
+    def _start_watching(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        self._watch_attempted.wait(timeout=5)
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                with self.storage.watch_identities() as changes:
+                    # changes before the stream was opened were not seen
+                    self.invalidate()
+                    self.watching = True
+                    self._watch_attempted.set()
+                    while not self._stop.is_set() and changes.alive:
+                        if changes.try_next() is not None:
+                            self.invalidate()
+            except OperationFailure as err:
+                # e.g. not a replica set, retrying would not help
+                print(f"Not watching parties changes, ttl only: {err}")
+                return
+            except Exception:
+                traceback.print_exc()
+                self._stop.wait(self.retry_delay)
+            finally:
+                self.watching = False
+                self._watch_attempted.set()
+
+    def close(self):
+        """Stops watching changes"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "watching": self.watching,
+            "size": sum(entry.size() for entry in self._entries.values()),
+        }
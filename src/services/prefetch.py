@@ -0,0 +1,78 @@
+import queue
+import threading
+from typing import Any, Iterator
+
+
+class Prefetcher(object):
+    """Iterates over items of an iterator consumed in a background thread.
+
+    The thread starts right away and stays at most `queue_size` items
+    ahead of the consumer, it pauses while the queue is full. An exception
+    raised by the iterator is re-raised by `next`. Closing the prefetcher
+    stops the thread (after the item being fetched) and closes the
+    iterator.
+
+    Usage:
+    ```
+    with Prefetcher(twclient.search_pages(text), queue_size=4) as pages:
+        for page in pages:
+            ...
+    ```
+    """
+
+    _END = object()
+
+    def __init__(self, iterator: Iterator[Any], queue_size: int) -> None:
+        self._iterator = iterator
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._fetch, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fetch(self):
+        try:
+            for item in self._iterator:
+                if not self._put(item):
+                    break
+        except Exception as err:
+            self._put(err)
+        finally:
+            if hasattr(self._iterator, "close"):
+                self._iterator.close()
+            self._put(self._END)
+
+    def __iter__(self) -> "Prefetcher":
+        return self
+
+    def __next__(self) -> Any:
+        if self._done:
+            raise StopIteration
+        item = self._queue.get()
+        if item is self._END:
+            self._done = True
+            raise StopIteration
+        if isinstance(item, Exception):
+            self._done = True
+            raise item
+        return item
+
+    def close(self):
+        self._done = True
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self) -> "Prefetcher":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
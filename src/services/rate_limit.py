@@ -0,0 +1,146 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional
+from urllib.parse import urlparse
+
+from twython.exceptions import TwythonRateLimitError
+
+
+class TokenBucket(object):
+    """Rate limit of one Twitter API endpoint: `remaining` calls (tokens)
+    are left until `reset`, then the bucket is refilled to `limit`."""
+
+    def __init__(self) -> None:
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset: Optional[float] = None
+
+    def update(self, limit: int, remaining: int, reset: float):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def refill(self, now: float):
+        if self.reset is not None and now >= self.reset:
+            self.remaining = self.limit
+            self.reset = None
+
+    def wait_time(self, now: float) -> float:
+        """Returns seconds to wait for a token (0 if there is one, or if
+        the rate limit is unknown)"""
+        self.refill(now)
+        if self.remaining is None or self.remaining > 0:
+            return 0.0
+        if self.reset is None:
+            return 0.0
+        return self.reset - now
+
+    def take(self):
+        if self.remaining:
+            self.remaining -= 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset": self.reset,
+        }
+
+
+class RateLimiter(object):
+    """Paces Twitter API calls per endpoint, so they use the whole rate
+    limit without being rejected (HTTP 429).
+
+    Buckets are fed from `x-rate-limit-*` headers of responses, by
+    `on_response` hook of the requests session. A call waits for the
+    bucket to be refilled, or raises `TwythonRateLimitError` without
+    calling the API if it would wait longer than `max_wait` seconds.
+    """
+
+    def __init__(
+        self,
+        max_wait: float = 60,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, endpoint: str) -> TokenBucket:
+        if endpoint not in self._buckets:
+            self._buckets[endpoint] = TokenBucket()
+        return self._buckets[endpoint]
+
+    def acquire(self, endpoint: str):
+        """Takes a token of the endpoint, waits for it if needed.
+
+        Args:
+            endpoint (str): Endpoint path, e.g. "search/tweets"
+
+        Raises:
+            TwythonRateLimitError: If the rate limit would not be reset
+                within `max_wait` seconds
+        """
+        while True:
+            with self._lock:
+                bucket = self._bucket(endpoint)
+                wait_time = bucket.wait_time(self._clock())
+                if wait_time <= 0:
+                    bucket.take()
+                    return
+                if wait_time > self.max_wait:
+                    raise TwythonRateLimitError(
+                        f'Rate limit of "{endpoint}" exceeded, reset in '
+                        f"{wait_time:.0f}s",
+                        error_code=429,
+                        retry_after=bucket.reset,
+                    )
+            self._sleep(wait_time)
+
+    def update(
+        self, endpoint: str, headers: Mapping[str, str], status_code: int
+    ):
+        """Updates the bucket from response headers"""
+        remaining = headers.get("x-rate-limit-remaining")
+        reset = headers.get("x-rate-limit-reset")
+        if remaining is None or reset is None:
+            return
+        limit = headers.get("x-rate-limit-limit")
+        with self._lock:
+            self._bucket(endpoint).update(
+                limit=int(limit) if limit is not None else None,
+                remaining=0 if status_code == 429 else int(remaining),
+                reset=float(reset),
+            )
+
+    def on_response(self, response, *args, **kwargs):
+        """Response hook of requests session"""
+        self.update(
+            api_endpoint(response.url), response.headers, response.status_code
+        )
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            now = self._clock()
+            for bucket in self._buckets.values():
+                bucket.refill(now)
+            return {
+                endpoint: bucket.to_dict()
+                for endpoint, bucket in sorted(self._buckets.items())
+            }
+
+
+def api_endpoint(url: str) -> str:
+    """Returns endpoint of Twitter API url, e.g. "statuses/show" for
+    https://api.twitter.com/1.1/statuses/show/123.json"""
+    path = urlparse(url).path.strip("/")
+    # drop API version
+    path = path.split("/", 1)[-1]
+    if path.endswith(".json"):
+        path = path[: -len(".json")]
+    if path.startswith("statuses/show/"):
+        return "statuses/show"
+    return path
@@ -1,13 +1,130 @@
-from typing import Any, Optional, Dict, List
+from typing import Any, Iterator, Optional, Dict, List, Set, Tuple
+from contextlib import contextmanager
 import pymongo
-from pymongo import database
+from pymongo import database, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.change_stream import ChangeStream
 from pymongo.collection import Collection
 from pymongo.cursor import CursorType
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from .mongodb import get_mongodb_connection
 
 from common import BlocklistPartyError
 
+# Fields of identities returned by `iter_parties`
+PARTY_FIELDS = [
+    "pub_key",
+    "twitter_handle",
+    "twitter_user_id",
+    "last_modified",
+    "created",
+]
+
+# Indexes of collections, created by `SMVStorage.ensure_indexes`
+INDEXES: Dict[str, List[IndexModel]] = {
+    "identities": [
+        # not blocked parties (`blocked` is null), see `iter_parties`
+        IndexModel(
+            [("blocked", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            name="blocked_id",
+        ),
+        # parties changed after a time, see `iter_party_changes`, and
+        # the last change, see `get_parties_last_modified`
+        IndexModel(
+            [
+                ("last_modified", pymongo.ASCENDING),
+                ("_id", pymongo.ASCENDING),
+            ],
+            name="last_modified_id",
+        ),
+        # parties matching a sign-up, see `upsert_verified_party`
+        IndexModel([("pub_key", pymongo.ASCENDING)], name="pub_key"),
+        IndexModel(
+            [("twitter_user_id", pymongo.ASCENDING)], name="twitter_user_id"
+        ),
+        IndexModel(
+            [("twitter_handle", pymongo.ASCENDING)], name="twitter_handle"
+        ),
+    ],
+    "tweets": [
+        # one record per tweet, also the last processed tweet
+        IndexModel(
+            [("tweet_id", pymongo.ASCENDING)], name="tweet_id", unique=True
+        ),
+        # stale PROCESSING tweets lookup
+        IndexModel(
+            [
+                ("status", pymongo.ASCENDING),
+                ("last_modified", pymongo.ASCENDING),
+            ],
+            name="status_last_modified",
+        ),
+    ],
+    "todo_tweets": [
+        # the same tweet can be added more than once
+        IndexModel([("tweet_id", pymongo.ASCENDING)], name="tweet_id"),
+    ],
+    "tweet_inbox": [
+        # tweets of a shard
+        IndexModel(
+            [("shard", pymongo.ASCENDING), ("tweet_id", pymongo.ASCENDING)],
+            name="shard_tweet_id",
+        ),
+    ],
+    "retry_tweets": [
+        # due retries
+        IndexModel(
+            [
+                ("status", pymongo.ASCENDING),
+                ("next_attempt", pymongo.ASCENDING),
+            ],
+            name="status_next_attempt",
+        ),
+    ],
+    "reply_outbox": [
+        # pending replies
+        IndexModel(
+            [
+                ("status", pymongo.ASCENDING),
+                ("next_attempt", pymongo.ASCENDING),
+            ],
+            name="status_next_attempt",
+        ),
+        # replies sent in the rate limit window
+        IndexModel(
+            [("status", pymongo.ASCENDING), ("sent", pymongo.ASCENDING)],
+            name="status_sent",
+        ),
+    ],
+}
+
+
+def tweet_record_data(
+    user_id: int = None,
+    screen_name: str = None,
+    text: str = None,
+    reply: str = None,
+    status: str = None,
+    description: str = None,
+) -> Dict[str, Any]:
+    """Returns fields of a tweet record to set (the given ones)"""
+    data = {
+        "last_modified": datetime.utcnow().replace(tzinfo=timezone.utc),
+    }
+    if user_id is not None:
+        data["user_id"] = user_id
+    if screen_name is not None:
+        data["screen_name"] = screen_name
+    if text is not None:
+        data["text"] = text
+    if reply is not None:
+        data["reply"] = reply
+    if status is not None:
+        data["status"] = status
+    if description is not None:
+        data["description"] = description
+    return data
+
 
 class SMVStorage(object):
     """Access SMV Storage (currently backed with MongoDB)"""
@@ -21,6 +138,20 @@ class SMVStorage(object):
             get_mongodb_connection(gcp_secret_name=gcp_secret_name)
         )
 
+    @staticmethod
+    def _shard_filter(shard: Tuple[int, int] = None) -> Dict[str, Any]:
+        """Query filter of tweets in shard: (shard count, shard index).
+
+        Tweets are sharded by `user_id`, as by `tweet_shard`. Records with
+        no `user_id` (e.g. tweets added by id) belong to shard 0.
+        """
+        if shard is None or shard[0] <= 1:
+            return {}
+        user_filter = {"user_id": {"$mod": list(shard)}}
+        if shard[1] == 0:
+            return {"$or": [user_filter, {"user_id": None}]}
+        return user_filter
+
     @property
     def col_identities(self) -> Collection:
         return self.db.get_collection("identities")
@@ -33,24 +164,145 @@ class SMVStorage(object):
     def col_todo_tweets(self) -> Collection:
         return self.db.get_collection("todo_tweets")
 
-    def get_parties(self):
-        return [
-            {
-                "party_id": item["pub_key"],
-                "twitter_handle": item["twitter_handle"],
-                "twitter_user_id": item["twitter_user_id"],
-                "last_modified": int(
-                    item["last_modified"]
-                    .replace(tzinfo=timezone.utc)
-                    .timestamp()
-                ),
-                "created": int(
-                    item["created"].replace(tzinfo=timezone.utc).timestamp()
-                ),
-            }
-            for item in self.col_identities.find()
-            if item.get("blocked", None) is None
-        ]
+    @property
+    def col_leases(self) -> Collection:
+        return self.db.get_collection("leases")
+
+    @property
+    def col_tweet_inbox(self) -> Collection:
+        return self.db.get_collection("tweet_inbox")
+
+    @property
+    def col_ingestion_cursors(self) -> Collection:
+        return self.db.get_collection("ingestion_cursors")
+
+    @property
+    def col_retry_tweets(self) -> Collection:
+        return self.db.get_collection("retry_tweets")
+
+    @property
+    def col_reply_outbox(self) -> Collection:
+        return self.db.get_collection("reply_outbox")
+
+    @property
+    def col_signature_variants(self) -> Collection:
+        return self.db.get_collection("signature_variants")
+
+    @property
+    def col_verification_results(self) -> Collection:
+        return self.db.get_collection("verification_results")
+
+    def ensure_indexes(self) -> List[str]:
+        """Creates indexes used by queries (see `INDEXES`), existing
+        indexes are left as they are, so it is safe to call on every start.
+
+        An index that cannot be created (e.g. duplicate tweet records for
+        the unique index) does not stop the others.
+
+        Returns:
+            Names of indexes which could not be created: collection.index
+        """
+        failed = []
+        for collection_name, indexes in INDEXES.items():
+            collection = self.db.get_collection(collection_name)
+            try:
+                collection.create_indexes(indexes)
+                continue
+            except OperationFailure:
+                pass
+            # find out which one has failed
+            for index in indexes:
+                try:
+                    collection.create_indexes([index])
+                except OperationFailure as err:
+                    index_name = f"{collection_name}.{index.document['name']}"
+                    print(f"Failed to create index {index_name}: {err}")
+                    failed.append(index_name)
+        return failed
+
+    @staticmethod
+    def _party(item: Dict[str, Any]) -> Dict[str, Any]:
+        """Party returned by the API from identities document"""
+        return {
+            "party_id": item["pub_key"],
+            "twitter_handle": item["twitter_handle"],
+            "twitter_user_id": item["twitter_user_id"],
+            "last_modified": int(
+                item["last_modified"].replace(tzinfo=timezone.utc).timestamp()
+            ),
+            "created": int(
+                item["created"].replace(tzinfo=timezone.utc).timestamp()
+            ),
+        }
+
+    def iter_parties(self) -> Iterator[Dict[str, Any]]:
+        """Returns not blocked parties in order of registration. Blocked
+        parties are filtered out and fields are projected by the query."""
+        for item in self.col_identities.find(
+            {"blocked": None},
+            projection={"_id": False, **{field: 1 for field in PARTY_FIELDS}},
+            sort=[("_id", pymongo.ASCENDING)],
+        ):
+            yield self._party(item)
+
+    def iter_party_changes(self, since: datetime) -> Iterator[Dict[str, Any]]:
+        """Returns parties created, changed or blocked after `since`, in
+        order of modification, with `blocked` and `removed` flags. Removed
+        parties are tombstones, consumers remove them: blocked parties,
+        and pub keys replaced by a new sign-up of the same user (returned
+        before the party with the new pub key)."""
+        for item in self.col_identities.find(
+            {"last_modified": {"$gt": since}},
+            projection={
+                "_id": False,
+                "blocked": 1,
+                "replaced_pub_keys": 1,
+                **{field: 1 for field in PARTY_FIELDS},
+            },
+            sort=[
+                ("last_modified", pymongo.ASCENDING),
+                ("_id", pymongo.ASCENDING),
+            ],
+        ):
+            party = self._party(item)
+            blocked = item.get("blocked") is not None
+            for replaced in item.get("replaced_pub_keys", []):
+                replaced_at = replaced["replaced"].replace(tzinfo=timezone.utc)
+                if (
+                    replaced_at > since
+                    and replaced["pub_key"] != item["pub_key"]
+                ):
+                    yield {
+                        **party,
+                        "party_id": replaced["pub_key"],
+                        "last_modified": int(replaced_at.timestamp()),
+                        "blocked": blocked,
+                        "removed": True,
+                    }
+            yield {**party, "blocked": blocked, "removed": blocked}
+
+    def get_parties(self) -> List[Dict[str, Any]]:
+        return list(self.iter_parties())
+
+    def get_parties_last_modified(self) -> Optional[datetime]:
+        """Returns the newest `last_modified` of identities, blocked too:
+        every sign-up and block sets it, so it changes with the parties."""
+        item = self.col_identities.find_one(
+            {},
+            projection={"_id": False, "last_modified": True},
+            sort=[
+                ("last_modified", pymongo.DESCENDING),
+                ("_id", pymongo.DESCENDING),
+            ],
+        )
+        if item is None:
+            return None
+        return item["last_modified"].replace(tzinfo=timezone.utc)
+
+    def watch_identities(self, max_await_time_ms: int = 1000) -> ChangeStream:
+        """Returns change stream of identities, `try_next` waits up to
+        `max_await_time_ms` for a change. Needs a replica set."""
+        return self.col_identities.watch(max_await_time_ms=max_await_time_ms)
 
     def upsert_verified_party(
         self,
@@ -109,7 +361,7 @@ class SMVStorage(object):
                 f" twitter_id: '{user_id}', pub_key: '{pub_key}'"
             )
 
-        self.col_identities.update_one(
+        previous = self.col_identities.find_one_and_update(
             {
                 "$nor": [
                     {
@@ -138,13 +390,46 @@ class SMVStorage(object):
                     "created": now,
                 },
             },
+            projection={"pub_key": True},
             # UPSERT !!
             upsert=True,
+            return_document=ReturnDocument.BEFORE,
         )
+        # User changed their Pub Key: the old one is kept, so the delta of
+        # parties (see `iter_party_changes`) removes it
+        if previous is not None and previous["pub_key"] != pub_key:
+            self.col_identities.update_one(
+                {"_id": previous["_id"]},
+                {
+                    "$push": {
+                        "replaced_pub_keys": {
+                            "pub_key": previous["pub_key"],
+                            "replaced": now,
+                        }
+                    }
+                },
+            )
 
     def get_tweet_record(self, tweet_id: int) -> Optional[Any]:
         return self.col_tweets.find_one({"tweet_id": tweet_id})
 
+    def get_processed_tweet_ids(self, tweet_ids: List[int]) -> Set[int]:
+        """Returns ids of tweets that already have a record, except tweets
+        waiting for retry (in one query)"""
+        if not tweet_ids:
+            return set()
+        return {
+            item["tweet_id"]
+            for item in self.col_tweets.find(
+                {
+                    "tweet_id": {"$in": list(dict.fromkeys(tweet_ids))},
+                    # tweets waiting for retry are processed again
+                    "status": {"$ne": "RETRY"},
+                },
+                projection={"tweet_id": 1, "_id": False},
+            )
+        }
+
     def upsert_tweet_record(
         self,
         tweet_id: int,
@@ -155,27 +440,80 @@ class SMVStorage(object):
         status: str = None,
         description: str = None,
     ):
-        data = {
-            "last_modified": datetime.utcnow().replace(tzinfo=timezone.utc),
-        }
-        if user_id is not None:
-            data["user_id"] = user_id
-        if screen_name is not None:
-            data["screen_name"] = screen_name
-        if text is not None:
-            data["text"] = text
-        if reply is not None:
-            data["reply"] = reply
-        if status is not None:
-            data["status"] = status
-        if description is not None:
-            data["description"] = description
         self.col_tweets.update_one(
             {"tweet_id": tweet_id},
-            {"$set": data},
+            {
+                "$set": tweet_record_data(
+                    user_id=user_id,
+                    screen_name=screen_name,
+                    text=text,
+                    reply=reply,
+                    status=status,
+                    description=description,
+                )
+            },
             upsert=True,
         )
 
+    @contextmanager
+    def buffer_tweet_records(self) -> Iterator["TweetRecordBuffer"]:
+        """Groups tweet record upserts of a run into bulk writes.
+
+        The context returns a buffer to pass to the code writing the
+        records instead of the storage: its `upsert_tweet_record` only
+        buffers the change (upserts of the same tweet are merged), other
+        calls go to the storage. Buffered records are written with one
+        unordered bulk write by `flush_tweet_records`, and on exit from
+        the context (also on exception). The storage itself still writes
+        immediately, so runs sharing it do not share the buffer.
+        If the process is killed, buffered records are lost, so write
+        `PROCESSING` status first and flush it before the tweet is
+        processed:
+        ```
+        with storage.buffer_tweet_records() as records:
+            records.upsert_tweet_record(tweet_id, status="PROCESSING")
+            records.flush_tweet_records()
+            ...
+            records.upsert_tweet_record(tweet_id, status="PASSED")
+        ```
+        """
+        records = TweetRecordBuffer(self)
+        try:
+            yield records
+        finally:
+            records.flush_tweet_records()
+
+    def get_stale_processing_tweets(
+        self,
+        older_than: datetime,
+        limit: int = 100,
+        shard: Tuple[int, int] = None,
+    ) -> Dict[int, Optional[int]]:
+        """Returns tweets left in PROCESSING status since before
+        `older_than`, i.e. processing has been interrupted:
+        tweet_id -> user_id"""
+        return {
+            item["tweet_id"]: item.get("user_id")
+            for item in self.col_tweets.find(
+                {
+                    "status": "PROCESSING",
+                    "last_modified": {"$lt": older_than},
+                    **self._shard_filter(shard),
+                },
+                projection={"tweet_id": 1, "user_id": 1, "_id": False},
+                sort=[("last_modified", pymongo.ASCENDING)],
+                limit=limit,
+            )
+        }
+
+    def remove_processing_tweet_records(self, tweet_ids: List[int]):
+        """Removes records of tweets which processing has not started,
+        i.e. in `PROCESSING` status"""
+        if tweet_ids:
+            self.col_tweets.delete_many(
+                {"tweet_id": {"$in": tweet_ids}, "status": "PROCESSING"}
+            )
+
     def get_tweet_count_by_status(self) -> Dict[str, int]:
         return {
             s["_id"]: s["count"]
@@ -202,12 +540,15 @@ class SMVStorage(object):
     def add_todo_tweet(self, tweet_id: int):
         self.col_todo_tweets.insert_one({"tweet_id": tweet_id})
 
-    def get_todo_tweets(self, limit: int = 50) -> List[int]:
+    def get_todo_tweets(
+        self, limit: int = 50, shard: Tuple[int, int] = None
+    ) -> List[int]:
         return list(
             set(
                 [
                     item["tweet_id"]
                     for item in self.col_todo_tweets.find(
+                        self._shard_filter(shard),
                         limit=limit,
                     )
                 ]
@@ -240,3 +581,470 @@ class SMVStorage(object):
     def remove_todo_tweets(self, tweet_ids: List[int]):
         if tweet_ids:
             self.col_todo_tweets.delete_many({"tweet_id": {"$in": tweet_ids}})
+
+    def upsert_retry_tweet(
+        self,
+        tweet_id: int,
+        attempts: int,
+        error: str,
+        next_attempt: datetime = None,
+        user_id: int = None,
+    ):
+        """Schedules processing of the tweet again after a failure.
+
+        Args:
+            tweet_id (int): The id of the tweet
+            attempts (int): Number of failed attempts so far
+            error (str): Error message of the last attempt
+            next_attempt (datetime): When to retry, None - do not retry
+                (dead letter)
+            user_id (int): The author of the tweet, None - unknown (the
+                tweet is retried by shard 0, or the shard of the known one)
+        """
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+        data = {
+            "tweet_id": tweet_id,
+            "status": "RETRY" if next_attempt else "DEAD_LETTER",
+            "attempts": attempts,
+            "next_attempt": next_attempt,
+            "error": error,
+            "last_modified": now,
+        }
+        if user_id is not None:
+            data["user_id"] = user_id
+        self.col_retry_tweets.update_one(
+            {"_id": tweet_id},
+            {"$set": data, "$setOnInsert": {"created": now}},
+            upsert=True,
+        )
+
+    def get_due_retry_tweets(
+        self, limit: int = 100, shard: Tuple[int, int] = None
+    ) -> Dict[int, int]:
+        """Returns tweets to retry now: tweet_id -> failed attempts"""
+        return {
+            item["tweet_id"]: item["attempts"]
+            for item in self.col_retry_tweets.find(
+                {
+                    "status": "RETRY",
+                    "next_attempt": {
+                        "$lte": datetime.utcnow().replace(tzinfo=timezone.utc)
+                    },
+                    **self._shard_filter(shard),
+                },
+                sort=[("next_attempt", pymongo.ASCENDING)],
+                limit=limit,
+            )
+        }
+
+    def get_retry_attempts(self, tweet_ids: List[int]) -> Dict[int, int]:
+        """Returns number of failed attempts of tweets in the retry queue"""
+        if not tweet_ids:
+            return {}
+        return {
+            item["tweet_id"]: item["attempts"]
+            for item in self.col_retry_tweets.find(
+                {"_id": {"$in": tweet_ids}},
+                projection={"tweet_id": 1, "attempts": 1},
+            )
+        }
+
+    def remove_retry_tweets(self, tweet_ids: List[int]):
+        if tweet_ids:
+            self.col_retry_tweets.delete_many({"_id": {"$in": tweet_ids}})
+
+    def get_retry_count_by_status(self) -> Dict[str, int]:
+        return {
+            s["_id"]: s["count"]
+            for s in self.col_retry_tweets.aggregate(
+                [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+            )
+        }
+
+    def enqueue_reply(
+        self,
+        tweet_id: int,
+        user_id: int,
+        screen_name: str,
+        text: str,
+        message: str,
+    ):
+        """Adds reply to the tweet to the outbox (once per tweet).
+
+        Replies are sent by `/process-replies` handler.
+        """
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+        self.col_reply_outbox.update_one(
+            {"_id": tweet_id},
+            {
+                "$setOnInsert": {
+                    "tweet_id": tweet_id,
+                    "user_id": user_id,
+                    "screen_name": screen_name,
+                    "text": text,
+                    "message": message,
+                    "status": "PENDING",
+                    "attempts": 0,
+                    "next_attempt": now,
+                    "created": now,
+                    "last_modified": now,
+                },
+            },
+            upsert=True,
+        )
+
+    def get_pending_replies(self, limit: int) -> List[Dict[str, Any]]:
+        """Returns replies ready to be sent, the longest waiting first"""
+        if limit <= 0:
+            return []
+        return list(
+            self.col_reply_outbox.find(
+                {
+                    "status": "PENDING",
+                    "next_attempt": {
+                        "$lte": datetime.utcnow().replace(tzinfo=timezone.utc)
+                    },
+                },
+                sort=[("next_attempt", pymongo.ASCENDING)],
+                limit=limit,
+            )
+        )
+
+    def get_sent_reply_count(self, since: datetime) -> int:
+        return self.col_reply_outbox.count_documents(
+            {"status": "SENT", "sent": {"$gte": since}}
+        )
+
+    def mark_reply_sent(self, tweet_id: int):
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+        self.col_reply_outbox.update_one(
+            {"_id": tweet_id},
+            {
+                "$set": {"status": "SENT", "sent": now, "last_modified": now},
+                "$inc": {"attempts": 1},
+            },
+        )
+
+    def mark_reply_failed(
+        self, tweet_id: int, error: str, next_attempt: datetime = None
+    ):
+        """Records failed attempt to send the reply.
+
+        Args:
+            tweet_id (int): The id of the tweet
+            error (str): Error message
+            next_attempt (datetime): When to retry, None - do not retry
+        """
+        self.col_reply_outbox.update_one(
+            {"_id": tweet_id},
+            {
+                "$set": {
+                    "status": "PENDING" if next_attempt else "FAILED",
+                    "next_attempt": next_attempt,
+                    "error": error,
+                    "last_modified": datetime.utcnow().replace(
+                        tzinfo=timezone.utc
+                    ),
+                },
+                "$inc": {"attempts": 1},
+            },
+        )
+
+    def get_reply_count_by_status(self) -> Dict[str, int]:
+        return {
+            s["_id"]: s["count"]
+            for s in self.col_reply_outbox.aggregate(
+                [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+            )
+        }
+
+    def acquire_lease(
+        self, name: str, owner: str, ttl: float
+    ) -> Optional[int]:
+        """Acquires the lease if it is free, expired or already owned by
+        the owner.
+
+        Args:
+            name (str): Name of the lease
+            owner (str): Unique id of the lease holder
+            ttl (float): Lease expires after `ttl` seconds unless renewed
+
+        Returns:
+            Fencing token (increased with every acquisition), or None if the
+            lease is held by someone else
+        """
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+        try:
+            lease = self.col_leases.find_one_and_update(
+                {
+                    "_id": name,
+                    "$or": [{"expires": {"$lte": now}}, {"owner": owner}],
+                },
+                {
+                    "$set": {
+                        "owner": owner,
+                        "expires": now + timedelta(seconds=ttl),
+                        "acquired": now,
+                    },
+                    "$inc": {"token": 1},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # lease exists and is held by someone else
+            return None
+        return lease["token"]
+
+    def renew_lease(
+        self, name: str, owner: str, token: int, ttl: float
+    ) -> bool:
+        """Extends the lease, if it is still held with the token.
+
+        Returns:
+            False if the lease has been lost (expired and acquired by
+            someone else)
+        """
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+        return (
+            self.col_leases.update_one(
+                {"_id": name, "owner": owner, "token": token},
+                {"$set": {"expires": now + timedelta(seconds=ttl)}},
+            ).matched_count
+            == 1
+        )
+
+    def release_lease(self, name: str, owner: str, token: int):
+        """Releases the lease (keeps the token counter)"""
+        self.col_leases.update_one(
+            {"_id": name, "owner": owner, "token": token},
+            {
+                "$set": {
+                    "expires": datetime.utcnow().replace(tzinfo=timezone.utc)
+                }
+            },
+        )
+
+    def add_inbox_tweets(self, tweets: List[Dict[str, Any]]):
+        """Stores fetched tweets to be processed (by the shard).
+
+        Args:
+            tweets (list): dicts with fields: tweet_id, user_id,
+                screen_name, text and shard (index of the shard)
+        """
+        if tweets:
+            now = datetime.utcnow().replace(tzinfo=timezone.utc)
+            self.col_tweet_inbox.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": tweet["tweet_id"]},
+                        {"$setOnInsert": {**tweet, "created": now}},
+                        upsert=True,
+                    )
+                    for tweet in tweets
+                ],
+                ordered=False,
+            )
+
+    def get_inbox_tweets(
+        self, shard_index: int, limit: int = 1000
+    ) -> List[Dict[str, Any]]:
+        return list(
+            self.col_tweet_inbox.find(
+                {"shard": shard_index},
+                sort=[("tweet_id", pymongo.ASCENDING)],
+                limit=limit,
+            )
+        )
+
+    def get_inbox_tweet_count(self, shard_index: int) -> int:
+        return self.col_tweet_inbox.count_documents({"shard": shard_index})
+
+    def remove_inbox_tweets(self, tweet_ids: List[int]):
+        if tweet_ids:
+            self.col_tweet_inbox.delete_many({"_id": {"$in": tweet_ids}})
+
+    def get_ingestion_cursor(self, source: str) -> Dict[str, Any]:
+        """Returns position of tweet ingestion from the source.
+
+        Fields:
+            since_id: all tweets up to this id have been ingested
+            max_id: only if pagination is in progress - the next page
+                starts with this id
+            next_since_id: only if pagination is in progress - the newest
+                ingested tweet id
+        """
+        return self.col_ingestion_cursors.find_one({"_id": source}) or {
+            "_id": source
+        }
+
+    def get_ingestion_cursors(self) -> Dict[str, Optional[int]]:
+        return {
+            item["_id"]: item.get("since_id")
+            for item in self.col_ingestion_cursors.find()
+        }
+
+    def save_ingestion_page(self, source: str, max_id: int, newest_id: int):
+        """Stores progress of pagination after a page has been ingested"""
+        self.col_ingestion_cursors.update_one(
+            {"_id": source},
+            {
+                "$set": {
+                    "max_id": max_id,
+                    "last_modified": datetime.utcnow().replace(
+                        tzinfo=timezone.utc
+                    ),
+                },
+                "$max": {"next_since_id": newest_id},
+            },
+            upsert=True,
+        )
+
+    def advance_ingestion_cursor(self, source: str, since_id: Optional[int]):
+        """Finishes pagination: the next one starts after `since_id`.
+        The cursor never moves backwards."""
+        update = {
+            "$set": {
+                "last_modified": datetime.utcnow().replace(tzinfo=timezone.utc)
+            },
+            "$unset": {"max_id": "", "next_since_id": ""},
+        }
+        if since_id is None:
+            update["$setOnInsert"] = {"since_id": None}
+        else:
+            update["$max"] = {"since_id": since_id}
+        self.col_ingestion_cursors.update_one(
+            {"_id": source}, update, upsert=True
+        )
+
+    def bump_ingestion_cursor(self, source: str, since_id: int) -> bool:
+        """Moves the cursor forward to `since_id` (a tweet received another
+        way), unless a pagination is in progress - it would skip
+        the remaining pages.
+
+        Returns:
+            True if the cursor has been moved
+        """
+        result = self.col_ingestion_cursors.update_one(
+            {"_id": source, "max_id": {"$exists": False}},
+            {
+                "$set": {
+                    "last_modified": datetime.utcnow().replace(
+                        tzinfo=timezone.utc
+                    )
+                },
+                "$max": {"since_id": since_id},
+            },
+        )
+        return result.matched_count > 0
+
+    def get_signature_variant_counts(self) -> Dict[str, int]:
+        return {
+            item["_id"]: item["count"]
+            for item in self.col_signature_variants.find()
+        }
+
+    def increment_signature_variant_counts(self, counts: Dict[str, int]):
+        if counts:
+            self.col_signature_variants.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": variant},
+                        {"$inc": {"count": count}},
+                        upsert=True,
+                    )
+                    for variant, count in counts.items()
+                ],
+                ordered=False,
+            )
+
+    @staticmethod
+    def _verification_result_id(key: Tuple[str, str, str]) -> str:
+        # pubkey is hex, signature is base64 and handle is alphanumeric
+        return "|".join(key)
+
+    def get_verification_results(
+        self, keys: List[Tuple[str, str, str]]
+    ) -> Dict[Tuple[str, str, str], Optional[str]]:
+        ids = {self._verification_result_id(key): key for key in keys}
+        return {
+            ids[item["_id"]]: item["variant"]
+            for item in self.col_verification_results.find(
+                {"_id": {"$in": list(ids.keys())}}
+            )
+        }
+
+    def save_verification_results(
+        self, results: Dict[Tuple[str, str, str], Optional[str]]
+    ):
+        if results:
+            now = datetime.utcnow().replace(tzinfo=timezone.utc)
+            self.col_verification_results.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": self._verification_result_id(key)},
+                        {"$set": {"variant": variant, "last_modified": now}},
+                        upsert=True,
+                    )
+                    for key, variant in results.items()
+                ],
+                ordered=False,
+            )
+
+
+class TweetRecordBuffer(object):
+    """Tweet record upserts of one run, written in bulk (see
+    `SMVStorage.buffer_tweet_records`). Other calls go to the storage."""
+
+    def __init__(self, storage: SMVStorage) -> None:
+        self.storage = storage
+        # tweet_id -> fields to set
+        self._records: Dict[int, Dict[str, Any]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.storage, name)
+
+    def get_tweet_record(self, tweet_id: int) -> Optional[Any]:
+        if tweet_id in self._records:
+            return {"tweet_id": tweet_id, **self._records[tweet_id]}
+        return self.storage.get_tweet_record(tweet_id)
+
+    def upsert_tweet_record(
+        self,
+        tweet_id: int,
+        user_id: int = None,
+        screen_name: str = None,
+        text: str = None,
+        reply: str = None,
+        status: str = None,
+        description: str = None,
+    ):
+        # the later upsert of the same tweet wins
+        self._records.setdefault(tweet_id, {}).update(
+            tweet_record_data(
+                user_id=user_id,
+                screen_name=screen_name,
+                text=text,
+                reply=reply,
+                status=status,
+                description=description,
+            )
+        )
+
+    def flush_tweet_records(self) -> int:
+        """Writes buffered tweet records.
+
+        Returns:
+            Number of written records
+        """
+        if not self._records:
+            return 0
+        records, self._records = self._records, {}
+        self.storage.col_tweets.bulk_write(
+            [
+                UpdateOne({"tweet_id": tweet_id}, {"$set": data}, upsert=True)
+                for tweet_id, data in records.items()
+            ],
+            ordered=False,
+        )
+        return len(records)
@@ -2,9 +2,10 @@ from typing import Iterator, List, Optional
 import os
 import json
 from twython import Twython
-from twython.exceptions import TwythonError
+from twython.exceptions import TwythonError, TwythonRateLimitError
 
 from .secret import get_json_secret_from_gcp
+from .rate_limit import RateLimiter
 
 
 class Tweet(object):
@@ -46,6 +47,7 @@ class TwitterClient(object):
         self,
         *,
         gcp_secret_name: str,
+        rate_limit_max_wait: float = 60,
     ) -> None:
         """Twitter Client connects to Twitter API
         using credentials read from GCP Secret Manager
@@ -57,6 +59,9 @@ class TwitterClient(object):
 
             Note: GCP secret name has format: projects/*/secrets/*/versions/*
 
+            rate_limit_max_wait (float): Max seconds to wait for the rate
+            limit of an endpoint to be reset
+
         Raises:
             json.JSONDecodeError: If the secret value is not valid json.
 
@@ -87,6 +92,10 @@ class TwitterClient(object):
             self._access_token,
             self._access_secret,
         )
+        self.rate_limits = RateLimiter(max_wait=rate_limit_max_wait)
+        self.twapi.client.hooks["response"].append(
+            self.rate_limits.on_response
+        )
 
     def get_by_id(self, tweet_id: int) -> Optional[Tweet]:
         """Returns one tweet specified by id.
@@ -99,6 +108,7 @@ class TwitterClient(object):
         """
 
         try:
+            self.rate_limits.acquire("statuses/show")
             result = self.twapi.show_status(
                 id=tweet_id,
                 include_entities=True,
@@ -116,19 +126,65 @@ class TwitterClient(object):
 
         return None
 
-    def search(
+    def get_by_ids(
+        self, tweet_ids: List[int], batch_size: int = 100
+    ) -> List[Tweet]:
+        """Returns tweets specified by ids, up to 100 tweets per API call.
+
+        Args:
+            tweet_ids (list): The ids of the tweets to return
+            batch_size (int): Number of tweets per API call (max 100)
+
+        Returns:
+            List of found Tweets, in order of tweet_ids
+
+        Raises:
+            TwythonRateLimitError: If out of the rate limit
+        """
+        tweets = {}
+        for start in range(0, len(tweet_ids), batch_size):
+            end = start + batch_size
+            try:
+                self.rate_limits.acquire("statuses/lookup")
+                result = self.twapi.lookup_status(
+                    id=",".join(
+                        str(tweet_id) for tweet_id in tweet_ids[start:end]
+                    ),
+                    include_entities=True,
+                    tweet_mode="extended",
+                )
+            except TwythonRateLimitError:
+                raise
+            except TwythonError:
+                continue
+
+            for tweet_data in result:
+                tweets[tweet_data["id"]] = Tweet(
+                    tweet_id=tweet_data["id"],
+                    user_id=tweet_data["user"]["id"],
+                    user_screen_name=tweet_data["user"]["screen_name"],
+                    full_text=tweet_data["full_text"],
+                )
+
+        return [
+            tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets
+        ]
+
+    def search_pages(
         self,
         search_text: str,
         since_tweet_id: int = None,
-    ) -> Iterator[Tweet]:
+        max_tweet_id: int = None,
+    ) -> Iterator[List[Tweet]]:
         """Searches for recent tweets contining specified text.
 
         Args:
             search_text (str): A text that tweet needs to contain
             since_tweet_id (int): Return only tweets newer than
+            max_tweet_id (int): Return only tweets older than or equal to
 
         Returns:
-            Iterator with Tweet
+            Iterator with pages of Tweets, from newest to oldest
         """
 
         query = {
@@ -140,34 +196,60 @@ class TwitterClient(object):
 
         if since_tweet_id:
             query["since_id"] = since_tweet_id
+        if max_tweet_id:
+            query["max_id"] = max_tweet_id
 
         while True:
+            self.rate_limits.acquire("search/tweets")
             result = self.twapi.search(**query)
-            for tweet_data in result["statuses"]:
-                yield Tweet(
+            page = [
+                Tweet(
                     tweet_id=tweet_data["id"],
                     user_id=tweet_data["user"]["id"],
                     user_screen_name=tweet_data["user"]["screen_name"],
                     full_text=tweet_data["full_text"],
                 )
+                for tweet_data in result["statuses"]
+            ]
+            if page:
+                yield page
 
-            if "next_results" not in result["search_metadata"]:
+            if not page or "next_results" not in result["search_metadata"]:
                 break
 
-            query["max_id"] = tweet_data["id"] - 1
+            query["max_id"] = page[-1].tweet_id - 1
 
-    def mentions(
+    def search(
         self,
+        search_text: str,
         since_tweet_id: int = None,
     ) -> Iterator[Tweet]:
-        """Get Tweet timelines
+        """Searches for recent tweets contining specified text.
 
         Args:
+            search_text (str): A text that tweet needs to contain
             since_tweet_id (int): Return only tweets newer than
 
         Returns:
             Iterator with Tweet
         """
+        for page in self.search_pages(search_text, since_tweet_id):
+            yield from page
+
+    def mentions_pages(
+        self,
+        since_tweet_id: int = None,
+        max_tweet_id: int = None,
+    ) -> Iterator[List[Tweet]]:
+        """Get Tweet timelines
+
+        Args:
+            since_tweet_id (int): Return only tweets newer than
+            max_tweet_id (int): Return only tweets older than or equal to
+
+        Returns:
+            Iterator with pages of Tweets, from newest to oldest
+        """
 
         query = {
             "count": 100,
@@ -177,22 +259,43 @@ class TwitterClient(object):
 
         if since_tweet_id:
             query["since_id"] = since_tweet_id
+        if max_tweet_id:
+            query["max_id"] = max_tweet_id
 
         while True:
+            self.rate_limits.acquire("statuses/mentions_timeline")
             result = self.twapi.get_mentions_timeline(**query)
 
             if len(result) == 0:
                 break
 
-            for tweet_data in result:
-                yield Tweet(
+            page = [
+                Tweet(
                     tweet_id=tweet_data["id"],
                     user_id=tweet_data["user"]["id"],
                     user_screen_name=tweet_data["user"]["screen_name"],
                     full_text=tweet_data["full_text"],
                 )
+                for tweet_data in result
+            ]
+            yield page
+
+            query["max_id"] = page[-1].tweet_id - 1
+
+    def mentions(
+        self,
+        since_tweet_id: int = None,
+    ) -> Iterator[Tweet]:
+        """Get Tweet timelines
+
+        Args:
+            since_tweet_id (int): Return only tweets newer than
 
-            query["max_id"] = tweet_data["id"] - 1
+        Returns:
+            Iterator with Tweet
+        """
+        for page in self.mentions_pages(since_tweet_id):
+            yield from page
 
     def get_tweets(
         self,
@@ -220,6 +323,19 @@ class TwitterClient(object):
 
         return result
 
+    def rate_limit_remaining(self) -> Optional[int]:
+        """Returns number of API calls left in the current rate limit window
+        of the last called endpoint, None if unknown"""
+        try:
+            remaining = self.twapi.get_lastfunction_header(
+                "x-rate-limit-remaining"
+            )
+        except TwythonError:
+            return None
+        if remaining is None:
+            return None
+        return int(remaining)
+
     def reply(self, msg: str, tweet: Tweet):
         msg = f"@{tweet.user_screen_name} {msg}"
         print(
@@ -233,6 +349,7 @@ class TwitterClient(object):
                 }
             )
         )
+        self.rate_limits.acquire("statuses/update")
         self.twapi.update_status(
             status=msg,
             in_reply_to_status_id=tweet.tweet_id,
@@ -0,0 +1,103 @@
+from typing import Any, Dict, Iterator, Optional
+import json
+import requests
+from twython.exceptions import TwythonStreamError
+
+from .twitter import TwitterClient, Tweet
+
+
+def stream_tweet(status: Dict[str, Any]) -> Tweet:
+    """Returns Tweet of a status received from the stream. Texts longer
+    than 140 characters are in `extended_tweet`."""
+    full_text = status.get("extended_tweet", {}).get("full_text")
+    if full_text is None:
+        full_text = status.get("full_text", status.get("text"))
+    return Tweet(
+        tweet_id=status["id"],
+        user_id=status["user"]["id"],
+        user_screen_name=status["user"]["screen_name"],
+        full_text=full_text,
+    )
+
+
+class TwitterStream(object):
+    """Filtered stream of tweets (statuses/filter) matching `track`.
+
+    Iterating the stream yields tweets as they arrive, and None for every
+    keep-alive newline (sent every 30 seconds), so an idle consumer still
+    gets control regularly. The iteration ends with TwythonStreamError
+    when the stream is disconnected.
+    """
+
+    def __init__(
+        self,
+        twclient: TwitterClient,
+        track: str,
+        url: str,
+        timeout: float = 90,
+    ) -> None:
+        """
+        Args:
+            twclient (TwitterClient): Client which credentials are used
+            track (str): Phrases to match, e.g. "@account"
+            url (str): URL of the filtered stream endpoint
+            timeout (float): Seconds without any data (not even
+            a keep-alive) after which the stream is considered stalled
+        """
+        self.track = track
+        self.url = url
+        self.timeout = timeout
+        # Number of matching tweets not delivered since connected
+        # (Twitter limit notices)
+        self.dropped_count = 0
+        # Own session, the long-lived connection is not shared with
+        # API calls
+        self._session = requests.Session()
+        self._session.auth = twclient.twapi.client.auth
+        self._session.headers.update(twclient.twapi.client.headers)
+        self._response: Optional[requests.Response] = None
+
+    def connect(self) -> "TwitterStream":
+        response = self._session.post(
+            self.url,
+            data={"track": self.track, "stall_warnings": "true"},
+            stream=True,
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            response.close()
+            raise TwythonStreamError(
+                "Failed to connect to the stream.",
+                error_code=response.status_code,
+            )
+        self._response = response
+        return self
+
+    def __iter__(self) -> Iterator[Optional[Tweet]]:
+        if self._response is None:
+            raise TwythonStreamError("The stream is not connected.")
+        for line in self._response.iter_lines():
+            if not line:
+                # keep-alive
+                yield None
+                continue
+            message = json.loads(line)
+            if "limit" in message:
+                # number of undelivered tweets since connected
+                self.dropped_count = max(
+                    self.dropped_count, message["limit"].get("track", 0)
+                )
+            elif "disconnect" in message:
+                raise TwythonStreamError(
+                    "The stream has been disconnected: "
+                    f"{message['disconnect'].get('reason')}",
+                    error_code=message["disconnect"].get("code"),
+                )
+            elif "id" in message and "user" in message:
+                yield stream_tweet(message)
+        raise TwythonStreamError("The stream has been closed.")
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+        self._session.close()
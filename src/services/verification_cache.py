@@ -0,0 +1,91 @@
+from typing import Dict, Iterable, Optional, Tuple
+from collections import OrderedDict
+
+from .smv_storage import SMVStorage
+
+# (pubkey, signed message, twitter handle)
+VerificationKey = Tuple[str, str, str]
+
+
+class VerificationCache(object):
+    """Bounded LRU cache of signature verification results.
+
+    A result is the name of the matched message variant, or None if the
+    signature is invalid. Results are optionally persisted in MongoDB, so they
+    survive restarts and are shared between instances.
+    """
+
+    def __init__(self, max_size: int = 10000, storage: SMVStorage = None):
+        self.max_size = max_size
+        self.storage = storage
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._results: "OrderedDict[VerificationKey, Optional[str]]" = (
+            OrderedDict()
+        )
+        self._unsaved: Dict[VerificationKey, Optional[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def _remember(self, key: VerificationKey, variant: Optional[str]):
+        self._results[key] = variant
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def get_many(
+        self, keys: Iterable[VerificationKey]
+    ) -> Dict[VerificationKey, Optional[str]]:
+        """Looks up verification results: memory first, then MongoDB
+        (in one query).
+
+        Args:
+            keys (list): (pubkey, signed message, twitter handle)
+
+        Returns:
+            Dict with results of found keys only
+        """
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if key in self._results:
+                self._results.move_to_end(key)
+                found[key] = self._results[key]
+                self.hits += 1
+            else:
+                missing.append(key)
+
+        persisted = {}
+        if missing and self.storage is not None:
+            persisted = self.storage.get_verification_results(missing)
+            for key, variant in persisted.items():
+                self._remember(key, variant)
+                found[key] = variant
+        self.persistent_hits += len(persisted)
+        self.misses += len(missing) - len(persisted)
+        return found
+
+    def put(self, key: VerificationKey, variant: Optional[str]):
+        """Stores verification result.
+
+        Note: results are saved to MongoDB on `flush`
+        """
+        self._remember(key, variant)
+        if self.storage is not None:
+            self._unsaved[key] = variant
+
+    def flush(self):
+        """Saves new results to MongoDB"""
+        if self._unsaved:
+            unsaved, self._unsaved = self._unsaved, {}
+            self.storage.save_verification_results(unsaved)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._results),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,202 @@
+from typing import Any, Dict, Optional
+
+# Order of ed25519 base point
+ED25519_L = 2**252 + 27742317777372353535851937790883648493
+# Field prime
+ED25519_P = 2**255 - 19
+# Y coordinates of points of small order (1, 2, 4 and 8)
+_ED25519_SMALL_ORDER_Y = {
+    0,
+    1,
+    ED25519_P - 1,
+    2707385501144840649318225287225658788936804267575313519463743609750303402022,  # noqa: E501
+    55188659117513257062467267217118295137698188065244968500265048394206261417927,  # noqa: E501
+}
+
+
+def _point_y(encoded_point: bytes) -> int:
+    # the highest bit is the sign of x coordinate
+    return int.from_bytes(encoded_point, "little") & ((1 << 255) - 1)
+
+
+def is_strict_signature(pub_key: bytes, signature: bytes) -> bool:
+    """Rejects keys and signatures crypto libraries disagree on.
+
+    Libraries differ in how strict they are, e.g. ed25519==1.5 accepts
+    non-canonical signatures (S >= L) and small order keys, libsodium does
+    not. Run this check (the same rules as libsodium) before verifying with
+    any backend, so all of them return the same results.
+
+    Args:
+        pub_key (bytes): Encoded public key
+        signature (bytes): Signature: encoded point R and scalar S
+
+    Returns:
+        True if key and signature can be verified
+    """
+    if len(pub_key) != 32 or len(signature) != 64:
+        return False
+    if int.from_bytes(signature[32:], "little") >= ED25519_L:
+        return False
+    key_y = _point_y(pub_key)
+    if key_y >= ED25519_P:
+        return False
+    if key_y in _ED25519_SMALL_ORDER_Y:
+        return False
+    if _point_y(signature[:32]) % ED25519_P in _ED25519_SMALL_ORDER_Y:
+        return False
+    return True
+
+
+class SignatureVerifier(object):
+    """Verifies ed25519 signatures with a crypto library.
+
+    Usage:
+    ```
+    verifier = get_verifier("nacl")
+    if is_strict_signature(pub_key, signature):
+        key = verifier.load_key(pub_key)  # once per key
+        if key is not None and verifier.verify(key, signature, message):
+            ...
+    ```
+    """
+
+    name = ""
+
+    def load_key(self, pub_key: bytes) -> Optional[Any]:
+        """Decodes public key.
+
+        Args:
+            pub_key (bytes): Encoded public key
+
+        Returns:
+            Library's public key object or None if the key is malformed
+        """
+        try:
+            return self._load_key(pub_key)
+        except Exception:
+            return None
+
+    def verify(self, key: Any, signature: bytes, message: bytes) -> bool:
+        """Verifies signature of the message.
+
+        Args:
+            key: Public key returned by `load_key`
+            signature (bytes): Signature
+            message (bytes): Signed message
+
+        Returns:
+            True if signature is valid
+        """
+        try:
+            return self._verify(key, signature, message)
+        except Exception:
+            return False
+
+    def _load_key(self, pub_key: bytes) -> Any:
+        raise NotImplementedError()
+
+    def _verify(self, key: Any, signature: bytes, message: bytes) -> bool:
+        raise NotImplementedError()
+
+
+class Ed25519Verifier(SignatureVerifier):
+    """ed25519 package (SUPERCOP reference implementation)"""
+
+    name = "ed25519"
+
+    def __init__(self) -> None:
+        import ed25519
+
+        self._ed25519 = ed25519
+
+    def _load_key(self, pub_key: bytes) -> Any:
+        return self._ed25519.VerifyingKey(pub_key)
+
+    def _verify(self, key: Any, signature: bytes, message: bytes) -> bool:
+        try:
+            key.verify(signature, message)
+            return True
+        except self._ed25519.BadSignatureError:
+            return False
+
+
+class NaClVerifier(SignatureVerifier):
+    """PyNaCl package (libsodium)"""
+
+    name = "nacl"
+
+    def __init__(self) -> None:
+        from nacl.signing import VerifyKey
+        from nacl.exceptions import BadSignatureError
+
+        self._verify_key_class = VerifyKey
+        self._bad_signature_error = BadSignatureError
+
+    def _load_key(self, pub_key: bytes) -> Any:
+        return self._verify_key_class(pub_key)
+
+    def _verify(self, key: Any, signature: bytes, message: bytes) -> bool:
+        try:
+            key.verify(message, signature)
+            return True
+        except self._bad_signature_error:
+            return False
+
+
+class CryptographyVerifier(SignatureVerifier):
+    """cryptography package (OpenSSL)"""
+
+    name = "cryptography"
+
+    def __init__(self) -> None:
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+            Ed25519PublicKey,
+        )
+        from cryptography.exceptions import InvalidSignature
+
+        self._public_key_class = Ed25519PublicKey
+        self._invalid_signature = InvalidSignature
+
+    def _load_key(self, pub_key: bytes) -> Any:
+        return self._public_key_class.from_public_bytes(pub_key)
+
+    def _verify(self, key: Any, signature: bytes, message: bytes) -> bool:
+        try:
+            key.verify(signature, message)
+            return True
+        except self._invalid_signature:
+            return False
+
+
+VERIFIERS = {
+    verifier_class.name: verifier_class
+    for verifier_class in [Ed25519Verifier, NaClVerifier, CryptographyVerifier]
+}
+
+DEFAULT_VERIFIER = NaClVerifier.name
+
+_verifiers: Dict[str, SignatureVerifier] = {}
+
+
+def get_verifier(name: str = DEFAULT_VERIFIER) -> SignatureVerifier:
+    """Returns signature verifier backed by a crypto library.
+
+    Args:
+        name (str): Name of the backend: ed25519, nacl or cryptography
+
+    Returns:
+        SignatureVerifier (one instance per backend)
+
+    Raises:
+        ValueError: If backend is unknown.
+        ImportError: If backend library is not installed.
+    """
+    if name not in _verifiers:
+        if name not in VERIFIERS:
+            raise ValueError(
+                f'Unknown signature verifier "{name}", available: '
+                f"{', '.join(VERIFIERS.keys())}"
+            )
+        _verifiers[name] = VERIFIERS[name]()
+    return _verifiers[name]
@@ -0,0 +1,53 @@
+"""Long-running ingestion of tweets from Twitter filtered stream,
+an alternative to polling with `/process-tweets` (see
+`handlers.stream_tweets.run_filter_stream`).
+
+Uses the same environment variables as the Cloud Function.
+
+Usage:
+    python stream.py
+"""
+
+import flask
+import os
+import sys
+from common import SMVConfig
+from handlers import run_filter_stream
+from services.smv_storage import SMVStorage
+from services.twitter import TwitterClient
+from services.verification_cache import VerificationCache
+
+
+def main() -> int:
+    config = SMVConfig.from_env()
+    storage = SMVStorage.get_storage(
+        gcp_secret_name=os.environ["MONGO_SECRET_NAME"],
+    )
+    storage.ensure_indexes()
+    twclient = TwitterClient(
+        gcp_secret_name=os.environ["TWITTER_SECRET_NAME"],
+        rate_limit_max_wait=float(
+            os.getenv("TWITTER_RATE_LIMIT_MAX_WAIT", "60")
+        ),
+    )
+    verification_cache = VerificationCache(
+        max_size=int(os.getenv("VERIFICATION_CACHE_SIZE", "10000")),
+        storage=(
+            storage
+            if os.getenv("VERIFICATION_CACHE_PERSISTENT", "false") == "true"
+            else None
+        ),
+    )
+    # backfill reuses `/process-tweets` handler
+    with flask.Flask(__name__).app_context():
+        started = run_filter_stream(
+            storage=storage,
+            twclient=twclient,
+            config=config,
+            verification_cache=verification_cache,
+        )
+    return 0 if started else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Time and peak memory to serve `/parties`: streamed with server-side
+filter and projection (`iter_parties` + `iter_json_array`) and the previous
+implementation (all documents read, blocked filtered out in Python, whole
+list passed to `flask.jsonify`).
+
+Without MongoDB, documents are generated in memory (serialization only).
+With MongoDB (the same environment variables as integration tests:
+MONGO_DB_USER, MONGO_DB_PASS, MONGO_DB_HOSTNAME, MONGO_DB_NAME with "local"
+in the name) `identities` collection is filled with random parties.
+
+Usage:
+    PYTHONPATH=src:tests/benchmark ./tests/benchmark/parties.py
+"""
+
+import argparse
+import json
+import os
+import random
+import tracemalloc
+from datetime import datetime, timezone
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import flask
+
+from services.json_stream import iter_json_array
+from services.smv_storage import SMVStorage
+
+CREATED = datetime(2021, 9, 13, tzinfo=timezone.utc)
+
+
+def random_identities(
+    count: int, blocked_ratio: float
+) -> Iterator[Dict[str, Any]]:
+    for i in range(count):
+        yield {
+            "pub_key": f"{random.getrandbits(256):064x}",
+            "twitter_handle": f"user_{i}",
+            "twitter_user_id": random.getrandbits(62),
+            "created": CREATED,
+            "last_modified": CREATED,
+            "blocked": (
+                "Sign up matched multiple parties"
+                if random.random() < blocked_ratio
+                else None
+            ),
+        }
+
+
+def party(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "party_id": item["pub_key"],
+        "twitter_handle": item["twitter_handle"],
+        "twitter_user_id": item["twitter_user_id"],
+        "last_modified": int(
+            item["last_modified"].replace(tzinfo=timezone.utc).timestamp()
+        ),
+        "created": int(
+            item["created"].replace(tzinfo=timezone.utc).timestamp()
+        ),
+    }
+
+
+def legacy_response(documents: Iterable[Dict[str, Any]]) -> int:
+    parties = [
+        party(item) for item in documents if item.get("blocked", None) is None
+    ]
+    return len(flask.jsonify(parties).get_data())
+
+
+def streamed_response(parties: Iterable[Dict[str, Any]]) -> int:
+    return sum(
+        len(chunk.encode()) for chunk in iter_json_array(parties, pretty=True)
+    )
+
+
+def run(f: Callable[[], int]):
+    """Returns time in seconds, peak memory in bytes and response size"""
+    start = timer()
+    size = f()
+    elapsed = timer() - start
+    tracemalloc.start()
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def report(name: str, results: List[tuple]):
+    (legacy_time, legacy_peak, legacy_size), (time, peak, size) = results
+    assert size == legacy_size
+    print(
+        f"\t{name}: {time * 1000:.0f} ms, peak {peak / 2**20:.1f} MiB"
+        f" (previous implementation {legacy_time * 1000:.0f} ms,"
+        f" peak {legacy_peak / 2**20:.1f} MiB), response"
+        f" {size / 2**20:.1f} MiB"
+    )
+
+
+def mongodb_storage() -> Optional[SMVStorage]:
+    names = ["USER", "PASS", "HOSTNAME", "NAME"]
+    secret = {f"DB_{name}": os.getenv(f"MONGO_DB_{name}") for name in names}
+    if not all(secret.values()):
+        return None
+    assert "local" in secret["DB_NAME"]
+    os.environ["BENCHMARK_MONGO_SECRET"] = json.dumps(
+        {**secret, "SCHEME": "mongodb"}
+    )
+    return SMVStorage.get_storage(gcp_secret_name="BENCHMARK_MONGO_SECRET")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--identities", type=int, nargs="+", default=[100000, 1000000]
+    )
+    parser.add_argument("--blocked-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    app = flask.Flask("benchmark")
+    app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
+    storage = mongodb_storage()
+    if storage is None:
+        print("No MongoDB configured, serialization only")
+
+    for count in args.identities:
+        print(f"identities={count}, blocked_ratio={args.blocked_ratio}")
+        documents = list(random_identities(count, args.blocked_ratio))
+        with app.app_context():
+            report(
+                "serialization",
+                [
+                    run(lambda: legacy_response(iter(documents))),
+                    run(
+                        lambda: streamed_response(
+                            party(item)
+                            for item in documents
+                            if item["blocked"] is None
+                        )
+                    ),
+                ],
+            )
+            if storage is None:
+                continue
+            storage.db.drop_collection("identities")
+            for start in range(0, count, 10000):
+                storage.col_identities.insert_many(
+                    documents[start : start + 10000]  # noqa: E203
+                )
+            storage.ensure_indexes()
+            del documents
+            report(
+                "mongodb",
+                [
+                    run(
+                        lambda: legacy_response(storage.col_identities.find())
+                    ),
+                    run(lambda: streamed_response(storage.iter_parties())),
+                ],
+            )
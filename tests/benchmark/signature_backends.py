@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Verifications per second of signature verification backends.
+
+Usage:
+    PYTHONPATH=src:tests/benchmark ./tests/benchmark/signature_backends.py
+"""
+
+import argparse
+import base64
+
+from tools import TWITTER_HANDLE, measure, signed_tweet
+from services.verifier import VERIFIERS, get_verifier
+from handlers.process_tweets import (
+    candidate_digests,
+    load_signature,
+    parse_tweet_message,
+    validate_signature,
+)
+from common import TweetInvalidSignatureError
+
+
+def signatures(count: int, valid: bool):
+    result = []
+    for tweet_id in range(count):
+        tweet = signed_tweet(tweet_id, valid=valid)
+        pubkey, sig = parse_tweet_message(tweet.full_text, TWITTER_HANDLE)
+        result.append((pubkey, sig, tweet.user_screen_name))
+    return result
+
+
+def verify_all(name: str, items) -> int:
+    verifier = get_verifier(name)
+    valid_count = 0
+    for pubkey, sig, screen_name in items:
+        loaded = load_signature(sig, pubkey, verifier)
+        digest = candidate_digests(screen_name)["@handle"]
+        if loaded and verifier.verify(*loaded, digest):
+            valid_count += 1
+    return valid_count
+
+
+def validate_all(name: str, items) -> int:
+    verifier = get_verifier(name)
+    valid_count = 0
+    for pubkey, sig, screen_name in items:
+        try:
+            validate_signature(pubkey, sig, screen_name, verifier=verifier)
+            valid_count += 1
+        except TweetInvalidSignatureError:
+            pass
+    return valid_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signatures", type=int, default=200)
+    args = parser.parse_args()
+
+    valid = signatures(args.signatures, valid=True)
+    invalid = signatures(args.signatures, valid=False)
+    # flip one bit in the signature
+    corrupted = [
+        (
+            pubkey,
+            base64.b64encode(
+                bytes([base64.b64decode(sig)[0] ^ 1])
+                + base64.b64decode(sig)[1:]
+            ).decode(),
+            screen_name,
+        )
+        for pubkey, sig, screen_name in valid
+    ]
+
+    names = []
+    for name in VERIFIERS:
+        try:
+            get_verifier(name)
+            names.append(name)
+        except ImportError:
+            print(f"{name}: not installed")
+
+    print(f"signatures={args.signatures}")
+    for name in names:
+        # all backends must agree
+        assert verify_all(name, valid) == len(valid)
+        assert verify_all(name, corrupted) == 0
+        assert validate_all(name, invalid) == 0
+
+        valid_rate = len(valid) / measure(lambda: verify_all(name, valid))
+        invalid_rate = len(corrupted) / measure(
+            lambda: verify_all(name, corrupted)
+        )
+        rejected_rate = len(invalid) / measure(
+            lambda: validate_all(name, invalid), repeat=1
+        )
+        print(
+            f"\t{name}: valid {valid_rate:.0f} verifications/s,"
+            f" invalid {invalid_rate:.0f} verifications/s,"
+            f" rejected sign-ups (all variants) {rejected_rate:.1f}/s"
+        )
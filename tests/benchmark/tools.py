@@ -0,0 +1,65 @@
+from typing import Callable, List
+import base64
+import random
+import string
+from timeit import default_timer as timer
+import ed25519
+
+from services.twitter import Tweet
+from handlers.process_tweets import message_digest
+
+TWITTER_HANDLE = "@smv_account"
+
+
+def random_screen_name() -> str:
+    return "".join(
+        random.choices(
+            string.ascii_letters + string.digits + "_",
+            k=random.randrange(5, 15),
+        )
+    )
+
+
+def signed_tweet(tweet_id: int, valid: bool = True, message: str = None):
+    """Sign-up tweet with a fresh key.
+
+    Args:
+        tweet_id (int): Id of the tweet
+        valid (bool): Sign user's handle, or something else if False
+        message (str): Signed message, "@{screen_name}" by default
+    """
+    screen_name = random_screen_name()
+    signing_key, verifying_key = ed25519.create_keypair()
+    if message is None:
+        message = f"@{screen_name}"
+    if not valid:
+        message = f"@{screen_name}_not"
+    sig = base64.b64encode(signing_key.sign(message_digest(message))).decode()
+    return Tweet(
+        tweet_id=tweet_id,
+        user_id=tweet_id * 10,
+        user_screen_name=screen_name,
+        full_text=(
+            f"I'm taking a ride on {TWITTER_HANDLE} "
+            f"{verifying_key.to_bytes().hex()} {sig} https://vega.xyz"
+        ),
+    )
+
+
+def signed_tweets(count: int, invalid_ratio: float = 0.5) -> List[Tweet]:
+    return [
+        signed_tweet(tweet_id, valid=random.random() >= invalid_ratio)
+        for tweet_id in range(1, count + 1)
+    ]
+
+
+def measure(f: Callable[[], object], repeat: int = 3) -> float:
+    """Returns the best execution time of `f` in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        f()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Tweets per second parsed by the single-pass tweet parser and by the
+previous implementation (three separate regular expressions).
+
+Usage:
+    PYTHONPATH=src:tests/benchmark ./tests/benchmark/tweet_parser.py
+"""
+
+import argparse
+import random
+import re
+
+from tools import TWITTER_HANDLE, measure, random_screen_name, signed_tweet
+from handlers.process_tweets import parse_tweet_message
+from common import TweetInvalidFormatError
+
+
+def legacy_parse_tweet_message(msg: str, twitter_handle: str):
+    if not re.search(rf"(^|.*){twitter_handle}([^a-zA-Z0-9_]|$)", msg):
+        raise TweetInvalidFormatError("Missing twitter handle.")
+    m = re.search(r"(^|[^0-9a-fA-F])([0-9a-fA-F]{64,64})([^0-9a-fA-F]|$)", msg)
+    if not m:
+        raise TweetInvalidFormatError("Missing pubkey.")
+    pubkey = m.group(2)
+    m = re.search(r"(^|[^a-zA-Z0-9/+])([a-zA-Z0-9/+]{60,}==)(.*|$)", msg)
+    if not m:
+        raise TweetInvalidFormatError("Missing signature.")
+    return pubkey, m.group(2)
+
+
+def non_matching_text() -> str:
+    """Mentions of the account without a sign-up message"""
+    words = [random_screen_name() for _ in range(random.randrange(5, 40))]
+    words.insert(random.randrange(len(words)), TWITTER_HANDLE)
+    return " ".join(words)
+
+
+def parse_all(parse, texts) -> int:
+    parsed_count = 0
+    for text in texts:
+        try:
+            parse(text, TWITTER_HANDLE)
+            parsed_count += 1
+        except TweetInvalidFormatError:
+            pass
+    return parsed_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tweets", type=int, default=20000)
+    args = parser.parse_args()
+
+    sign_ups = [signed_tweet(i).full_text for i in range(args.tweets // 2)]
+    corpus = {
+        "matching": sign_ups,
+        "non-matching": [non_matching_text() for _ in range(args.tweets)],
+        "no handle": [text.replace("@", "#") for text in sign_ups],
+    }
+
+    print(f"tweets={args.tweets}")
+    for name, texts in corpus.items():
+        # both parsers must agree
+        assert [parse_all(parse_tweet_message, [text]) for text in texts] == [
+            parse_all(legacy_parse_tweet_message, [text]) for text in texts
+        ]
+
+        legacy_rate = len(texts) / measure(
+            lambda: parse_all(legacy_parse_tweet_message, texts)
+        )
+        rate = len(texts) / measure(
+            lambda: parse_all(parse_tweet_message, texts)
+        )
+        print(
+            f"\t{name}: {rate:.0f} tweets/s"
+            f" (previous implementation {legacy_rate:.0f} tweets/s,"
+            f" x{rate / legacy_rate:.1f})"
+        )
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Time to ingest new tweets from search and mentions into the inbox:
+both sources fetched concurrently (`ingest_tweets`, as `/process-tweets`
+does) and one after another (previous implementation), from a local fake
+Twitter API with configurable latency.
+
+Usage:
+    PYTHONPATH=src:tests/benchmark ./tests/benchmark/twitter_fetch.py
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from tools import measure
+from common import SMVConfig
+from services.onelog import OneLog
+from services.twitter import TwitterClient
+from handlers.process_tweets import inbox_item, ingest_tweets
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+    """Serves search/tweets and statuses/mentions_timeline pages"""
+
+    latency = 0.0
+    search_ids = []
+    mention_ids = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        time.sleep(self.latency)
+        if url.path.endswith("/search/tweets.json"):
+            tweet_ids = self.search_ids
+        elif url.path.endswith("/statuses/mentions_timeline.json"):
+            tweet_ids = self.mention_ids
+        else:
+            self.send_error(404)
+            return
+
+        max_id = int(query["max_id"][0]) if "max_id" in query else None
+        since_id = int(query["since_id"][0]) if "since_id" in query else 0
+        count = int(query.get("count", ["100"])[0])
+        matching_ids = [
+            tweet_id
+            for tweet_id in tweet_ids
+            if tweet_id > since_id and (max_id is None or tweet_id <= max_id)
+        ]
+        statuses = [
+            {
+                "id": tweet_id,
+                "full_text": f"Tweet {tweet_id}",
+                "user": {"id": tweet_id, "screen_name": f"user_{tweet_id}"},
+            }
+            for tweet_id in matching_ids[:count]
+        ]
+        if tweet_ids is self.search_ids:
+            metadata = {}
+            if len(matching_ids) > count:
+                metadata["next_results"] = "?max_id"
+            body = {"statuses": statuses, "search_metadata": metadata}
+        else:
+            body = statuses
+
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def fake_twitter_client(port: int) -> TwitterClient:
+    os.environ["BENCHMARK_TWITTER_SECRET"] = json.dumps(
+        {
+            "ACCOUNT_NAME": "smv_account",
+            "CONSUMER_KEY": "key",
+            "CONSUMER_SECRET": "secret",
+            "ACCESS_TOKEN": "token",
+            "ACCESS_SECRET": "secret",
+        }
+    )
+    twclient = TwitterClient(gcp_secret_name="BENCHMARK_TWITTER_SECRET")
+    twclient.twapi.api_url = f"http://127.0.0.1:{port}/%s"
+    return twclient
+
+
+class InboxStorage(object):
+    """Inbox and ingestion cursors kept in memory"""
+
+    def __init__(self):
+        self.inbox = {}
+        self.cursors = {}
+
+    def get_ingestion_cursor(self, source):
+        return {
+            "_id": source,
+            "since_id": None,
+            **self.cursors.get(source, {}),
+        }
+
+    def get_last_tweet_id(self):
+        return None
+
+    def advance_ingestion_cursor(self, source, since_id):
+        self.cursors[source] = {"since_id": since_id}
+
+    def save_ingestion_page(self, source, max_id, newest_id):
+        self.cursors[source] = {
+            **self.cursors.get(source, {}),
+            "max_id": max_id,
+            "next_since_id": newest_id,
+        }
+
+    def add_inbox_tweets(self, tweets):
+        for item in tweets:
+            self.inbox.setdefault(item["tweet_id"], item)
+
+
+def sequential_ingest(twclient: TwitterClient, search_text: str):
+    storage = InboxStorage()
+    for pages in [
+        twclient.search_pages(search_text),
+        twclient.mentions_pages(),
+    ]:
+        for page in pages:
+            storage.add_inbox_tweets([inbox_item(twt, 0) for twt in page])
+    return sorted(storage.inbox)
+
+
+def concurrent_ingest(twclient: TwitterClient, search_text: str):
+    storage = InboxStorage()
+    config = SMVConfig(
+        twitter_search_text=search_text,
+        twitter_reply_message_success="",
+        twitter_reply_message_invalid_format="",
+        twitter_reply_message_invalid_signature="",
+    )
+    ingest_tweets(storage, twclient, config, search_text, OneLog())
+    return sorted(storage.inbox)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-tweets", type=int, default=1000)
+    parser.add_argument("--mention-tweets", type=int, default=1000)
+    parser.add_argument("--common-ratio", type=float, default=0.5)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per API call"
+    )
+    args = parser.parse_args()
+
+    common_count = int(
+        min(args.search_tweets, args.mention_tweets) * args.common_ratio
+    )
+    # newest first, tweets mentioned in both sources have even ids
+    FakeTwitterHandler.search_ids = sorted(
+        range(2, 2 * args.search_tweets + 1, 2), reverse=True
+    )
+    FakeTwitterHandler.mention_ids = sorted(
+        set(range(2, 2 * common_count + 1, 2))
+        | set(
+            range(
+                2 * common_count + 1,
+                2 * common_count + 2 * (args.mention_tweets - common_count),
+                2,
+            )
+        ),
+        reverse=True,
+    )
+    FakeTwitterHandler.latency = args.latency
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTwitterHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    twclient = fake_twitter_client(server.server_address[1])
+
+    expected = sequential_ingest(twclient, "@smv_account")
+    assert concurrent_ingest(twclient, "@smv_account") == expected
+
+    print(
+        f"search_tweets={args.search_tweets}, "
+        f"mention_tweets={args.mention_tweets}, "
+        f"unique_tweets={len(expected)}, latency={args.latency}s"
+    )
+    for name, ingest in [
+        ("sequential", sequential_ingest),
+        ("concurrent", concurrent_ingest),
+    ]:
+        elapsed = measure(lambda: ingest(twclient, "@smv_account"))
+        print(f"\t{name}: {elapsed * 1000:.0f} ms")
+    server.shutdown()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Throughput of signature verification with worker processes (the pool
+is started before measuring, runs reuse it).
+
+Usage:
+    PYTHONPATH=src:tests/benchmark ./tests/benchmark/verification_workers.py
+"""
+
+import argparse
+import os
+
+from tools import TWITTER_HANDLE, measure, signed_tweets
+from handlers.process_tweets import SignatureBatch, get_verification_pool
+
+
+def verify(tweets, workers: int):
+    batch = SignatureBatch()
+    for tweet in tweets:
+        batch.add_tweet(tweet, TWITTER_HANDLE)
+    if workers > 0:
+        batch.verify(get_verification_pool(workers))
+    else:
+        batch.verify()
+    for tweet in tweets:
+        try:
+            batch.validate_signature(*batch_key(tweet))
+        except Exception:
+            pass
+
+
+def batch_key(tweet):
+    _, pubkey, sig, _ = tweet.full_text.rsplit(" ", 3)
+    return pubkey, sig, tweet.user_screen_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tweets", type=int, default=400)
+    parser.add_argument("--invalid-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    tweets = signed_tweets(args.tweets, args.invalid_ratio)
+    cpu_count = os.cpu_count() or 1
+    workers_counts = sorted(
+        {0, 1, 2, 4, 8, cpu_count} - {w for w in (2, 4, 8) if w > cpu_count}
+    )
+
+    print(f"tweets={len(tweets)}, invalid_ratio={args.invalid_ratio}")
+    print(f"cpu_count={cpu_count}")
+    baseline = None
+    for workers in workers_counts:
+        # start worker processes
+        verify(tweets[:1], workers)
+        elapsed = measure(lambda: verify(tweets, workers), repeat=1)
+        throughput = len(tweets) / elapsed
+        if baseline is None:
+            baseline = throughput
+        print(
+            f"\tworkers={workers}: {throughput:.1f} tweets/s"
+            f" (x{throughput / baseline:.2f})"
+        )
@@ -0,0 +1,57 @@
+import pytest
+from services.smv_storage import SMVStorage
+
+
+def setup_ingestion_cursors_collection(smv_storage: SMVStorage):
+    smv_storage.db.drop_collection("ingestion_cursors")
+    smv_storage.db.create_collection("ingestion_cursors")
+
+
+@pytest.mark.skipif_no_mongodb
+def test_ingestion_cursors(smv_storage: SMVStorage):
+    setup_ingestion_cursors_collection(smv_storage)
+    assert smv_storage.get_ingestion_cursor("search") == {"_id": "search"}
+
+    # nothing ingested before
+    smv_storage.advance_ingestion_cursor("search", None)
+    assert smv_storage.get_ingestion_cursor("search")["since_id"] is None
+
+    # pagination from newest to oldest
+    smv_storage.save_ingestion_page("search", 29, 40)
+    smv_storage.save_ingestion_page("search", 9, 40)
+    cursor = smv_storage.get_ingestion_cursor("search")
+    assert cursor["since_id"] is None
+    assert cursor["max_id"] == 9
+    assert cursor["next_since_id"] == 40
+
+    smv_storage.advance_ingestion_cursor("search", 40)
+    cursor = smv_storage.get_ingestion_cursor("search")
+    assert cursor["since_id"] == 40
+    assert "max_id" not in cursor
+    assert "next_since_id" not in cursor
+
+    # never moves backwards
+    smv_storage.advance_ingestion_cursor("search", 30)
+    smv_storage.advance_ingestion_cursor("mentions", 35)
+    assert smv_storage.get_ingestion_cursors() == {
+        "search": 40,
+        "mentions": 35,
+    }
+
+
+@pytest.mark.skipif_no_mongodb
+def test_bump_ingestion_cursor(smv_storage: SMVStorage):
+    setup_ingestion_cursors_collection(smv_storage)
+    smv_storage.advance_ingestion_cursor("search", 40)
+    assert smv_storage.bump_ingestion_cursor("search", 50)
+    assert smv_storage.get_ingestion_cursors() == {"search": 50}
+
+    # pagination in progress
+    smv_storage.save_ingestion_page("search", 59, 70)
+    assert not smv_storage.bump_ingestion_cursor("search", 80)
+    assert smv_storage.get_ingestion_cursors() == {"search": 50}
+
+    smv_storage.advance_ingestion_cursor("search", 70)
+    assert smv_storage.bump_ingestion_cursor("search", 80)
+    assert not smv_storage.bump_ingestion_cursor("mentions", 80)
+    assert smv_storage.get_ingestion_cursors() == {"search": 80}
@@ -0,0 +1,82 @@
+import time
+import pytest
+from services.smv_storage import SMVStorage
+
+
+def setup_leases_collection(smv_storage: SMVStorage):
+    smv_storage.db.drop_collection("leases")
+    smv_storage.db.create_collection("leases")
+
+
+def setup_tweet_inbox_collection(smv_storage: SMVStorage):
+    smv_storage.db.drop_collection("tweet_inbox")
+    smv_storage.db.create_collection("tweet_inbox")
+
+
+@pytest.mark.skipif_no_mongodb
+def test_leases(smv_storage: SMVStorage):
+    setup_leases_collection(smv_storage)
+
+    token = smv_storage.acquire_lease("job", "a", 60)
+    assert token == 1
+    # held by "a"
+    assert smv_storage.acquire_lease("job", "b", 60) is None
+    assert smv_storage.renew_lease("job", "a", token, 60)
+    assert not smv_storage.renew_lease("job", "b", token, 60)
+    # other leases are independent
+    assert smv_storage.acquire_lease("other-job", "b", 60) == 1
+
+    smv_storage.release_lease("job", "a", token)
+    # new holder gets a new token
+    assert smv_storage.acquire_lease("job", "b", 0.1) == 2
+
+
+@pytest.mark.skipif_no_mongodb
+def test_leases_expired(smv_storage: SMVStorage):
+    setup_leases_collection(smv_storage)
+
+    token = smv_storage.acquire_lease("job", "a", 0.1)
+    time.sleep(0.2)
+    assert smv_storage.acquire_lease("job", "b", 60) == token + 1
+    # "a" lost the lease and can not extend it
+    assert not smv_storage.renew_lease("job", "a", token, 60)
+    smv_storage.release_lease("job", "a", token)
+    assert smv_storage.acquire_lease("job", "c", 60) is None
+
+
+@pytest.mark.skipif_no_mongodb
+def test_tweet_inbox(smv_storage: SMVStorage):
+    setup_tweet_inbox_collection(smv_storage)
+
+    smv_storage.add_inbox_tweets(
+        [
+            {
+                "tweet_id": tweet_id,
+                "user_id": tweet_id,
+                "screen_name": "user",
+                "text": "Hello",
+                "shard": tweet_id % 3,
+            }
+            for tweet_id in [1, 2, 4, 5]
+        ]
+    )
+    # added once
+    smv_storage.add_inbox_tweets(
+        [
+            {
+                "tweet_id": 4,
+                "user_id": 4,
+                "screen_name": "user",
+                "text": "Other",
+                "shard": 1,
+            }
+        ]
+    )
+
+    inbox_tweets = smv_storage.get_inbox_tweets(1)
+    assert [item["tweet_id"] for item in inbox_tweets] == [1, 4]
+    assert inbox_tweets[1]["text"] == "Hello"
+
+    smv_storage.remove_inbox_tweets([1, 4])
+    assert smv_storage.get_inbox_tweets(1) == []
+    assert len(smv_storage.get_inbox_tweets(2)) == 2
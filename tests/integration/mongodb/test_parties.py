@@ -92,3 +92,117 @@ def test_dates_after_update(smv_storage: SMVStorage):
     party = parties[0]
     assert party["created"] == START_TIME_EPOCH
     assert party["last_modified"] == START_TIME_EPOCH + 11
+
+
+@pytest.mark.skipif_no_mongodb
+def test_iter_parties_filters_blocked(smv_storage: SMVStorage):
+    created = START_TIME.replace(microsecond=0)
+    party = {
+        "twitter_handle": TWITTER_HANDLE,
+        "twitter_user_id": TWITTER_ID,
+        "created": created,
+        "last_modified": created,
+    }
+    setup_parties_collection(
+        smv_storage,
+        [
+            {**party, "pub_key": "a" * 64},
+            {**party, "pub_key": "b" * 64, "blocked": None},
+            {**party, "pub_key": "c" * 64, "blocked": "Sign up matched"},
+        ],
+    )
+    smv_storage.ensure_indexes()
+
+    assert list(smv_storage.iter_parties()) == [
+        {
+            "party_id": pub_key,
+            "twitter_handle": TWITTER_HANDLE,
+            "twitter_user_id": TWITTER_ID,
+            "created": START_TIME_EPOCH,
+            "last_modified": START_TIME_EPOCH,
+        }
+        for pub_key in ["a" * 64, "b" * 64]
+    ]
+
+
+@pytest.mark.skipif_no_mongodb
+def test_iter_party_changes(smv_storage: SMVStorage):
+    created = START_TIME.replace(microsecond=0)
+    party = {
+        "twitter_handle": TWITTER_HANDLE,
+        "twitter_user_id": TWITTER_ID,
+        "created": created,
+        "last_modified": created,
+    }
+    setup_parties_collection(
+        smv_storage,
+        [
+            {**party, "pub_key": "a" * 64},
+            {
+                **party,
+                "pub_key": "b" * 64,
+                "last_modified": created + timedelta(seconds=20),
+            },
+            {
+                **party,
+                "pub_key": "c" * 64,
+                "last_modified": created + timedelta(seconds=10),
+                "blocked": "Sign up matched",
+            },
+        ],
+    )
+    smv_storage.ensure_indexes()
+
+    # changed after `since`, in order of modification, blocked as tombstones
+    assert list(smv_storage.iter_party_changes(created)) == [
+        {
+            "party_id": pub_key,
+            "twitter_handle": TWITTER_HANDLE,
+            "twitter_user_id": TWITTER_ID,
+            "created": START_TIME_EPOCH,
+            "last_modified": START_TIME_EPOCH + delay,
+            "blocked": blocked,
+            "removed": blocked,
+        }
+        for pub_key, delay, blocked in [
+            ("c" * 64, 10, True),
+            ("b" * 64, 20, False),
+        ]
+    ]
+    assert (
+        list(smv_storage.iter_party_changes(created + timedelta(seconds=20)))
+        == []
+    )
+
+
+@pytest.mark.skipif_no_mongodb
+def test_get_parties_last_modified(smv_storage: SMVStorage):
+    setup_parties_collection(smv_storage, [])
+    smv_storage.ensure_indexes()
+    assert smv_storage.get_parties_last_modified() is None
+
+    created = START_TIME.replace(microsecond=0)
+    party = {
+        "twitter_handle": TWITTER_HANDLE,
+        "twitter_user_id": TWITTER_ID,
+        "created": created,
+        "last_modified": created,
+    }
+    setup_parties_collection(
+        smv_storage,
+        [
+            {**party, "pub_key": "a" * 64},
+            # blocked parties count too
+            {
+                **party,
+                "pub_key": "b" * 64,
+                "last_modified": created + timedelta(milliseconds=1500),
+                "blocked": "Sign up matched",
+            },
+        ],
+    )
+    smv_storage.ensure_indexes()
+
+    assert smv_storage.get_parties_last_modified() == created + timedelta(
+        milliseconds=1500
+    )
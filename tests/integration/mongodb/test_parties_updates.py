@@ -1,5 +1,5 @@
 import pytest
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from tools import setup_parties_collection
 from services.smv_storage import SMVStorage
 
@@ -83,6 +83,63 @@ def test_allowed_user_info_updates(
     assert party["twitter_user_id"] == new_twitter_id
 
 
+@pytest.mark.skipif_no_mongodb
+def test_update_pub_key_party_changes(smv_storage: SMVStorage):
+    setup_parties_collection(
+        smv_storage,
+        [
+            {
+                "pub_key": PUB_KEY,
+                "twitter_user_id": TWITTER_ID,
+                "twitter_handle": TWITTER_HANDLE,
+                "created": START_TIME,
+                "last_modified": START_TIME,
+            }
+        ],
+    )
+    since = START_TIME
+    synced = {
+        party["party_id"]: party
+        for party in smv_storage.iter_party_changes(
+            since - timedelta(seconds=1)
+        )
+    }
+
+    # User changes their Pub Key
+    smv_storage.upsert_verified_party(
+        pub_key=NEW_PUB_KEY,
+        user_id=TWITTER_ID,
+        screen_name=TWITTER_HANDLE,
+    )
+
+    # the old Pub Key is removed first
+    changes = list(smv_storage.iter_party_changes(since))
+    assert [
+        (party["party_id"], party["removed"], party["blocked"])
+        for party in changes
+    ] == [(PUB_KEY, True, False), (NEW_PUB_KEY, False, False)]
+    # the consumer ends up with the same parties as the full list
+    for party in changes:
+        if party["removed"]:
+            synced.pop(party["party_id"], None)
+        else:
+            synced[party["party_id"]] = party
+    assert list(synced) == [
+        party["party_id"] for party in smv_storage.get_parties()
+    ]
+
+    # back to the old Pub Key: no tombstone of the current one
+    smv_storage.upsert_verified_party(
+        pub_key=PUB_KEY,
+        user_id=TWITTER_ID,
+        screen_name=TWITTER_HANDLE,
+    )
+    assert [
+        (party["party_id"], party["removed"])
+        for party in smv_storage.iter_party_changes(since)
+    ] == [(NEW_PUB_KEY, True), (PUB_KEY, False)]
+
+
 @pytest.mark.skipif_no_mongodb
 # fmt: off
 @pytest.mark.parametrize(
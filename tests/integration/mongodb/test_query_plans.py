@@ -0,0 +1,306 @@
+from typing import Any, Callable, Dict, List
+from datetime import datetime, timezone, timedelta
+import pytest
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from tools import (
+    setup_parties_collection,
+    setup_tweets_collection,
+    random_party,
+    random_tweet,
+)
+from services.smv_storage import INDEXES, SMVStorage, TweetRecordBuffer
+
+NOW = datetime.utcnow().replace(tzinfo=timezone.utc)
+
+# Queries of every storage method, by method name
+STORAGE_QUERIES: Dict[str, Callable[[SMVStorage], Any]] = {
+    "iter_parties": lambda s: list(s.iter_parties()),
+    "get_parties": lambda s: s.get_parties(),
+    "get_parties_last_modified": lambda s: s.get_parties_last_modified(),
+    "iter_party_changes": lambda s: list(
+        s.iter_party_changes(NOW - timedelta(days=1))
+    ),
+    "upsert_verified_party": lambda s: s.upsert_verified_party(
+        "a" * 64, 1, "user_1"
+    ),
+    "get_tweet_record": lambda s: s.get_tweet_record(1),
+    "get_processed_tweet_ids": lambda s: s.get_processed_tweet_ids([1, 2]),
+    "upsert_tweet_record": lambda s: s.upsert_tweet_record(1, status="PASSED"),
+    "flush_tweet_records": lambda s: s.flush_tweet_records(),
+    "get_stale_processing_tweets": lambda s: (
+        s.get_stale_processing_tweets(NOW, shard=(2, 0))
+    ),
+    "remove_processing_tweet_records": lambda s: (
+        s.remove_processing_tweet_records([1])
+    ),
+    "get_tweet_count_by_status": lambda s: s.get_tweet_count_by_status(),
+    "get_last_tweet_id": lambda s: s.get_last_tweet_id(),
+    "get_tweet_count": lambda s: s.get_tweet_count(),
+    "get_todo_tweets": lambda s: s.get_todo_tweets(),
+    "is_todo_tweet": lambda s: s.is_todo_tweet(1),
+    "cleanup_todo_tweets": lambda s: s.cleanup_todo_tweets(),
+    "remove_todo_tweets": lambda s: s.remove_todo_tweets([1]),
+    "upsert_retry_tweet": lambda s: s.upsert_retry_tweet(1, 1, "error", NOW),
+    "get_due_retry_tweets": lambda s: s.get_due_retry_tweets(),
+    "get_retry_attempts": lambda s: s.get_retry_attempts([1]),
+    "remove_retry_tweets": lambda s: s.remove_retry_tweets([1]),
+    "get_retry_count_by_status": lambda s: s.get_retry_count_by_status(),
+    "enqueue_reply": lambda s: s.enqueue_reply(1, 1, "user_1", "text", "ok"),
+    "get_pending_replies": lambda s: s.get_pending_replies(10),
+    "get_sent_reply_count": lambda s: s.get_sent_reply_count(
+        NOW - timedelta(hours=3)
+    ),
+    "mark_reply_sent": lambda s: s.mark_reply_sent(1),
+    "mark_reply_failed": lambda s: s.mark_reply_failed(1, "error", NOW),
+    "get_reply_count_by_status": lambda s: s.get_reply_count_by_status(),
+    "acquire_lease": lambda s: s.acquire_lease("job", "owner", 60),
+    "renew_lease": lambda s: s.renew_lease("job", "owner", 1, 60),
+    "release_lease": lambda s: s.release_lease("job", "owner", 1),
+    "add_inbox_tweets": lambda s: s.add_inbox_tweets(
+        [
+            {
+                "tweet_id": 1,
+                "user_id": 1,
+                "screen_name": "user_1",
+                "text": "text",
+                "shard": 0,
+            }
+        ]
+    ),
+    "get_inbox_tweets": lambda s: s.get_inbox_tweets(0),
+    "get_inbox_tweet_count": lambda s: s.get_inbox_tweet_count(0),
+    "remove_inbox_tweets": lambda s: s.remove_inbox_tweets([1]),
+    "get_ingestion_cursor": lambda s: s.get_ingestion_cursor("search"),
+    "get_ingestion_cursors": lambda s: s.get_ingestion_cursors(),
+    "save_ingestion_page": lambda s: s.save_ingestion_page("search", 9, 20),
+    "advance_ingestion_cursor": lambda s: s.advance_ingestion_cursor(
+        "search", 20
+    ),
+    "bump_ingestion_cursor": lambda s: s.bump_ingestion_cursor("search", 30),
+    "get_signature_variant_counts": lambda s: (
+        s.get_signature_variant_counts()
+    ),
+    "increment_signature_variant_counts": lambda s: (
+        s.increment_signature_variant_counts({"plain": 1})
+    ),
+    "get_verification_results": lambda s: s.get_verification_results(
+        [("a" * 64, "sig", "user_1")]
+    ),
+    "save_verification_results": lambda s: s.save_verification_results(
+        {("a" * 64, "sig", "user_1"): "plain"}
+    ),
+}
+
+# Methods reading whole (small or queue) collections by design
+FULL_SCANS = {
+    "get_tweet_count_by_status",
+    "get_tweet_count",
+    "get_todo_tweets",
+    "cleanup_todo_tweets",
+    "get_retry_count_by_status",
+    "get_reply_count_by_status",
+    "get_ingestion_cursors",
+    "get_signature_variant_counts",
+}
+
+# Not queries
+NOT_QUERIES = {
+    "get_storage",
+    "ensure_indexes",
+    "buffer_tweet_records",
+    "add_todo_tweet",  # insert only
+    "watch_identities",  # change stream
+}
+
+
+def explain_commands(
+    collection: Collection, method: str, args: tuple, kwargs: dict
+) -> List[Dict[str, Any]]:
+    """Returns commands to explain the collection method call"""
+    name = collection.name
+    if method in ["find", "find_one"]:
+        command = {
+            "find": name,
+            "filter": (args[0] if args else kwargs.get("filter")) or {},
+        }
+        if kwargs.get("sort"):
+            command["sort"] = dict(kwargs["sort"])
+        limit = 1 if method == "find_one" else kwargs.get("limit")
+        if limit:
+            command["limit"] = limit
+        return [command]
+    if method == "count_documents":
+        return [{"count": name, "query": args[0]}]
+    if method in ["update_one", "update_many"]:
+        return [
+            {
+                "update": name,
+                "updates": [
+                    {
+                        "q": args[0],
+                        "u": args[1],
+                        "upsert": kwargs.get("upsert", False),
+                        "multi": method == "update_many",
+                    }
+                ],
+            }
+        ]
+    if method in ["delete_one", "delete_many"]:
+        return [
+            {
+                "delete": name,
+                "deletes": [
+                    {"q": args[0], "limit": 1 if method == "delete_one" else 0}
+                ],
+            }
+        ]
+    if method == "find_one_and_update":
+        return [
+            {
+                "findAndModify": name,
+                "query": args[0],
+                "update": args[1],
+                "upsert": kwargs.get("upsert", False),
+            }
+        ]
+    if method == "bulk_write":
+        return [
+            {
+                "update": name,
+                "updates": [
+                    {"q": op._filter, "u": op._doc, "upsert": op._upsert}
+                ],
+            }
+            for op in args[0]
+            if isinstance(op, UpdateOne)
+        ]
+    if method == "aggregate":
+        return [{"aggregate": name, "pipeline": args[0], "cursor": {}}]
+    return []
+
+
+class RecordingCollection(object):
+    """Collection recording explain commands of queries"""
+
+    def __init__(self, collection: Collection, commands: List[dict]):
+        self._collection = collection
+        self._commands = commands
+
+    def __getattr__(self, method: str):
+        attr = getattr(self._collection, method)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._commands.extend(
+                explain_commands(self._collection, method, args, kwargs)
+            )
+            return attr(*args, **kwargs)
+
+        return call
+
+
+class RecordingDatabase(object):
+    def __init__(self, db):
+        self._db = db
+        self.commands: List[dict] = []
+
+    def get_collection(self, name: str) -> RecordingCollection:
+        return RecordingCollection(
+            self._db.get_collection(name), self.commands
+        )
+
+    def __getattr__(self, name: str):
+        return getattr(self._db, name)
+
+
+def collection_scans(plan: Any, in_winning_plan: bool = False) -> List[str]:
+    """Returns COLLSCAN stages of winning plans in explain output"""
+    scans = []
+    if isinstance(plan, dict):
+        if in_winning_plan and plan.get("stage") == "COLLSCAN":
+            scans.append(plan.get("filter", {}))
+        for key, value in plan.items():
+            if key == "rejectedPlans":
+                continue
+            scans.extend(
+                collection_scans(
+                    value, in_winning_plan or key == "winningPlan"
+                )
+            )
+    elif isinstance(plan, list):
+        for value in plan:
+            scans.extend(collection_scans(value, in_winning_plan))
+    return scans
+
+
+def setup_query_plan_collections(smv_storage: SMVStorage):
+    setup_parties_collection(smv_storage, [random_party() for _ in range(20)])
+    setup_tweets_collection(
+        smv_storage,
+        [random_tweet(tweet_id) for tweet_id in range(10, 30)],
+    )
+    for collection_name in [
+        "todo_tweets",
+        "retry_tweets",
+        "reply_outbox",
+        "leases",
+        "tweet_inbox",
+        "ingestion_cursors",
+        "signature_variants",
+        "verification_results",
+    ]:
+        smv_storage.db.drop_collection(collection_name)
+        smv_storage.db.create_collection(collection_name)
+    assert smv_storage.ensure_indexes() == []
+
+
+def test_storage_queries_listed():
+    methods = {
+        name
+        for cls in [SMVStorage, TweetRecordBuffer]
+        for name, value in vars(cls).items()
+        if not name.startswith("_")
+        and callable(value)
+        and name not in NOT_QUERIES
+    }
+    assert methods == set(STORAGE_QUERIES)
+
+
+@pytest.mark.skipif_no_mongodb
+def test_ensure_indexes(smv_storage: SMVStorage):
+    setup_query_plan_collections(smv_storage)
+    # idempotent
+    assert smv_storage.ensure_indexes() == []
+
+    for collection_name, indexes in INDEXES.items():
+        index_info = smv_storage.db.get_collection(
+            collection_name
+        ).index_information()
+        for index in indexes:
+            assert index.document["name"] in index_info
+    assert smv_storage.col_tweets.index_information()["tweet_id"]["unique"]
+
+
+@pytest.mark.skipif_no_mongodb
+@pytest.mark.parametrize("method", sorted(STORAGE_QUERIES))
+def test_query_plan(smv_storage: SMVStorage, method: str):
+    setup_query_plan_collections(smv_storage)
+    db = RecordingDatabase(smv_storage.db)
+    storage = SMVStorage(db)
+    if method == "flush_tweet_records":
+        with storage.buffer_tweet_records() as records:
+            records.upsert_tweet_record(1, status="PROCESSING")
+            STORAGE_QUERIES[method](records)
+    else:
+        STORAGE_QUERIES[method](storage)
+    assert db.commands
+
+    if method in FULL_SCANS:
+        return
+    for command in db.commands:
+        explain = smv_storage.db.command(
+            {"explain": command, "verbosity": "queryPlanner"}
+        )
+        assert collection_scans(explain) == [], command
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone, timedelta
+import pytest
+from services.smv_storage import SMVStorage
+
+
+def setup_reply_outbox_collection(smv_storage: SMVStorage):
+    smv_storage.db.drop_collection("reply_outbox")
+    smv_storage.db.create_collection("reply_outbox")
+
+
+@pytest.mark.skipif_no_mongodb
+def test_reply_outbox(smv_storage: SMVStorage):
+    setup_reply_outbox_collection(smv_storage)
+    start = datetime.utcnow().replace(tzinfo=timezone.utc)
+
+    for tweet_id in [1, 2, 3]:
+        smv_storage.enqueue_reply(tweet_id, 10, "user", "Hi", "Bad")
+    # enqueued once per tweet
+    smv_storage.enqueue_reply(1, 10, "user", "Hi", "Other")
+
+    pending = smv_storage.get_pending_replies(limit=10)
+    assert [item["tweet_id"] for item in pending] == [1, 2, 3]
+    assert pending[0]["message"] == "Bad"
+    assert smv_storage.get_pending_replies(limit=2)[-1]["tweet_id"] == 2
+
+    smv_storage.mark_reply_sent(1)
+    smv_storage.mark_reply_failed(2, "error", start + timedelta(hours=1))
+    smv_storage.mark_reply_failed(3, "error")
+
+    assert smv_storage.get_pending_replies(limit=10) == []
+    assert smv_storage.get_sent_reply_count(since=start) == 1
+    assert smv_storage.get_reply_count_by_status() == {
+        "SENT": 1,
+        "PENDING": 1,
+        "FAILED": 1,
+    }
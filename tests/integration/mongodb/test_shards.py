@@ -0,0 +1,66 @@
+from datetime import timedelta
+import pytest
+from tools import setup_tweets_collection, random_tweet, NOW
+from services.smv_storage import SMVStorage
+from services.twitter import Tweet
+from handlers.process_tweets import inbox_item, tweet_shard
+
+SHARD_COUNT = 3
+# tweet_id and user_id are in different shards
+TWEETS = [
+    Tweet(tweet_id, tweet_id + 10, f"user_{tweet_id}", "Hello")
+    for tweet_id in range(1, 10)
+]
+
+
+def setup_shards(smv_storage: SMVStorage):
+    setup_tweets_collection(
+        smv_storage,
+        [
+            random_tweet(
+                twt.tweet_id,
+                user_id=twt.user_id,
+                status="PROCESSING",
+                last_modified=NOW - timedelta(days=1),
+            )
+            for twt in TWEETS
+        ],
+    )
+    for name in ["retry_tweets", "todo_tweets", "tweet_inbox"]:
+        smv_storage.db.drop_collection(name)
+    smv_storage.ensure_indexes()
+    for twt in TWEETS:
+        smv_storage.upsert_retry_tweet(
+            twt.tweet_id, 1, "error", NOW, user_id=twt.user_id
+        )
+        smv_storage.add_todo_tweet(twt.tweet_id)
+    smv_storage.add_inbox_tweets(
+        [inbox_item(twt, tweet_shard(twt, SHARD_COUNT)) for twt in TWEETS]
+    )
+
+
+@pytest.mark.skipif_no_mongodb
+@pytest.mark.parametrize("shard_index", range(SHARD_COUNT))
+def test_shard_queries_agree_with_tweet_shard(
+    smv_storage: SMVStorage, shard_index: int
+):
+    setup_shards(smv_storage)
+    shard = (SHARD_COUNT, shard_index)
+    expected = {
+        twt.tweet_id
+        for twt in TWEETS
+        if tweet_shard(twt, SHARD_COUNT) == shard_index
+    }
+
+    assert {
+        item["tweet_id"] for item in smv_storage.get_inbox_tweets(shard_index)
+    } == expected
+    assert (
+        set(smv_storage.get_stale_processing_tweets(NOW, shard=shard))
+        == expected
+    )
+    assert set(smv_storage.get_due_retry_tweets(shard=shard)) == expected
+    # the user of a tweet added by id is not known, shard 0 looks it up
+    assert set(smv_storage.get_todo_tweets(shard=shard)) == (
+        {twt.tweet_id for twt in TWEETS} if shard_index == 0 else set()
+    )
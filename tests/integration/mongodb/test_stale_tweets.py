@@ -0,0 +1,95 @@
+from datetime import datetime, timezone, timedelta
+import pytest
+from tools import setup_tweets_collection, random_tweet, NOW
+from common import SMVConfig
+from services.smv_storage import SMVStorage
+from handlers.process_tweets import requeue_stale_tweets
+
+smv_config = SMVConfig(
+    twitter_search_text="I'm taking a ride with",
+    twitter_reply_message_success="",
+    twitter_reply_message_invalid_format="Tweet has invalid format.",
+    twitter_reply_message_invalid_signature="Tweet has invalid signature.",
+    processing_lease=600,
+)
+
+
+def setup_stale_tweets(smv_storage: SMVStorage):
+    now = datetime.utcnow().replace(tzinfo=timezone.utc)
+    setup_tweets_collection(
+        smv_storage,
+        [
+            # interrupted
+            random_tweet(
+                1, status="PROCESSING", last_modified=NOW - timedelta(days=1)
+            ),
+            random_tweet(
+                2, status="PROCESSING", last_modified=now - timedelta(hours=1)
+            ),
+            # being processed
+            random_tweet(
+                3,
+                status="PROCESSING",
+                last_modified=now - timedelta(minutes=1),
+            ),
+            # finished
+            random_tweet(
+                4, status="PASSED", last_modified=NOW - timedelta(days=1)
+            ),
+        ],
+    )
+    smv_storage.db.drop_collection("retry_tweets")
+    smv_storage.ensure_indexes()
+    return now
+
+
+@pytest.mark.skipif_no_mongodb
+def test_get_stale_processing_tweets(smv_storage: SMVStorage):
+    now = setup_stale_tweets(smv_storage)
+
+    stale_tweets = smv_storage.get_stale_processing_tweets(
+        now - timedelta(minutes=10)
+    )
+    assert list(stale_tweets) == [1, 2]
+    assert stale_tweets[1] == smv_storage.get_tweet_record(1)["user_id"]
+    assert list(
+        smv_storage.get_stale_processing_tweets(
+            now - timedelta(minutes=10), limit=1
+        )
+    ) == [1]
+    assert (
+        smv_storage.get_stale_processing_tweets(now - timedelta(days=2)) == {}
+    )
+
+
+@pytest.mark.skipif_no_mongodb
+def test_stale_processing_tweets_query_uses_index(smv_storage: SMVStorage):
+    now = setup_stale_tweets(smv_storage)
+
+    plan = smv_storage.col_tweets.find(
+        {
+            "status": "PROCESSING",
+            "last_modified": {"$lt": now - timedelta(minutes=10)},
+        },
+    ).explain()["queryPlanner"]["winningPlan"]
+
+    assert "COLLSCAN" not in str(plan)
+    assert "'indexName': 'status_last_modified'" in str(plan)
+
+
+@pytest.mark.skipif_no_mongodb
+def test_requeue_stale_tweets(smv_storage: SMVStorage):
+    setup_stale_tweets(smv_storage)
+    smv_storage.upsert_retry_tweet(2, 1, "error", NOW)
+
+    assert requeue_stale_tweets(smv_storage, smv_config) == 2
+
+    assert smv_storage.get_tweet_record(1)["status"] == "RETRY"
+    assert smv_storage.get_tweet_record(2)["status"] == "RETRY"
+    assert smv_storage.get_tweet_record(3)["status"] == "PROCESSING"
+    assert smv_storage.get_retry_attempts([1, 2, 3]) == {1: 1, 2: 2}
+    # processed again by next runs
+    assert smv_storage.get_processed_tweet_ids([1, 2, 3, 4]) == {3, 4}
+
+    # nothing left to re-queue
+    assert requeue_stale_tweets(smv_storage, smv_config) == 0
@@ -0,0 +1,71 @@
+from datetime import datetime, timezone, timedelta
+import pytest
+from tools import setup_tweets_collection, random_tweet
+from services.smv_storage import SMVStorage
+
+
+@pytest.mark.skipif_no_mongodb
+def test_get_processed_tweet_ids(smv_storage: SMVStorage):
+    setup_tweets_collection(
+        smv_storage,
+        [random_tweet(tweet_id) for tweet_id in [2, 3, 5, 8]],
+    )
+
+    assert smv_storage.get_processed_tweet_ids([1, 2, 3, 4, 8, 8]) == {
+        2,
+        3,
+        8,
+    }
+    assert smv_storage.get_processed_tweet_ids([1, 4]) == set()
+    assert smv_storage.get_processed_tweet_ids([]) == set()
+
+
+@pytest.mark.skipif_no_mongodb
+def test_buffer_tweet_records(smv_storage: SMVStorage):
+    setup_tweets_collection(smv_storage, [random_tweet(1, status="PASSED")])
+
+    with smv_storage.buffer_tweet_records() as records:
+        records.upsert_tweet_record(2, text="a", status="PROCESSING")
+        records.upsert_tweet_record(3, text="b", status="PROCESSING")
+        records.flush_tweet_records()
+        assert smv_storage.get_processed_tweet_ids([1, 2, 3]) == {1, 2, 3}
+
+        records.upsert_tweet_record(2, reply="", status="PASSED")
+        assert smv_storage.col_tweets.find_one({"tweet_id": 2})["status"] == (
+            "PROCESSING"
+        )
+
+    assert smv_storage.get_tweet_record(2)["status"] == "PASSED"
+    assert smv_storage.get_tweet_record(2)["text"] == "a"
+
+    smv_storage.remove_processing_tweet_records([1, 2, 3])
+    assert smv_storage.get_processed_tweet_ids([1, 2, 3]) == {1, 2}
+
+
+@pytest.mark.skipif_no_mongodb
+def test_retry_tweets(smv_storage: SMVStorage):
+    setup_tweets_collection(
+        smv_storage,
+        [
+            random_tweet(1, status="PASSED"),
+            random_tweet(2, status="RETRY"),
+            random_tweet(3, status="DEAD_LETTER"),
+        ],
+    )
+    smv_storage.db.drop_collection("retry_tweets")
+    now = datetime.utcnow().replace(tzinfo=timezone.utc)
+
+    smv_storage.upsert_retry_tweet(2, 1, "error", now)
+    smv_storage.upsert_retry_tweet(4, 1, "error", now + timedelta(hours=1))
+    smv_storage.upsert_retry_tweet(3, 5, "error")
+
+    # tweets waiting for retry are not processed
+    assert smv_storage.get_processed_tweet_ids([1, 2, 3]) == {1, 3}
+    assert smv_storage.get_due_retry_tweets() == {2: 1}
+    assert smv_storage.get_retry_count_by_status() == {
+        "RETRY": 2,
+        "DEAD_LETTER": 1,
+    }
+
+    smv_storage.remove_retry_tweets([2])
+    assert smv_storage.get_due_retry_tweets() == {}
@@ -1,5 +1,11 @@
 # This file is automatically picked up and run by pytest
 # It defines special marker: `@pytest.mark.focus`
+# and `stream_server` fixture
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pytest
 
 
 def pytest_collection_modifyitems(items):
@@ -18,3 +24,42 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "focus: If any tests have this mark, run only those"
     )
+
+
+class FakeStreamHandler(BaseHTTPRequestHandler):
+    """Local stand-in for Twitter filtered stream. Serves the next of
+    `server.connections`: (status code, messages), then disconnects.
+    A None message is sent as keep-alive newline."""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        self.server.requests.append(parse_qs(self.rfile.read(length).decode()))
+        if self.server.connections:
+            status_code, messages = self.server.connections.pop(0)
+        else:
+            status_code, messages = 503, []
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        for message in messages:
+            line = "" if message is None else json.dumps(message)
+            self.wfile.write(f"{line}\r\n".encode())
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stream_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeStreamHandler)
+    server.connections = []
+    server.requests = []
+    server.url = (
+        f"http://127.0.0.1:{server.server_port}/1.1/statuses/filter.json"
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,771 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest import mock
+import flask
+import pytest
+from twython.exceptions import TwythonRateLimitError
+from common import SMVConfig
+
+from services.smv_storage import SMVStorage
+from services.twitter import Tweet
+from services.onelog import OneLog
+from handlers.process_tweets import (
+    handle_process_tweets,
+    inbox_item,
+    ingest_tweets,
+    requeue_stale_tweets,
+    SignatureBatch,
+    TweetProcessor,
+)
+
+twitter_pubkey = (
+    "01152723fa548599255ea0a17cbeb5d92c9659c8d797eb7c1213419218c6b94f"
+)
+twitter_signed_message = "ku39iMD7/SLTxfZUw7SAn5K3mypHGmp7hKpgh0yDIWGRR9Qlc1yqoUOaVbMbgjFU8nNots2BDFKK4f79HokbCA=="  # noqa: E501
+
+
+def sign_up_tweet(tweet_id: int) -> Tweet:
+    return Tweet(
+        tweet_id=tweet_id,
+        user_id=321,
+        user_screen_name="twitter_account",
+        full_text=(
+            f"I'm taking a ride with @hello_mixel {twitter_pubkey} "
+            f"{twitter_signed_message}"
+        ),
+    )
+
+
+smv_config = SMVConfig(
+    twitter_search_text="I'm taking a ride with",
+    twitter_reply_message_success="",
+    twitter_reply_message_invalid_format="Tweet has invalid format.",
+    twitter_reply_message_invalid_signature="Tweet has invalid signature.",
+)
+
+
+def mock_inbox(storage):
+    """Inbox and ingestion cursors kept in memory"""
+    inbox = {}
+
+    def add_inbox_tweets(items):
+        for item in items:
+            inbox.setdefault(
+                item["tweet_id"], {"_id": item["tweet_id"], **item}
+            )
+
+    def get_inbox_tweets(shard_index, limit=1000):
+        return [
+            inbox[tweet_id]
+            for tweet_id in sorted(inbox)
+            if inbox[tweet_id]["shard"] == shard_index
+        ][:limit]
+
+    def get_inbox_tweet_count(shard_index):
+        return sum(
+            1 for item in inbox.values() if item["shard"] == shard_index
+        )
+
+    def remove_inbox_tweets(tweet_ids):
+        for tweet_id in tweet_ids:
+            inbox.pop(tweet_id, None)
+
+    storage.add_inbox_tweets.side_effect = add_inbox_tweets
+    storage.remove_inbox_tweets.side_effect = remove_inbox_tweets
+    storage.get_inbox_tweets.side_effect = get_inbox_tweets
+    storage.get_inbox_tweet_count.side_effect = get_inbox_tweet_count
+    storage.get_ingestion_cursor.side_effect = lambda source: {
+        "_id": source,
+        "since_id": 10,
+    }
+
+
+def mock_clients(tweets, todo_tweets=None):
+    storage = mock.MagicMock()
+    # tweet records written as without the buffer
+    storage.buffer_tweet_records.return_value.__enter__.return_value = storage
+    mock_inbox(storage)
+    storage.get_todo_tweets.return_value = list(todo_tweets or {})
+    storage.get_due_retry_tweets.return_value = {}
+    storage.get_stale_processing_tweets.return_value = {}
+    storage.get_signature_variant_counts.return_value = {}
+    twclient = mock.MagicMock()
+    twclient.account_name = "hello_mixel"
+    twclient.search_pages.side_effect = lambda *args: iter(
+        [tweets] if tweets else []
+    )
+    twclient.mentions_pages.side_effect = lambda *args: iter([])
+    twclient.get_by_ids.side_effect = lambda tweet_ids: [
+        todo_tweets[tweet_id]
+        for tweet_id in tweet_ids
+        if tweet_id in todo_tweets
+    ]
+    return storage, twclient
+
+
+def mock_db_storage(db) -> SMVStorage:
+    """Storage writing tweet records to mocked db"""
+    storage = SMVStorage(db)
+    for name in [
+        "get_ingestion_cursor",
+        "save_ingestion_page",
+        "advance_ingestion_cursor",
+        "add_inbox_tweets",
+        "get_inbox_tweets",
+        "get_inbox_tweet_count",
+        "remove_inbox_tweets",
+        "cleanup_todo_tweets",
+        "get_todo_tweets",
+        "get_due_retry_tweets",
+        "get_stale_processing_tweets",
+        "get_processed_tweet_ids",
+        "get_signature_variant_counts",
+        "increment_signature_variant_counts",
+        "upsert_verified_party",
+        "remove_todo_tweets",
+        "acquire_lease",
+        "renew_lease",
+        "release_lease",
+    ]:
+        setattr(storage, name, mock.MagicMock())
+    mock_inbox(storage)
+    storage.acquire_lease.return_value = 1
+    storage.renew_lease.return_value = True
+    storage.get_todo_tweets.return_value = []
+    storage.get_due_retry_tweets.return_value = {}
+    storage.get_stale_processing_tweets.return_value = {}
+    storage.get_processed_tweet_ids.return_value = set()
+    storage.get_signature_variant_counts.return_value = {}
+    return storage
+
+
+def run(storage, twclient, config=smv_config) -> flask.Response:
+    app = flask.Flask("test")
+    with app.test_request_context():
+        return handle_process_tweets(storage, twclient, config)
+
+
+def test_handle_process_tweets_skips_processed_tweets(capsys):
+    # search results repeat the tweet at `since_id` boundary
+    storage, twclient = mock_clients(
+        [sign_up_tweet(13), sign_up_tweet(12), sign_up_tweet(11)],
+        todo_tweets={12: sign_up_tweet(12), 5: sign_up_tweet(5)},
+    )
+    storage.get_processed_tweet_ids.return_value = {11, 5}
+
+    response = run(storage, twclient)
+
+    assert response.status_code == 200
+    assert response.json == {
+        "status": "success",
+        "processed_count": 2,
+        "failed_count": 0,
+        "dead_letter_count": 0,
+        "remaining_count": 0,
+    }
+
+    # one API call for all todo tweets
+    twclient.get_by_ids.assert_called_once_with([12, 5])
+    assert twclient.get_by_id.mock_calls == []
+    storage.get_todo_tweets.assert_called_once_with(limit=500, shard=(1, 0))
+    # one query for all tweets
+    storage.get_processed_tweet_ids.assert_called_once_with([11, 12, 13, 5])
+    # no per-tweet lookups
+    assert storage.get_tweet_record.mock_calls == []
+    # tweets processed once, from oldest to newest
+    assert [
+        call.kwargs["tweet_id"]
+        for call in storage.upsert_tweet_record.mock_calls
+        if call.kwargs.get("status") == "PASSED"
+    ] == [12, 13]
+
+    captured = capsys.readouterr()
+    assert '"processed_before_count":2,"new_count":2' in captured.out
+
+
+@pytest.mark.parametrize("tweet_count,pool_used", [(3, False), (4, True)])
+def test_handle_process_tweets_verification_pool(tweet_count, pool_used):
+    storage, twclient = mock_clients(
+        [sign_up_tweet(i) for i in range(tweet_count, 0, -1)]
+    )
+    storage.get_processed_tweet_ids.return_value = set()
+    config = SMVConfig(
+        **{
+            **smv_config.__dict__,
+            "verification_workers": 2,
+            "verification_pool_min_tweets": 4,
+        }
+    )
+
+    with ThreadPoolExecutor(2) as pool, mock.patch(
+        "handlers.process_tweets.get_verification_pool", return_value=pool
+    ) as get_verification_pool_mock:
+        response = run(storage, twclient, config)
+
+    assert response.json["processed_count"] == tweet_count
+    # small batches are verified without the workers
+    assert get_verification_pool_mock.mock_calls == (
+        [mock.call(2)] if pool_used else []
+    )
+
+
+def test_handle_process_tweets_bulk_writes():
+    db = mock.MagicMock()
+    storage = mock_db_storage(db)
+    _, twclient = mock_clients([sign_up_tweet(i) for i in range(5, 0, -1)])
+    config = SMVConfig(**{**smv_config.__dict__, "tweet_record_batch_size": 2})
+
+    response = run(storage, twclient, config)
+
+    assert response.json["status"] == "success"
+    col_tweets = db.get_collection.return_value
+    assert col_tweets.update_one.mock_calls == []
+    # markers of the next tweets are written with statuses of previous ones
+    assert bulk_written_statuses(col_tweets) == [
+        [(1, "PROCESSING"), (2, "PROCESSING")],
+        [(1, "PASSED"), (2, "PASSED"), (3, "PROCESSING"), (4, "PROCESSING")],
+        [(3, "PASSED"), (4, "PASSED"), (5, "PROCESSING")],
+        [(5, "PASSED")],
+    ]
+    assert all(
+        call.kwargs == {"ordered": False}
+        for call in col_tweets.bulk_write.mock_calls
+    )
+
+
+def bulk_written_statuses(col_tweets):
+    return [
+        [
+            (request._filter["tweet_id"], request._doc["$set"]["status"])
+            for request in call.args[0]
+        ]
+        for call in col_tweets.bulk_write.mock_calls
+    ]
+
+
+def test_handle_process_tweets_failure_isolation():
+    db = mock.MagicMock()
+    storage = mock_db_storage(db)
+    storage.upsert_verified_party.side_effect = [
+        None,
+        RuntimeError("boom"),
+        None,
+        None,
+    ]
+    _, twclient = mock_clients([sign_up_tweet(i) for i in range(4, 0, -1)])
+
+    response = run(storage, twclient)
+
+    assert response.status_code == 200
+    assert response.json == {
+        "status": "partial",
+        "processed_count": 3,
+        "failed_count": 1,
+        "dead_letter_count": 0,
+        "remaining_count": 0,
+    }
+    # the rest of tweets is processed
+    assert bulk_written_statuses(db.get_collection.return_value) == [
+        [(i, "PROCESSING") for i in range(1, 5)],
+        [(1, "PASSED"), (2, "RETRY"), (3, "PASSED"), (4, "PASSED")],
+    ]
+    # the failed tweet is going to be retried
+    db.get_collection.assert_any_call("retry_tweets")
+    retry_update = db.get_collection.return_value.update_one.call_args
+    assert retry_update.args[0] == {"_id": 2}
+    assert retry_update.args[1]["$set"]["status"] == "RETRY"
+    assert retry_update.args[1]["$set"]["attempts"] == 1
+    assert retry_update.args[1]["$set"]["error"] == "boom"
+
+
+def test_handle_process_tweets_retry():
+    storage, twclient = mock_clients(
+        [sign_up_tweet(20)],
+        todo_tweets={7: sign_up_tweet(7), 9: sign_up_tweet(9)},
+    )
+    storage.get_todo_tweets.return_value = []
+    # tweet 8 is not found, 9 has been processed in the meantime
+    storage.get_due_retry_tweets.return_value = {7: 1, 8: 4, 9: 2}
+    storage.get_processed_tweet_ids.return_value = {9}
+
+    response = run(storage, twclient)
+
+    assert response.json == {
+        "status": "partial",
+        "processed_count": 2,
+        "failed_count": 1,
+        "dead_letter_count": 1,
+        "remaining_count": 0,
+    }
+    twclient.get_by_ids.assert_called_once_with([7, 8, 9])
+    storage.get_due_retry_tweets.assert_called_once_with(
+        limit=100, shard=(1, 0)
+    )
+    # 5th failed attempt
+    storage.upsert_retry_tweet.assert_called_once_with(
+        8, 5, "Tweet not found", None, user_id=None
+    )
+    assert (
+        mock.call(
+            tweet_id=8, status="DEAD_LETTER", description="Tweet not found"
+        )
+        in storage.upsert_tweet_record.mock_calls
+    )
+    storage.remove_retry_tweets.assert_called_once_with([9, 7])
+
+
+def test_handle_process_tweets_bulk_writes_failure():
+    db = mock.MagicMock()
+    storage = mock_db_storage(db)
+    col_tweets = db.get_collection.return_value
+    col_tweets.bulk_write.side_effect = [None, RuntimeError("boom")]
+    _, twclient = mock_clients([sign_up_tweet(i) for i in range(4, 0, -1)])
+    config = SMVConfig(**{**smv_config.__dict__, "tweet_record_batch_size": 2})
+
+    response = run(storage, twclient, config)
+
+    assert response[1] == 500
+    assert bulk_written_statuses(col_tweets) == [
+        [(1, "PROCESSING"), (2, "PROCESSING")],
+        [(1, "PASSED"), (2, "PASSED"), (3, "PROCESSING"), (4, "PROCESSING")],
+    ]
+    # not started tweets are left for the next run
+    col_tweets.delete_many.assert_called_once_with(
+        {"tweet_id": {"$in": [3, 4]}, "status": "PROCESSING"}
+    )
+
+
+def test_requeue_stale_tweets():
+    storage = mock.MagicMock()
+    storage.get_stale_processing_tweets.return_value = {3: 13, 4: 14}
+    # tweet 4 has been interrupted before
+    storage.get_retry_attempts.return_value = {4: 1}
+
+    assert requeue_stale_tweets(storage, smv_config) == 2
+
+    older_than = storage.get_stale_processing_tweets.call_args.args[0]
+    assert (
+        datetime.utcnow().replace(tzinfo=timezone.utc) - older_than
+    ).total_seconds() == pytest.approx(90, abs=5)
+    storage.get_retry_attempts.assert_called_once_with([3, 4])
+    assert storage.upsert_retry_tweet.mock_calls == [
+        mock.call(3, 1, "Processing not finished", mock.ANY, user_id=13),
+        mock.call(4, 2, "Processing not finished", mock.ANY, user_id=14),
+    ]
+    assert storage.upsert_tweet_record.mock_calls == [
+        mock.call(
+            tweet_id=tweet_id,
+            status="RETRY",
+            description="Processing not finished",
+        )
+        for tweet_id in [3, 4]
+    ]
+
+
+def test_handle_process_tweets_skipped_when_lease_is_held():
+    storage, twclient = mock_clients([sign_up_tweet(1)])
+    storage.acquire_lease.return_value = None
+
+    response = run(storage, twclient)
+
+    assert response.json == {
+        "status": "skipped",
+        "error": "Another run is in progress.",
+    }
+    storage.acquire_lease.assert_called_once_with(
+        "process-tweets", mock.ANY, 90
+    )
+    assert twclient.get_tweets.mock_calls == []
+    assert storage.upsert_tweet_record.mock_calls == []
+    assert storage.release_lease.mock_calls == []
+
+
+def test_handle_process_tweets_lease_lost():
+    db = mock.MagicMock()
+    storage = mock_db_storage(db)
+    # another run took over the lease
+    storage.renew_lease.side_effect = [True, False]
+    _, twclient = mock_clients([sign_up_tweet(i) for i in range(4, 0, -1)])
+    config = SMVConfig(**{**smv_config.__dict__, "tweet_record_batch_size": 2})
+
+    response = run(storage, twclient, config)
+
+    assert response[1] == 409
+    col_tweets = db.get_collection.return_value
+    assert bulk_written_statuses(col_tweets) == [
+        [(1, "PROCESSING"), (2, "PROCESSING")],
+        [(1, "PASSED"), (2, "PASSED")],
+    ]
+    # tweets of the other run are left untouched
+    assert col_tweets.delete_many.mock_calls == []
+    assert storage.remove_todo_tweets.mock_calls == []
+    storage.release_lease.assert_called_once()
+
+
+def test_handle_process_tweets_first_shard():
+    tweets = [
+        Tweet(tweet_id, tweet_id, f"user_{tweet_id}", "Hello")
+        for tweet_id in [4, 3, 2, 1]
+    ]
+    storage, twclient = mock_clients(tweets)
+    config = SMVConfig(
+        **{**smv_config.__dict__, "shard_count": 2, "shard_index": 0}
+    )
+
+    response = run(storage, twclient, config)
+
+    assert response.json["processed_count"] == 2
+    storage.acquire_lease.assert_called_once_with(
+        "process-tweets-0-of-2", mock.ANY, 90
+    )
+    twclient.search_pages.assert_called_once_with("@hello_mixel", 10, None)
+    # tweets of odd users go to the other shard
+    storage.add_inbox_tweets.assert_called_once_with(
+        [
+            {
+                "tweet_id": tweet_id,
+                "user_id": tweet_id,
+                "screen_name": f"user_{tweet_id}",
+                "text": "Hello",
+                "shard": tweet_id % 2,
+            }
+            for tweet_id in [4, 3, 2, 1]
+        ]
+    )
+    storage.get_inbox_tweets.assert_called_once_with(0)
+    storage.get_processed_tweet_ids.assert_called_once_with([2, 4])
+    storage.get_todo_tweets.assert_called_once_with(limit=500, shard=(2, 0))
+    storage.remove_inbox_tweets.assert_called_once_with([2, 4])
+
+
+def test_handle_process_tweets_other_shard():
+    storage, twclient = mock_clients([])
+    storage.add_inbox_tweets.side_effect(
+        [
+            {
+                "tweet_id": tweet_id,
+                "user_id": 3,
+                "screen_name": "user_3",
+                "text": "Hello",
+                "shard": 1,
+            }
+            for tweet_id in [7, 5]
+        ]
+    )
+    config = SMVConfig(
+        **{**smv_config.__dict__, "shard_count": 2, "shard_index": 1}
+    )
+
+    response = run(storage, twclient, config)
+
+    assert response.json["processed_count"] == 2
+    # no Twitter API calls to fetch new tweets
+    assert twclient.search_pages.mock_calls == []
+    assert twclient.mentions_pages.mock_calls == []
+    assert storage.advance_ingestion_cursor.mock_calls == []
+    storage.get_inbox_tweets.assert_called_once_with(1)
+    storage.get_processed_tweet_ids.assert_called_once_with([5, 7])
+    storage.get_due_retry_tweets.assert_called_once_with(
+        limit=100, shard=(2, 1)
+    )
+    storage.remove_inbox_tweets.assert_called_once_with([5, 7])
+
+
+def test_handle_process_tweets_todo_of_other_shard():
+    storage, twclient = mock_clients(
+        [],
+        todo_tweets={
+            tweet_id: Tweet(tweet_id, tweet_id, f"user_{tweet_id}", "Hello")
+            for tweet_id in [7, 8]
+        },
+    )
+    config = SMVConfig(
+        **{**smv_config.__dict__, "shard_count": 2, "shard_index": 0}
+    )
+
+    run(storage, twclient, config)
+
+    # the user of tweet 7 belongs to the other shard
+    storage.add_inbox_tweets.assert_called_once_with(
+        [
+            {
+                "tweet_id": 7,
+                "user_id": 7,
+                "screen_name": "user_7",
+                "text": "Hello",
+                "shard": 1,
+            }
+        ]
+    )
+    storage.get_processed_tweet_ids.assert_called_once_with([8])
+    storage.remove_todo_tweets.assert_called_once_with([7, 8])
+
+
+def test_ingest_tweets():
+    storage = mock.MagicMock()
+    storage.get_ingestion_cursor.side_effect = [
+        # interrupted in the middle of pagination
+        {"_id": "search", "since_id": 10, "max_id": 50, "next_since_id": 90},
+        # no cursor yet
+        {"_id": "mentions"},
+        {"_id": "mentions", "since_id": 12},
+    ]
+    storage.get_last_tweet_id.return_value = 12
+    twclient = mock.MagicMock()
+    twclient.search_pages.return_value = iter(
+        [
+            [sign_up_tweet(40), sign_up_tweet(30)],
+            [sign_up_tweet(20)],
+        ]
+    )
+    twclient.mentions_pages.return_value = iter([[sign_up_tweet(95)]])
+    config = SMVConfig(**{**smv_config.__dict__, "shard_count": 2})
+
+    assert (
+        ingest_tweets(storage, twclient, config, "@hello_mixel", OneLog()) == 4
+    )
+
+    twclient.search_pages.assert_called_once_with("@hello_mixel", 10, 50)
+    twclient.mentions_pages.assert_called_once_with(12, None)
+    assert [
+        [item["tweet_id"] for item in call.args[0]]
+        for call in storage.add_inbox_tweets.mock_calls
+    ] == [[40, 30], [20], [95]]
+    assert storage.add_inbox_tweets.mock_calls[0].args[0][0] == {
+        "tweet_id": 40,
+        "user_id": 321,
+        "screen_name": "twitter_account",
+        "text": sign_up_tweet(40).full_text,
+        "shard": 1,
+    }
+    # the cursor is advanced after every page
+    assert storage.mock_calls == [
+        mock.call.get_ingestion_cursor("search"),
+        mock.call.get_ingestion_cursor("mentions"),
+        mock.call.get_last_tweet_id(),
+        mock.call.advance_ingestion_cursor("mentions", 12),
+        mock.call.get_ingestion_cursor("mentions"),
+        mock.call.add_inbox_tweets(mock.ANY),
+        mock.call.save_ingestion_page("search", 29, 90),
+        mock.call.add_inbox_tweets(mock.ANY),
+        mock.call.save_ingestion_page("search", 19, 90),
+        mock.call.advance_ingestion_cursor("search", 90),
+        mock.call.add_inbox_tweets(mock.ANY),
+        mock.call.save_ingestion_page("mentions", 94, 95),
+        mock.call.advance_ingestion_cursor("mentions", 95),
+    ]
+
+
+def test_ingest_tweets_failure():
+    storage = mock.MagicMock()
+    storage.get_ingestion_cursor.return_value = {
+        "_id": "search",
+        "since_id": 10,
+    }
+
+    def search_pages(*args):
+        yield [sign_up_tweet(40)]
+        raise RuntimeError("Twitter API error")
+
+    twclient = mock.MagicMock()
+    twclient.search_pages.side_effect = search_pages
+
+    with pytest.raises(RuntimeError):
+        ingest_tweets(storage, twclient, smv_config, "@hello_mixel", OneLog())
+
+    # the next run continues after the stored page
+    storage.save_ingestion_page.assert_called_once_with("search", 39, 40)
+    assert storage.advance_ingestion_cursor.mock_calls == []
+
+
+def test_handle_process_tweets_time_budget():
+    storage, twclient = mock_clients(
+        [sign_up_tweet(i) for i in range(4, 0, -1)],
+        todo_tweets={6: sign_up_tweet(6)},
+    )
+    # left by the previous run
+    storage.add_inbox_tweets.side_effect([inbox_item(sign_up_tweet(5), 0)])
+    config = SMVConfig(
+        **{
+            **smv_config.__dict__,
+            "tweet_record_batch_size": 2,
+            "time_budget": 7,
+        }
+    )
+
+    # start, then start and end of batches: the 3rd batch would likely end
+    # after 8 seconds
+    with mock.patch(
+        "handlers.process_tweets.timer", side_effect=[0, 1, 3, 4, 5, 6]
+    ):
+        response = run(storage, twclient, config)
+
+    assert response.json == {
+        "status": "success",
+        "processed_count": 4,
+        "failed_count": 0,
+        "dead_letter_count": 0,
+        "remaining_count": 2,
+    }
+    assert [
+        call.kwargs["tweet_id"]
+        for call in storage.upsert_tweet_record.mock_calls
+        if call.kwargs.get("status") == "PASSED"
+    ] == [1, 2, 3, 4]
+    assert not any(
+        call.kwargs["tweet_id"] in [5, 6]
+        for call in storage.upsert_tweet_record.mock_calls
+    )
+    # not started tweets are left in their queues for the next run
+    storage.remove_todo_tweets.assert_called_once_with([])
+    storage.remove_inbox_tweets.assert_called_once_with([1, 2, 3, 4])
+    assert storage.renew_lease.call_count == 2
+
+
+def test_handle_process_tweets_remaining_inbox():
+    storage, twclient = mock_clients([])
+    storage.add_inbox_tweets.side_effect(
+        [inbox_item(sign_up_tweet(i), 0) for i in range(1, 6)]
+    )
+    # more than one page in the inbox
+    get_inbox_tweets = storage.get_inbox_tweets.side_effect
+    storage.get_inbox_tweets.side_effect = (
+        lambda shard_index, limit=1000: get_inbox_tweets(shard_index, 2)
+    )
+
+    response = run(storage, twclient)
+
+    assert response.json["processed_count"] == 2
+    # the rest of the inbox is counted
+    assert response.json["remaining_count"] == 3
+    storage.get_inbox_tweet_count.assert_called_once_with(0)
+
+
+def test_handle_process_tweets_time_budget_first_batch():
+    storage, twclient = mock_clients(
+        [sign_up_tweet(i) for i in range(4, 0, -1)]
+    )
+    config = SMVConfig(
+        **{
+            **smv_config.__dict__,
+            "tweet_record_batch_size": 2,
+            "time_budget": 1,
+        }
+    )
+
+    # the budget is spent before processing
+    with mock.patch("handlers.process_tweets.timer", side_effect=[0, 5, 6, 7]):
+        response = run(storage, twclient, config)
+
+    # at least one batch is processed in every run
+    assert response.json["processed_count"] == 2
+    assert response.json["remaining_count"] == 2
+
+
+def test_handle_process_tweets_time_budget_verification():
+    storage, twclient = mock_clients(
+        [sign_up_tweet(i) for i in range(4, 0, -1)]
+    )
+    config = SMVConfig(
+        **{
+            **smv_config.__dict__,
+            "tweet_record_batch_size": 2,
+            "time_budget": 3,
+        }
+    )
+
+    # start, then start and end of the 1st batch, the 2nd would end late
+    with mock.patch(
+        "handlers.process_tweets.timer", side_effect=[0, 1, 3, 3.5]
+    ), mock.patch.object(
+        SignatureBatch,
+        "add_tweet",
+        autospec=True,
+        side_effect=SignatureBatch.add_tweet,
+    ) as add_tweet_mock:
+        response = run(storage, twclient, config)
+
+    assert response.json["processed_count"] == 2
+    assert response.json["remaining_count"] == 2
+    # signatures are verified with their batch, within the budget
+    assert [call.args[1].tweet_id for call in add_tweet_mock.mock_calls] == [
+        1,
+        2,
+    ]
+
+
+def test_handle_process_tweets_pages_in_order():
+    storage, twclient = mock_clients([])
+    # pages of the same user, from newest to oldest
+    twclient.search_pages.side_effect = lambda *args: iter(
+        [
+            [sign_up_tweet(40), sign_up_tweet(30)],
+            [sign_up_tweet(20), sign_up_tweet(10)],
+        ]
+    )
+    config = SMVConfig(**{**smv_config.__dict__, "tweet_record_batch_size": 1})
+
+    response = run(storage, twclient, config)
+
+    assert response.json["processed_count"] == 4
+    # from oldest to newest across pages, the last sign-up wins
+    assert [
+        call.kwargs["tweet_id"]
+        for call in storage.upsert_tweet_record.mock_calls
+        if call.kwargs.get("status") == "PASSED"
+    ] == [10, 20, 30, 40]
+    storage.remove_inbox_tweets.assert_called_once_with([10, 20, 30, 40])
+
+
+def test_handle_process_tweets_rate_limited():
+    storage, twclient = mock_clients([], todo_tweets={6: sign_up_tweet(6)})
+
+    def search_pages(*args):
+        yield [sign_up_tweet(4)]
+        raise TwythonRateLimitError("Rate limit exceeded", 429)
+
+    twclient.search_pages.side_effect = search_pages
+    twclient.mentions_pages.side_effect = lambda *args: iter(
+        [[sign_up_tweet(3)]]
+    )
+    twclient.get_by_ids.side_effect = TwythonRateLimitError(
+        "Rate limit exceeded", 429
+    )
+
+    response = run(storage, twclient)
+
+    # fetched tweets are processed
+    assert response.json["status"] == "success"
+    assert response.json["processed_count"] == 2
+    # search continues with the next page in the next run
+    storage.save_ingestion_page.assert_any_call("search", 3, 4)
+    assert storage.advance_ingestion_cursor.mock_calls == [
+        mock.call("mentions", 3)
+    ]
+    # todo tweets are left for the next run
+    storage.remove_todo_tweets.assert_called_once_with([])
+
+
+def test_tweet_processor_reused():
+    storage, twclient = mock_clients([])
+    leases = [mock.MagicMock(), mock.MagicMock()]
+    processor = TweetProcessor(
+        storage,
+        twclient,
+        smv_config,
+        leases[0],
+        None,
+        "@hello_mixel",
+        OneLog(),
+    )
+
+    assert processor.process([sign_up_tweet(1)]) == []
+    processor.start(leases[1], OneLog())
+    assert processor.process([sign_up_tweet(2)]) == []
+
+    # counters of the run, under its lease
+    assert processor.processed_count == 1
+    leases[1].renew.assert_called_once_with()
+    # variant counts read once, kept with matches of previous runs
+    storage.get_signature_variant_counts.assert_called_once_with()
+    assert sum(processor.variant_counts.values()) == 2
@@ -1,3 +1,5 @@
+import random
+import re
 import pytest
 from common import TweetInvalidFormatError
 from handlers.process_tweets import parse_tweet_message
@@ -72,3 +74,83 @@ msg_sign = "BqWxgF8o+qKolb/NdnRPtF5eHQyyOa2laUul6DyAEfEKCOC33UZk3wGfv6QCtYnFDuAP
 def test_parse_message_invalid_format(message):
     with pytest.raises(TweetInvalidFormatError):
         parse_tweet_message(message, twitter_handle)
+
+
+def legacy_parse_tweet_message(msg: str, twitter_handle: str):
+    """Parser with separate regular expressions: the reference behaviour"""
+    if not re.search(rf"(^|.*){twitter_handle}([^a-zA-Z0-9_]|$)", msg):
+        raise TweetInvalidFormatError("Missing twitter handle.")
+    m = re.search(r"(^|[^0-9a-fA-F])([0-9a-fA-F]{64,64})([^0-9a-fA-F]|$)", msg)
+    if not m:
+        raise TweetInvalidFormatError("Missing pubkey.")
+    pubkey = m.group(2)
+    m = re.search(r"(^|[^a-zA-Z0-9/+])([a-zA-Z0-9/+]{60,}==)(.*|$)", msg)
+    if not m:
+        raise TweetInvalidFormatError("Missing signature.")
+    return pubkey, m.group(2)
+
+
+def parse_result(parse, message: str, handle: str):
+    try:
+        return parse(message, handle)
+    except TweetInvalidFormatError as err:
+        return str(err)
+
+
+hex_64 = "0123456789abcdefABCDEF" * 2 + "0123456789abcdefABCD"
+assert len(hex_64) == 64
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        f"{twitter_handle} {hex_64}==",
+        f"{twitter_handle} zz{hex_64}zz==",
+        f"{twitter_handle} {hex_64}a {msg_sign}",
+        f"{twitter_handle} a{hex_64} {msg_sign}",
+        f"{twitter_handle} {hex_64}/{msg_sign}",
+        f"{twitter_handle}/{msg_sign} {pubkey}",
+        f"{twitter_handle}2 {pubkey} {msg_sign}",
+        f"x{twitter_handle} {pubkey} {msg_sign}\n",
+        f"{pubkey} {msg_sign[:-3]}== {twitter_handle}",
+        f"{pubkey} {msg_sign[:58]}== {twitter_handle}",
+        f"{pubkey} {msg_sign}= {twitter_handle}",
+        f"{pubkey} {msg_sign}={msg_sign} {twitter_handle}",
+        f"{pubkey}{pubkey} {msg_sign} {twitter_handle}",
+        f"{twitter_handle}\n{pubkey}\n{msg_sign}\n",
+        f"{twitter_handle.upper()} {pubkey} {msg_sign}",
+        "",
+    ],
+)
+def test_parse_message_edge_cases(message):
+    assert parse_result(
+        parse_tweet_message, message, twitter_handle
+    ) == parse_result(legacy_parse_tweet_message, message, twitter_handle)
+
+
+def test_parse_message_random():
+    rand = random.Random(1234)
+    pieces = [
+        twitter_handle,
+        twitter_handle + "_x",
+        "@another_acc",
+        pubkey,
+        pubkey[:63],
+        pubkey + "a",
+        msg_sign,
+        msg_sign[:-2],
+        msg_sign[20:],
+        "taking a ride",
+        "https://test.url",
+        "🔥",
+    ]
+    separators = [" ", "", "\n", "\t", "/", "+", "=", "==", "@", "_", "-"]
+
+    for _ in range(2000):
+        message = "".join(
+            rand.choice(pieces) + rand.choice(separators)
+            for _ in range(rand.randrange(1, 6))
+        )
+        assert parse_result(
+            parse_tweet_message, message, twitter_handle
+        ) == parse_result(legacy_parse_tweet_message, message, twitter_handle)
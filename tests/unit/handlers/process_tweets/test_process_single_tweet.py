@@ -45,7 +45,6 @@ smv_config = SMVConfig(
     twitter_reply_message_success="",
     twitter_reply_message_invalid_format="Tweet has invalid format.",
     twitter_reply_message_invalid_signature="Tweet has invalid signature.",
-    twitter_reply_delay=0.1,
 )
 
 
@@ -229,6 +228,13 @@ def test_process_tweet_invalid_signature(capsys):
             text=tweet_invalid_signature.full_text,
             status="PROCESSING",
         ),
+        mock.call.enqueue_reply(
+            tweet_id=tweet_invalid_signature.tweet_id,
+            user_id=tweet_invalid_signature.user_id,
+            screen_name=tweet_invalid_signature.user_screen_name,
+            text=tweet_invalid_signature.full_text,
+            message=smv_config.twitter_reply_message_invalid_signature,
+        ),
         mock.call.upsert_tweet_record(
             tweet_id=tweet_invalid_signature.tweet_id,
             reply=smv_config.twitter_reply_message_invalid_signature,
@@ -236,10 +242,24 @@ def test_process_tweet_invalid_signature(capsys):
         ),
     ]
 
-    # assert twitter API calls
-    assert twclient.mock_calls == [
-        mock.call.reply(
-            smv_config.twitter_reply_message_invalid_signature,
-            tweet_invalid_signature,
-        )
-    ]
+    # assert twitter API calls: reply is sent from the outbox
+    assert twclient.mock_calls == []
+
+
+def test_process_tweet_without_processed_check():
+    storage = mock.MagicMock()
+    twclient = mock.MagicMock()
+
+    process_tweet(
+        tweet=tweet_invalid_format,
+        storage=storage,
+        twclient=twclient,
+        config=smv_config,
+        tweet_prefix=twitter_tweet_prefix,
+        twitter_handle=twitter_handle,
+        check_processed=False,
+    )
+
+    # no lookup, caller has already checked the tweet
+    assert storage.get_tweet_record.mock_calls == []
+    assert len(storage.upsert_tweet_record.mock_calls) == 2
@@ -0,0 +1,204 @@
+import base64
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import mock
+import ed25519
+import pytest
+from common import TweetInvalidSignatureError
+from services.twitter import Tweet
+from services.verification_cache import VerificationCache
+from handlers.process_tweets import (
+    SignatureBatch,
+    message_digest,
+    is_digest_sig_valid,
+    get_verification_pool,
+    shutdown_verification_pool,
+)
+
+pubkey = "01152723fa548599255ea0a17cbeb5d92c9659c8d797eb7c1213419218c6b94f"
+sig_with_at = "ku39iMD7/SLTxfZUw7SAn5K3mypHGmp7hKpgh0yDIWGRR9Qlc1yqoUOaVbMbgjFU8nNots2BDFKK4f79HokbCA=="  # noqa: E501
+sig_without_at = "caq81rZuZ3bHf/IrsDaAkGB2VFdHlydfdCqyChzfh6U+mRi3oeIpXI6WanOIOIva6GZE4i3VgdpX+TWAs/z6CA=="  # noqa: E501
+sig_invalid = "ku39iMD7/SLTxfZUw7SAn5K3mypHGmp7hKpgh0yDIWGRR9Qlc1yqoUOaVbMbgjFU8nNots2BDFKK4f7INVALID=="  # noqa: E501
+
+
+def signed_entry(handle: str, valid: bool = True):
+    signing_key, verifying_key = ed25519.create_keypair()
+    digest = message_digest(f"@{handle}")
+    sig = signing_key.sign(digest if valid else message_digest(handle))
+    return (
+        verifying_key.to_bytes().hex(),
+        digest,
+        base64.b64encode(sig).decode("ascii"),
+    )
+
+
+@pytest.mark.parametrize(
+    "valid",
+    [
+        [],
+        [True],
+        [False],
+        [True] * 16,
+        [False] * 5,
+        [True, False, True, True, True, True, False, True, True],
+    ],
+)
+def test_signature_batch_results(valid):
+    entries = [signed_entry(f"handle_{i}", ok) for i, ok in enumerate(valid)]
+    batch = SignatureBatch()
+    for i, (pub_key, _, sig) in enumerate(entries):
+        batch.add(pub_key, sig, f"handle_{i}")
+
+    assert batch.verify() == sum(valid)
+    # the same results as verified one by one
+    assert [
+        is_digest_sig_valid(sig, digest, pub_key)
+        for pub_key, digest, sig in entries
+    ] == valid
+
+
+def test_signature_batch():
+    batch = SignatureBatch()
+    batch.add(pubkey, sig_with_at, "twitter_account")
+    batch.add(pubkey, sig_without_at, "twitter_account")
+    batch.add(pubkey, sig_invalid, "twitter_account")
+    batch.add(pubkey, sig_with_at, "another_account")
+
+    # only "@twitter_account" message is verified in the batch
+    assert batch.verify() == 1
+
+    # same results as validate_signature
+    assert (
+        batch.validate_signature(pubkey, sig_with_at, "twitter_account")
+        == "@handle"
+    )
+    assert (
+        batch.validate_signature(pubkey, sig_without_at, "twitter_account")
+        == "handle"
+    )
+    with pytest.raises(TweetInvalidSignatureError):
+        batch.validate_signature(pubkey, sig_invalid, "twitter_account")
+    with pytest.raises(TweetInvalidSignatureError):
+        batch.validate_signature(pubkey, sig_with_at, "another_account")
+
+    assert batch.variant_hits == {"@handle": 1, "handle": 1}
+
+
+def test_signature_batch_variant_order():
+    batch = SignatureBatch({"handle": 5, "@handle": 2})
+    assert batch.variants[:2] == ["handle", "@handle"]
+
+    batch.add(pubkey, sig_with_at, "twitter_account")
+    batch.add(pubkey, sig_without_at, "twitter_account")
+
+    # the most common variant: "twitter_account" is verified in the batch
+    assert batch.verify() == 1
+    assert (
+        batch.validate_signature(pubkey, sig_without_at, "twitter_account")
+        == "handle"
+    )
+    assert (
+        batch.validate_signature(pubkey, sig_with_at, "twitter_account")
+        == "@handle"
+    )
+
+
+def test_signature_batch_add_tweet():
+    batch = SignatureBatch()
+    batch.add_tweet(
+        Tweet(1, 2, "twitter_account", f"@hello {pubkey} {sig_with_at}"),
+        "@hello",
+    )
+    # invalid format is ignored
+    batch.add_tweet(Tweet(3, 4, "twitter_account", "Hello!!"), "@hello")
+
+    assert batch.verify() == 1
+
+
+@pytest.mark.parametrize(
+    "pool_class", [ThreadPoolExecutor, ProcessPoolExecutor]
+)
+def test_signature_batch_pool(pool_class):
+    tweets = [
+        Tweet(1, 2, "twitter_account", f"@hello {pubkey} {sig_with_at}"),
+        Tweet(3, 4, "twitter_account", f"@hello {pubkey} {sig_without_at}"),
+        Tweet(5, 6, "twitter_account", f"@hello {pubkey} {sig_invalid}"),
+        Tweet(7, 8, "another_account", f"@hello {pubkey} {sig_with_at}"),
+        Tweet(9, 10, "twitter_account", "Hello!!"),
+    ]
+    batch = SignatureBatch()
+    for tweet in tweets:
+        batch.add_tweet(tweet, "@hello")
+
+    with pool_class(2) as pool:
+        assert batch.verify(pool, chunk_size=2) == 2
+
+    with mock.patch(
+        "handlers.process_tweets.validate_signature"
+    ) as validate_signature_mock:
+        assert (
+            batch.validate_signature(pubkey, sig_with_at, "twitter_account")
+            == "@handle"
+        )
+        assert (
+            batch.validate_signature(pubkey, sig_without_at, "twitter_account")
+            == "handle"
+        )
+        with pytest.raises(TweetInvalidSignatureError):
+            batch.validate_signature(pubkey, sig_invalid, "twitter_account")
+        with pytest.raises(TweetInvalidSignatureError):
+            batch.validate_signature(pubkey, sig_with_at, "another_account")
+
+    # all signatures have been verified in the pool
+    assert validate_signature_mock.mock_calls == []
+
+
+def test_signature_batch_cache():
+    cache = VerificationCache()
+    tweets = [
+        Tweet(1, 2, "twitter_account", f"@hello {pubkey} {sig_with_at}"),
+        Tweet(3, 4, "twitter_account", f"@hello {pubkey} {sig_invalid}"),
+        Tweet(5, 6, "twitter_account", "Hello!!"),
+    ]
+
+    batch = SignatureBatch(cache=cache)
+    for tweet in tweets:
+        batch.add_tweet(tweet, "@hello")
+    assert batch.verify() == 1
+    with pytest.raises(TweetInvalidSignatureError):
+        batch.validate_signature(pubkey, sig_invalid, "twitter_account")
+    assert cache.stats()["misses"] == 2
+
+    # the same tweets again
+    batch = SignatureBatch(cache=cache)
+    for tweet in tweets:
+        batch.add_tweet(tweet, "@hello")
+    with mock.patch(
+        "handlers.process_tweets.validate_signature"
+    ) as validate_signature_mock, mock.patch(
+        "handlers.process_tweets.is_digest_sig_valid"
+    ) as is_digest_sig_valid_mock:
+        assert batch.verify() == 1
+        assert (
+            batch.validate_signature(pubkey, sig_with_at, "twitter_account")
+            == "@handle"
+        )
+        with pytest.raises(TweetInvalidSignatureError):
+            batch.validate_signature(pubkey, sig_invalid, "twitter_account")
+
+    assert validate_signature_mock.mock_calls == []
+    assert is_digest_sig_valid_mock.mock_calls == []
+    assert cache.stats()["hits"] == 2
+
+
+def test_get_verification_pool():
+    try:
+        pool = get_verification_pool(1)
+        # reused by the next runs
+        assert get_verification_pool(1) is pool
+        assert pool.submit(abs, -1).result() == 1
+        # a new pool when the number of workers changes
+        assert get_verification_pool(2) is not pool
+    finally:
+        shutdown_verification_pool()
+    assert get_verification_pool(1) is not pool
+    shutdown_verification_pool()
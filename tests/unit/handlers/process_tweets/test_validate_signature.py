@@ -1,6 +1,14 @@
 import pytest
+from unittest import mock
 from common import TweetInvalidSignatureError
-from handlers.process_tweets import validate_signature
+from services.verifier import get_verifier
+from handlers.process_tweets import (
+    SIGNATURE_VARIANTS,
+    candidate_digests,
+    message_digest,
+    order_signature_variants,
+    validate_signature,
+)
 
 
 @pytest.mark.parametrize(
@@ -52,3 +60,87 @@ def test_validate_signature_negative(
 ):
     with pytest.raises(TweetInvalidSignatureError):
         validate_signature(pubkey, signed_message, twitter_handle)
+
+
+@pytest.mark.parametrize(
+    "twitter_handle, expected_count",
+    [
+        ("Twitter_Account", 30),
+        ("twitter_account", 20),
+        ("TWITTER_ACCOUNT", 20),
+        ("123_456", 10),
+    ],
+)
+def test_candidate_digests(twitter_handle, expected_count):
+    digests = candidate_digests(twitter_handle)
+
+    assert list(digests.keys()) == list(SIGNATURE_VARIANTS.keys())
+    assert len(set(digests.values())) == expected_count
+    assert digests["handle"] == message_digest(twitter_handle)
+    assert digests["@handle"] == message_digest(f"@{twitter_handle}")
+    assert digests["@lower+CRLF"] == message_digest(
+        f"@{twitter_handle.lower()}\r\n"
+    )
+    assert digests["upper+tab"] == message_digest(
+        f"{twitter_handle.upper()}\t"
+    )
+    # memoized
+    assert candidate_digests(twitter_handle) is digests
+
+
+def test_order_signature_variants():
+    assert len(SIGNATURE_VARIANTS) == 30
+    assert order_signature_variants({}) == list(SIGNATURE_VARIANTS.keys())
+    assert order_signature_variants({"@handle": 10})[0] == "@handle"
+
+    ordered = order_signature_variants(
+        {"@handle": 10, "handle+LF": 12, "@lower": 3}
+    )
+    assert ordered[:4] == ["handle+LF", "@handle", "@lower", "handle"]
+    assert sorted(ordered) == sorted(SIGNATURE_VARIANTS.keys())
+
+
+@pytest.mark.parametrize(
+    "variants",
+    [
+        None,
+        ["handle"],
+        ["handle+LF", "@handle", "handle"],
+    ],
+)
+def test_validate_signature_variant(variants):
+    assert (
+        validate_signature(
+            "01152723fa548599255ea0a17cbeb5d92c9659c8d797eb7c1213419218c6b94f",
+            "caq81rZuZ3bHf/IrsDaAkGB2VFdHlydfdCqyChzfh6U+mRi3oeIpXI6WanOIOIva6GZE4i3VgdpX+TWAs/z6CA==",  # noqa: E501
+            "twitter_account",
+            variants,
+        )
+        == "handle"
+    )
+
+
+def test_validate_signature_variant_not_tried():
+    with pytest.raises(TweetInvalidSignatureError):
+        validate_signature(
+            "01152723fa548599255ea0a17cbeb5d92c9659c8d797eb7c1213419218c6b94f",
+            "caq81rZuZ3bHf/IrsDaAkGB2VFdHlydfdCqyChzfh6U+mRi3oeIpXI6WanOIOIva6GZE4i3VgdpX+TWAs/z6CA==",  # noqa: E501
+            "twitter_account",
+            ["@handle", "handle+LF"],
+        )
+
+
+@mock.patch("ed25519.VerifyingKey")
+def test_validate_signature_decodes_key_once(VerifyingKeyMock):
+    VerifyingKeyMock.return_value.verify.side_effect = Exception("invalid")
+
+    with pytest.raises(TweetInvalidSignatureError):
+        validate_signature(
+            "01152723fa548599255ea0a17cbeb5d92c9659c8d797eb7c1213419218c6b94f",
+            "caq81rZuZ3bHf/IrsDaAkGB2VFdHlydfdCqyChzfh6U+mRi3oeIpXI6WanOIOIva6GZE4i3VgdpX+TWAs/z6CA==",  # noqa: E501
+            "Twitter_Account",
+            verifier=get_verifier("ed25519"),
+        )
+
+    assert VerifyingKeyMock.call_count == 1
+    assert VerifyingKeyMock.return_value.verify.call_count == 30
@@ -1,15 +1,25 @@
 from unittest import mock
+from datetime import datetime, timezone
+import gzip
 import flask
+import pytest
 import re
 from handlers.parties import handle_parties
+from services.parties_snapshot import SnapshotEntry
+
+LAST_MODIFIED = datetime(2021, 9, 13, 10, 34, 20, 123000, timezone.utc)
+ETAG = 'W/"1631529260123-compact"'
 
 
 def test_handle_parties(capsys):
     storage = mock.MagicMock()
-    storage.get_parties.return_value = [
-        {"party_id": "pub key 1", "twitter_handle": "handle 1"},
-        {"party_id": "pub key 2", "twitter_handle": "handle 2"},
-    ]
+    storage.get_parties_last_modified.return_value = LAST_MODIFIED
+    storage.iter_parties.return_value = iter(
+        [
+            {"party_id": "pub key 1", "twitter_handle": "handle 1"},
+            {"party_id": "pub key 2", "twitter_handle": "handle 2"},
+        ]
+    )
 
     app = flask.Flask("test")
 
@@ -19,21 +29,272 @@ def test_handle_parties(capsys):
 
     # validate response
     assert response.status_code == 200
+    assert response.is_streamed
     assert response.json == [
         {"party_id": "pub key 1", "twitter_handle": "handle 1"},
         {"party_id": "pub key 2", "twitter_handle": "handle 2"},
     ]
 
-    # validate function calls
+    assert response.headers["ETag"] == ETAG
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in response.headers
+
+    # validate function calls: the last change first
+    assert storage.mock_calls == [
+        mock.call.get_parties_last_modified(),
+        mock.call.iter_parties(),
+    ]
+
+    # validate log: request, and number of parties once streamed
+    captured = capsys.readouterr()
+
+    assert re.match(
+        r'^{"time":"[^"]*","action":"handle_parties",'
+        r'"streamed":true,"time_ms":\d+,"status":"SUCCESS"}\n'
+        r'{"time":"[^"]*","action":"log_streamed_parties",'
+        r'"parties_count":2,"time_ms":\d+,"status":"SUCCESS"}$',
+        captured.out,
+    )
+
+
+def test_handle_parties_same_as_jsonify():
+    parties = [
+        {
+            "party_id": f"pub key {i}",
+            "twitter_handle": f"handle {i}",
+            "twitter_user_id": i,
+            "created": 1631529260,
+            "last_modified": 1631529260,
+        }
+        for i in range(3)
+    ]
+    storage = mock.MagicMock()
+    storage.get_parties_last_modified.return_value = None
+
+    app = flask.Flask("test")
+    for pretty in [True, False]:
+        app.config["JSONIFY_PRETTYPRINT_REGULAR"] = pretty
+        with app.test_request_context():
+            storage.iter_parties.return_value = iter(parties)
+            response = handle_parties(storage)  # type: flask.Response
+
+            assert response.get_data() == flask.jsonify(parties).get_data()
+            assert response.mimetype == "application/json"
+
+
+def test_handle_parties_snapshot(capsys):
+    storage = mock.MagicMock()
+    snapshot = mock.MagicMock()
+    snapshot.get.return_value = SnapshotEntry(
+        1, 0, b'[{"party_id":"pub key 1"}]\n', LAST_MODIFIED
+    )
+
+    app = flask.Flask("test")
+
+    # execute
+    with app.test_request_context():
+        response = handle_parties(storage, snapshot)  # type: flask.Response
+
+    # validate response: served from memory
+    assert response.status_code == 200
+    assert not response.is_streamed
+    assert response.mimetype == "application/json"
+    assert response.json == [{"party_id": "pub key 1"}]
+    assert response.headers["ETag"] == ETAG
+    assert snapshot.mock_calls == [mock.call.get(pretty=False)]
+    assert storage.mock_calls == []
+
+    # validate log
+    captured = capsys.readouterr()
+
+    assert re.match(
+        r'^{"time":"[^"]*","action":"handle_parties",'
+        r'"snapshot":true,"response_size":27,"gzip":false,"time_ms":\d+,'
+        r'"status":"SUCCESS"}$',
+        captured.out,
+    )
+
+
+def test_handle_parties_snapshot_gzip():
+    snapshot = mock.MagicMock()
+    entry = SnapshotEntry(1, 0, b'[{"party_id":"pub key 1"}]\n' * 100, None)
+    snapshot.get.return_value = entry
+
+    app = flask.Flask("test")
+
+    # execute
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = handle_parties(mock.MagicMock(), snapshot)
+
+    # validate response: compressed once, with the snapshot
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == 'W/"0-compact"'
+    assert response.get_data() is entry.gzip_body()
+    assert gzip.decompress(response.get_data()) == entry.body
+
+
+def test_handle_parties_gzip():
+    parties = [{"party_id": f"pub key {i}"} for i in range(100)]
+    storage = mock.MagicMock()
+    storage.get_parties_last_modified.return_value = LAST_MODIFIED
+    storage.iter_parties.return_value = iter(parties)
+
+    app = flask.Flask("test")
+
+    # execute
+    with app.test_request_context(
+        headers={"Accept-Encoding": "deflate, gzip;q=0.5"}
+    ):
+        response = handle_parties(storage)  # type: flask.Response
+
+    # validate response: still streamed
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == ETAG
+    with app.app_context():
+        assert (
+            gzip.decompress(response.get_data())
+            == flask.jsonify(parties).get_data()
+        )
+
+
+@pytest.mark.parametrize(
+    "if_none_match", [ETAG, '"1631529260123-compact"', f'"other", {ETAG}']
+)
+def test_handle_parties_not_modified(capsys, if_none_match: str):
+    storage = mock.MagicMock()
+    storage.get_parties_last_modified.return_value = LAST_MODIFIED
+
+    app = flask.Flask("test")
+
+    # execute
+    with app.test_request_context(
+        headers={"If-None-Match": if_none_match, "Accept-Encoding": "gzip"}
+    ):
+        response = handle_parties(storage)  # type: flask.Response
+
+    # validate response: no body, parties not read
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.headers["ETag"] == ETAG
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in response.headers
+    assert storage.mock_calls == [mock.call.get_parties_last_modified()]
+
+    # validate log
+    captured = capsys.readouterr()
+
+    assert re.match(
+        r'^{"time":"[^"]*","action":"handle_parties",'
+        r'"not_modified":true,"time_ms":\d+,"status":"SUCCESS"}$',
+        captured.out,
+    )
+
+
+def test_handle_parties_modified():
+    storage = mock.MagicMock()
+    storage.get_parties_last_modified.return_value = LAST_MODIFIED
+    storage.iter_parties.return_value = iter([])
+
+    app = flask.Flask("test")
+    app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
+
+    # execute: ETag of the previous change, or of the other format
+    for if_none_match in ['W/"1631529260122-pretty"', ETAG]:
+        with app.test_request_context(
+            headers={"If-None-Match": if_none_match}
+        ):
+            response = handle_parties(storage)  # type: flask.Response
+
+        # validate response
+        assert response.status_code == 200
+        assert response.headers["ETag"] == 'W/"1631529260123-pretty"'
+
+
+def test_handle_parties_snapshot_not_modified():
+    storage = mock.MagicMock()
+    snapshot = mock.MagicMock()
+    snapshot.get.return_value = SnapshotEntry(1, 0, b"[]\n", LAST_MODIFIED)
+
+    app = flask.Flask("test")
+
+    # execute
+    with app.test_request_context(headers={"If-None-Match": ETAG}):
+        response = handle_parties(storage, snapshot)  # type: flask.Response
+
+    # validate response: without touching the database
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert storage.mock_calls == []
+    assert snapshot.mock_calls == [mock.call.get(pretty=False)]
+
+
+def test_handle_parties_since(capsys):
+    storage = mock.MagicMock()
+    snapshot = mock.MagicMock()
+    storage.get_parties_last_modified.return_value = LAST_MODIFIED
+    storage.iter_party_changes.return_value = iter(
+        [
+            {"party_id": "pub key 1", "blocked": False},
+            {"party_id": "pub key 2", "blocked": True},
+        ]
+    )
+
+    app = flask.Flask("test")
+
+    # execute
+    with app.test_request_context():
+        response = handle_parties(
+            storage, snapshot, since="1631529260"
+        )  # type: flask.Response
+
+    # validate response: changes, streamed from the database
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.json == [
+        {"party_id": "pub key 1", "blocked": False},
+        {"party_id": "pub key 2", "blocked": True},
+    ]
+    assert response.headers["ETag"] == ETAG
     assert storage.mock_calls == [
-        mock.call.get_parties(),
+        mock.call.get_parties_last_modified(),
+        mock.call.iter_party_changes(
+            datetime(2021, 9, 13, 10, 34, 20, tzinfo=timezone.utc)
+        ),
     ]
+    assert snapshot.mock_calls == []
 
     # validate log
     captured = capsys.readouterr()
 
     assert re.match(
         r'^{"time":"[^"]*","action":"handle_parties",'
-        r'"parties_count":2,"time_ms":0,"status":"SUCCESS"}$',
+        r'"since":"1631529260","streamed":true,"time_ms":\d+,'
+        r'"status":"SUCCESS"}\n'
+        r'{"time":"[^"]*","action":"log_streamed_parties",'
+        r'"parties_count":2,"time_ms":\d+,"status":"SUCCESS"}$',
         captured.out,
     )
+
+
+@pytest.mark.parametrize(
+    "since", ["", "yesterday", "-1", "nan", "inf", "1e12", "1e20"]
+)
+def test_handle_parties_since_invalid(since: str):
+    storage = mock.MagicMock()
+
+    app = flask.Flask("test")
+
+    # execute
+    with app.test_request_context():
+        response, status = handle_parties(storage, since=since)
+
+    # validate response
+    assert status == 400
+    assert response.json == {
+        "status": "failed",
+        "error": "since argument must be seconds since the epoch",
+    }
+    assert storage.mock_calls == []
@@ -0,0 +1,194 @@
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+import flask
+from twython.exceptions import TwythonError, TwythonRateLimitError
+from pymongo.errors import AutoReconnect
+from common import SMVConfig
+from services.twitter import Tweet
+import pytest
+from handlers.process_replies import (
+    handle_process_replies,
+    next_reply_attempt,
+    send_replies_after_run,
+)
+
+smv_config = SMVConfig(
+    twitter_search_text="I'm taking a ride with",
+    twitter_reply_message_success="",
+    twitter_reply_message_invalid_format="Tweet has invalid format.",
+    twitter_reply_message_invalid_signature="Tweet has invalid signature.",
+    twitter_reply_limit=10,
+    twitter_reply_limit_window=3600,
+    twitter_reply_max_attempts=3,
+    twitter_reply_retry_delay=60,
+)
+
+
+def outbox_item(tweet_id: int, attempts: int = 0):
+    return {
+        "_id": tweet_id,
+        "tweet_id": tweet_id,
+        "user_id": tweet_id * 10,
+        "screen_name": f"user_{tweet_id}",
+        "text": "Hello",
+        "message": "Tweet has invalid signature.",
+        "status": "PENDING",
+        "attempts": attempts,
+    }
+
+
+def run(storage, twclient) -> flask.Response:
+    app = flask.Flask("test")
+    with app.test_request_context():
+        return handle_process_replies(storage, twclient, smv_config)
+
+
+def test_next_reply_attempt():
+    now = datetime(2021, 5, 1, tzinfo=timezone.utc)
+
+    assert next_reply_attempt(smv_config, 1, now) == now + timedelta(
+        seconds=60
+    )
+    assert next_reply_attempt(smv_config, 2, now) == now + timedelta(
+        seconds=120
+    )
+    assert next_reply_attempt(smv_config, 3, now) is None
+
+
+def test_handle_process_replies():
+    storage = mock.MagicMock()
+    storage.get_sent_reply_count.return_value = 7
+    storage.get_pending_replies.return_value = [
+        outbox_item(1),
+        outbox_item(2, attempts=1),
+        outbox_item(3, attempts=2),
+    ]
+    twclient = mock.MagicMock()
+    twclient.reply.side_effect = [
+        None,
+        TwythonError("Internal error"),
+        TwythonError("Internal error"),
+    ]
+    twclient.rate_limit_remaining.return_value = None
+
+    response = run(storage, twclient)
+
+    assert response.json == {"status": "success", "sent": 1, "failed": 2}
+    # only 3 more replies fit into the rate limit
+    storage.get_pending_replies.assert_called_once_with(limit=3)
+    assert twclient.reply.mock_calls == [
+        mock.call(
+            "Tweet has invalid signature.",
+            Tweet(1, 10, "user_1", "Hello"),
+        ),
+        mock.call(
+            "Tweet has invalid signature.",
+            Tweet(2, 20, "user_2", "Hello"),
+        ),
+        mock.call(
+            "Tweet has invalid signature.",
+            Tweet(3, 30, "user_3", "Hello"),
+        ),
+    ]
+    storage.mark_reply_sent.assert_called_once_with(1)
+    assert storage.mark_reply_failed.mock_calls == [
+        # retried later
+        mock.call(2, "Internal error", mock.ANY),
+        # no more attempts
+        mock.call(3, "Internal error", None),
+    ]
+    assert storage.mark_reply_failed.mock_calls[0].args[2] is not None
+
+
+def test_handle_process_replies_rate_limited():
+    storage = mock.MagicMock()
+    storage.get_sent_reply_count.return_value = 0
+    storage.get_pending_replies.return_value = [
+        outbox_item(1),
+        outbox_item(2),
+        outbox_item(3),
+    ]
+    twclient = mock.MagicMock()
+    twclient.reply.side_effect = [None, TwythonRateLimitError("Limit", 429)]
+    twclient.rate_limit_remaining.return_value = 5
+
+    response = run(storage, twclient)
+
+    assert response.json == {"status": "success", "sent": 1, "failed": 0}
+    assert len(twclient.reply.mock_calls) == 2
+    # rate limited reply is not a failed attempt
+    storage.mark_reply_sent.assert_called_once_with(1)
+    assert storage.mark_reply_failed.mock_calls == []
+
+
+def test_handle_process_replies_out_of_rate_limit():
+    storage = mock.MagicMock()
+    storage.get_sent_reply_count.return_value = 0
+    storage.get_pending_replies.return_value = [outbox_item(1), outbox_item(2)]
+    twclient = mock.MagicMock()
+    twclient.rate_limit_remaining.return_value = 0
+
+    response = run(storage, twclient)
+
+    assert response.json == {"status": "success", "sent": 1, "failed": 0}
+    assert len(twclient.reply.mock_calls) == 1
+
+
+def test_handle_process_replies_skipped_when_lease_is_held():
+    storage = mock.MagicMock()
+    storage.acquire_lease.return_value = None
+    twclient = mock.MagicMock()
+
+    response = run(storage, twclient)
+
+    assert response.json["status"] == "skipped"
+    assert storage.get_pending_replies.mock_calls == []
+    assert twclient.reply.mock_calls == []
+
+
+@pytest.mark.parametrize(
+    "result,sent",
+    [
+        ({"status": "success", "remaining_count": 0}, True),
+        ({"status": "skipped", "error": "Another run is in progress."}, True),
+        (
+            ({"status": "failed", "error": "Failed to fetch tweets."}, 500),
+            True,
+        ),
+        # out of time budget
+        ({"status": "success", "remaining_count": 3}, False),
+    ],
+)
+def test_send_replies_after_run(result, sent: bool):
+    app = flask.Flask("test")
+    with app.test_request_context(), mock.patch(
+        "handlers.process_replies.handle_process_replies"
+    ) as handle_process_replies_mock:
+        if isinstance(result, tuple):
+            rv = (flask.jsonify(result[0]), result[1])
+        else:
+            rv = flask.jsonify(result)
+        storage, twclient = mock.MagicMock(), mock.MagicMock()
+
+        assert send_replies_after_run(rv, storage, twclient, smv_config) is rv
+
+    assert handle_process_replies_mock.mock_calls == (
+        [mock.call(storage=storage, twclient=twclient, config=smv_config)]
+        if sent
+        else []
+    )
+
+
+def test_send_replies_after_run_failed(capsys):
+    storage, twclient = mock.MagicMock(), mock.MagicMock()
+    storage.acquire_lease.side_effect = AutoReconnect("down")
+
+    app = flask.Flask("test")
+    with app.test_request_context():
+        rv = flask.jsonify({"status": "success", "remaining_count": 0})
+
+        # the run has succeeded
+        assert send_replies_after_run(rv, storage, twclient, smv_config) is rv
+
+    assert twclient.reply.mock_calls == []
+    assert '"err":"down","time_ms"' in capsys.readouterr().out
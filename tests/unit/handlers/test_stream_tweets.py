@@ -0,0 +1,262 @@
+from unittest import mock
+import flask
+from common import SMVConfig
+from services.twitter import Tweet
+from handlers.stream_tweets import (
+    backfill_tweets,
+    next_reconnect_delay,
+    run_filter_stream,
+)
+
+smv_config = SMVConfig(
+    twitter_search_text="I'm taking a ride with",
+    twitter_reply_message_success="",
+    twitter_reply_message_invalid_format="Tweet has invalid format.",
+    twitter_reply_message_invalid_signature="Tweet has invalid signature.",
+)
+
+
+def status(tweet_id: int, user_id: int = 2) -> dict:
+    return {
+        "id": tweet_id,
+        "text": f"Tweet {tweet_id}",
+        "user": {"id": user_id, "screen_name": f"user_{user_id}"},
+    }
+
+
+def tweet(tweet_id: int, user_id: int = 2) -> Tweet:
+    return Tweet(tweet_id, user_id, f"user_{user_id}", f"Tweet {tweet_id}")
+
+
+def mock_clients():
+    storage = mock.MagicMock()
+    inbox = {}
+
+    def add_inbox_tweets(items):
+        for item in items:
+            inbox.setdefault(item["tweet_id"], item)
+
+    def remove_inbox_tweets(tweet_ids):
+        for tweet_id in tweet_ids:
+            inbox.pop(tweet_id, None)
+
+    storage.add_inbox_tweets.side_effect = add_inbox_tweets
+    storage.remove_inbox_tweets.side_effect = remove_inbox_tweets
+    storage.get_inbox_tweets.side_effect = lambda shard_index: [
+        inbox[tweet_id]
+        for tweet_id in sorted(inbox)
+        if inbox[tweet_id]["shard"] == shard_index
+    ]
+    storage.acquire_lease.return_value = 1
+    storage.renew_lease.return_value = True
+    storage.get_signature_variant_counts.return_value = {}
+    twclient = mock.MagicMock()
+    twclient.account_name = "hello_mixel"
+    twclient.twapi.client.auth = None
+    twclient.twapi.client.headers = {"User-Agent": "test"}
+    return storage, twclient
+
+
+@mock.patch("handlers.stream_tweets.TweetProcessor")
+@mock.patch("handlers.stream_tweets.backfill_tweets", return_value=True)
+def test_run_filter_stream(backfill, processor_class, stream_server):
+    stream_server.connections = [
+        (200, [status(11)]),
+        (
+            200,
+            [
+                None,
+                status(12),
+                {"limit": {"track": 1}},
+                status(13),
+            ],
+        ),
+    ]
+    storage, twclient = mock_clients()
+    processor_class.return_value.process.return_value = []
+    sleep = mock.MagicMock()
+    config = SMVConfig(
+        **{**smv_config.__dict__, "filter_stream_url": stream_server.url}
+    )
+
+    assert run_filter_stream(
+        storage, twclient, config, sleep=sleep, max_connections=2
+    )
+
+    assert (
+        stream_server.requests
+        == [{"track": ["@hello_mixel"], "stall_warnings": ["true"]}] * 2
+    )
+    # every connection starts with a backfill
+    assert len(backfill.mock_calls) == 2
+    # one processor per connection, a run per tweet
+    assert processor_class.call_count == 2
+    assert [
+        call.args[0].name
+        for call in processor_class.return_value.start.mock_calls
+    ] == ["process-tweets"] * 3
+    assert processor_class.return_value.process.mock_calls == [
+        mock.call([tweet(11)]),
+        mock.call([tweet(12)]),
+        mock.call([tweet(13)]),
+    ]
+    assert storage.remove_inbox_tweets.mock_calls == [
+        mock.call([11]),
+        mock.call([12]),
+        mock.call([13]),
+    ]
+    # not after the limit notice, the next backfill fetches dropped tweets
+    assert storage.bump_ingestion_cursor.mock_calls == [
+        mock.call("search", 11),
+        mock.call("mentions", 11),
+        mock.call("search", 12),
+        mock.call("mentions", 12),
+    ]
+    assert sleep.mock_calls == [mock.call(5), mock.call(5)]
+    # tweets are processed under the lease of `/process-tweets`
+    assert [call.args[0] for call in storage.release_lease.mock_calls] == [
+        "process-tweets",
+        "process-tweets",
+        "process-tweets",
+        "filter-stream",
+    ]
+
+
+@mock.patch("handlers.stream_tweets.TweetProcessor")
+@mock.patch("handlers.stream_tweets.backfill_tweets", return_value=False)
+def test_run_filter_stream_other_shard(backfill, processor_class):
+    storage, twclient = mock_clients()
+    stream = mock.MagicMock()
+    stream.__iter__.return_value = iter([tweet(11, user_id=3)])
+    stream.dropped_count = 0
+    config = SMVConfig(**{**smv_config.__dict__, "shard_count": 2})
+
+    assert run_filter_stream(
+        storage,
+        twclient,
+        config,
+        open_stream=lambda: stream,
+        sleep=mock.MagicMock(),
+        max_connections=1,
+    )
+
+    # left in the inbox of shard 1
+    storage.add_inbox_tweets.assert_called_once_with(
+        [
+            {
+                "tweet_id": 11,
+                "user_id": 3,
+                "screen_name": "user_3",
+                "text": "Tweet 11",
+                "shard": 1,
+            }
+        ]
+    )
+    assert storage.remove_inbox_tweets.mock_calls == []
+    assert processor_class.return_value.process.mock_calls == []
+    # the backfill has failed
+    assert storage.bump_ingestion_cursor.mock_calls == []
+    stream.close.assert_called_once()
+
+
+@mock.patch("handlers.stream_tweets.TweetProcessor")
+@mock.patch("handlers.stream_tweets.backfill_tweets", return_value=True)
+def test_run_filter_stream_processing_lease_held(backfill, processor_class):
+    storage, twclient = mock_clients()
+    # a `/process-tweets` run is in progress
+    storage.acquire_lease.side_effect = lambda name, owner, ttl: (
+        None if name == "process-tweets" else 1
+    )
+    stream = mock.MagicMock()
+    stream.__iter__.return_value = iter([tweet(12), tweet(11)])
+    stream.dropped_count = 0
+
+    assert run_filter_stream(
+        storage,
+        twclient,
+        smv_config,
+        open_stream=lambda: stream,
+        sleep=mock.MagicMock(),
+        max_connections=1,
+    )
+
+    # left in the inbox for the next run
+    assert [item["tweet_id"] for item in storage.get_inbox_tweets(0)] == [
+        11,
+        12,
+    ]
+    assert processor_class.return_value.process.mock_calls == []
+    assert storage.remove_inbox_tweets.mock_calls == []
+
+    # the next tweet is processed with them, oldest first
+    storage.acquire_lease.side_effect = None
+    stream.__iter__.return_value = iter([tweet(13)])
+    processor_class.return_value.process.return_value = []
+
+    assert run_filter_stream(
+        storage,
+        twclient,
+        smv_config,
+        open_stream=lambda: stream,
+        sleep=mock.MagicMock(),
+        max_connections=1,
+    )
+
+    processor_class.return_value.process.assert_called_once_with(
+        [tweet(11), tweet(12), tweet(13)]
+    )
+    storage.remove_inbox_tweets.assert_called_once_with([11, 12, 13])
+
+
+def test_run_filter_stream_reconnect_delay(stream_server):
+    stream_server.connections = [(420, []), (503, []), (503, [])]
+    storage, twclient = mock_clients()
+    sleep = mock.MagicMock()
+    config = SMVConfig(
+        **{**smv_config.__dict__, "filter_stream_url": stream_server.url}
+    )
+
+    assert run_filter_stream(
+        storage, twclient, config, sleep=sleep, max_connections=3
+    )
+
+    assert sleep.mock_calls == [mock.call(60), mock.call(120), mock.call(240)]
+
+
+def test_run_filter_stream_lease_held():
+    storage, twclient = mock_clients()
+    storage.acquire_lease.return_value = None
+    open_stream = mock.MagicMock()
+
+    assert not run_filter_stream(
+        storage, twclient, smv_config, open_stream=open_stream
+    )
+    assert open_stream.mock_calls == []
+
+
+def test_next_reconnect_delay():
+    assert next_reconnect_delay(smv_config, 0, Exception()) == 5
+    assert next_reconnect_delay(smv_config, 5, Exception()) == 10
+    assert next_reconnect_delay(smv_config, 200, Exception()) == 320
+
+
+@mock.patch("handlers.stream_tweets.handle_process_tweets")
+def test_backfill_tweets(handle_process_tweets):
+    storage, twclient = mock_clients()
+    app = flask.Flask("test")
+    with app.app_context():
+        handle_process_tweets.return_value = flask.jsonify(
+            {"status": "partial"}
+        )
+        assert backfill_tweets(storage, twclient, smv_config, None)
+
+        handle_process_tweets.return_value = flask.jsonify(
+            {"status": "skipped"}
+        )
+        assert not backfill_tweets(storage, twclient, smv_config, None)
+
+        handle_process_tweets.return_value = (
+            flask.jsonify({"status": "failed"}),
+            500,
+        )
+        assert not backfill_tweets(storage, twclient, smv_config, None)
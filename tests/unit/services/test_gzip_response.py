@@ -0,0 +1,71 @@
+import gzip
+import flask
+import pytest
+from services.gzip_response import gzip_response, iter_gzip
+
+BODY = b'{"status": "success"}' * 100
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,compressed",
+    [
+        ("gzip", True),
+        ("gzip, deflate, br", True),
+        ("*", True),
+        ("", False),
+        ("deflate", False),
+        ("gzip;q=0, deflate", False),
+    ],
+)
+def test_gzip_response(accept_encoding: str, compressed: bool):
+    app = flask.Flask("test")
+    with app.test_request_context(
+        headers={"Accept-Encoding": accept_encoding}
+    ):
+        response = gzip_response(flask.request, app.response_class(BODY))
+
+    assert response.headers["Vary"] == "Accept-Encoding"
+    if compressed:
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.get_data()) == BODY
+        assert response.content_length == len(response.get_data())
+    else:
+        assert "Content-Encoding" not in response.headers
+        assert response.get_data() == BODY
+
+
+def test_gzip_response_streamed():
+    app = flask.Flask("test")
+    chunks = [BODY[i : i + 100] for i in range(0, len(BODY), 100)]  # noqa
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = gzip_response(
+            flask.request, app.response_class(iter(chunks))
+        )
+
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == BODY
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        flask.Response(b"small"),
+        flask.Response(BODY, status=404),
+        flask.Response(BODY, headers={"Content-Encoding": "br"}),
+    ],
+)
+def test_gzip_response_unchanged(response: flask.Response):
+    app = flask.Flask("test")
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, br"}):
+        assert gzip_response(flask.request, response) is response
+
+    assert response.get_data() in [b"small", BODY]
+    assert response.headers.get("Content-Encoding") != "gzip"
+
+
+def test_iter_gzip():
+    compressed = list(iter_gzip(iter([b"a" * 1000, b"", b"b" * 1000])))
+
+    assert all(compressed)
+    assert gzip.decompress(b"".join(compressed)) == b"a" * 1000 + b"b" * 1000
@@ -0,0 +1,20 @@
+import flask
+import pytest
+from services.json_stream import iter_json_array
+
+
+@pytest.mark.parametrize("pretty", [True, False])
+@pytest.mark.parametrize("count", [0, 1, 5])
+@pytest.mark.parametrize("chunk_size", [1, 2, 1000])
+def test_iter_json_array(pretty: bool, count: int, chunk_size: int):
+    items = [{"b": i, "a": [1, "two\nlines"], "c": None} for i in range(count)]
+
+    app = flask.Flask("test")
+    app.config["JSONIFY_PRETTYPRINT_REGULAR"] = pretty
+    with app.app_context():
+        expected = flask.jsonify(items).get_data(as_text=True)
+
+    chunks = list(iter_json_array(iter(items), pretty, chunk_size))
+    assert "".join(chunks) == expected
+    # items of a chunk, and the end
+    assert len(chunks) == -(-count // chunk_size) + 1
@@ -0,0 +1,52 @@
+from unittest import mock
+import pytest
+from common import LeaseLostError
+from services.lease import Lease
+
+
+def test_lease():
+    storage = mock.MagicMock()
+    storage.acquire_lease.return_value = 7
+    storage.renew_lease.return_value = True
+
+    lease = Lease(storage, "job", ttl=60)
+    assert lease.acquire()
+    assert lease.token == 7
+    lease.renew()
+    lease.release()
+    assert lease.token is None
+
+    assert storage.mock_calls == [
+        mock.call.acquire_lease("job", lease.owner, 60),
+        mock.call.renew_lease("job", lease.owner, 7, 60),
+        mock.call.release_lease("job", lease.owner, 7),
+    ]
+
+
+def test_lease_held_by_someone_else():
+    storage = mock.MagicMock()
+    storage.acquire_lease.return_value = None
+
+    lease = Lease(storage, "job", ttl=60)
+    assert not lease.acquire()
+    with pytest.raises(LeaseLostError):
+        lease.renew()
+    lease.release()
+
+    assert storage.release_lease.mock_calls == []
+
+
+def test_lease_lost():
+    storage = mock.MagicMock()
+    storage.acquire_lease.return_value = 7
+    storage.renew_lease.return_value = False
+
+    lease = Lease(storage, "job", ttl=60)
+    assert lease.acquire()
+    with pytest.raises(LeaseLostError, match="token: 7"):
+        lease.renew()
+
+
+def test_lease_owners_are_unique():
+    storage = mock.MagicMock()
+    assert Lease(storage, "job", 60).owner != Lease(storage, "job", 60).owner
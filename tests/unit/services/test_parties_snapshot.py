@@ -0,0 +1,185 @@
+from unittest import mock
+from datetime import datetime, timezone
+import gzip
+import queue
+import threading
+import time
+import flask
+from pymongo.errors import AutoReconnect, OperationFailure
+from services.parties_snapshot import PartiesSnapshot
+
+PARTIES = [
+    {"party_id": "pub key 1", "twitter_handle": "handle 1"},
+    {"party_id": "pub key 2", "twitter_handle": "handle 2"},
+]
+LAST_MODIFIED = datetime(2021, 9, 13, 10, 34, 20, tzinfo=timezone.utc)
+
+
+class FakeChangeStream(object):
+    def __init__(self):
+        self.changes = queue.Queue()
+        self.alive = True
+        self.closed = threading.Event()
+
+    def try_next(self):
+        try:
+            return self.changes.get(timeout=0.01)
+        except queue.Empty:
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed.set()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def parties_storage() -> mock.MagicMock:
+    storage = mock.MagicMock()
+    storage.iter_parties.side_effect = lambda: iter(PARTIES)
+    storage.get_parties_last_modified.return_value = LAST_MODIFIED
+    return storage
+
+
+def test_get_same_as_jsonify():
+    app = flask.Flask("test")
+    for pretty in [True, False]:
+        app.config["JSONIFY_PRETTYPRINT_REGULAR"] = pretty
+        snapshot = PartiesSnapshot(parties_storage(), watch=False)
+        with app.app_context():
+            entry = snapshot.get(pretty=pretty)
+            assert entry.body == flask.jsonify(PARTIES).get_data()
+            assert gzip.decompress(entry.gzip_body()) == entry.body
+            assert entry.last_modified == LAST_MODIFIED
+
+
+def test_get_ttl():
+    now = [100.0]
+    storage = parties_storage()
+    snapshot = PartiesSnapshot(
+        storage, ttl=60, watch=False, clock=lambda: now[0]
+    )
+
+    entry = snapshot.get()
+    now[0] += 59
+    assert snapshot.get() is entry
+    # one query, the last change before parties
+    assert storage.mock_calls == [
+        mock.call.get_parties_last_modified(),
+        mock.call.iter_parties(),
+    ]
+
+    # expired
+    now[0] += 1
+    assert snapshot.get().body == entry.body
+    assert storage.iter_parties.call_count == 2
+    # formats are cached separately
+    pretty_entry = snapshot.get(pretty=True)
+    assert pretty_entry.body != entry.body
+    assert snapshot.stats() == {
+        "hits": 1,
+        "misses": 3,
+        "invalidations": 0,
+        "watching": False,
+        "size": len(entry.body) + len(pretty_entry.body),
+    }
+
+
+def test_invalidate():
+    storage = parties_storage()
+    snapshot = PartiesSnapshot(storage, ttl=60, watch=False)
+
+    snapshot.get()
+    snapshot.invalidate()
+    snapshot.get()
+    snapshot.get()
+
+    assert storage.iter_parties.call_count == 2
+    assert snapshot.stats()["invalidations"] == 1
+
+
+def test_watch():
+    now = [100.0]
+    changes = FakeChangeStream()
+    storage = parties_storage()
+    storage.watch_identities.return_value = changes
+    snapshot = PartiesSnapshot(storage, ttl=60, clock=lambda: now[0])
+
+    try:
+        snapshot.get()
+        assert snapshot.watching
+        now[0] += 59
+        snapshot.get()
+        assert storage.iter_parties.call_count == 1
+
+        # a change invalidates the snapshot
+        changes.changes.put({"operationType": "update"})
+        wait_for(lambda: snapshot.invalidations == 2)
+        snapshot.get()
+        snapshot.get()
+        assert storage.iter_parties.call_count == 2
+
+        # expires while watched too, changes may not have been seen yet
+        now[0] += 60
+        snapshot.get()
+        assert storage.iter_parties.call_count == 3
+    finally:
+        snapshot.close()
+    assert changes.closed.is_set()
+    assert not snapshot.watching
+    storage.watch_identities.assert_called_once_with()
+
+
+def test_watch_not_supported(capsys):
+    now = [100.0]
+    storage = parties_storage()
+    storage.watch_identities.side_effect = OperationFailure(
+        "The $changeStream stage is only supported on replica sets", 40573
+    )
+    snapshot = PartiesSnapshot(storage, ttl=60, clock=lambda: now[0])
+
+    snapshot.get()
+    snapshot.get()
+    assert storage.iter_parties.call_count == 1
+    # ttl only
+    now[0] += 60
+    snapshot.get()
+    assert storage.iter_parties.call_count == 2
+
+    snapshot.close()
+    assert not snapshot.watching
+    storage.watch_identities.assert_called_once_with()
+    assert "Not watching parties changes, ttl only" in capsys.readouterr().out
+
+
+def test_watch_reconnect():
+    changes = FakeChangeStream()
+    storage = parties_storage()
+    reconnect = threading.Event()
+
+    def watch_identities():
+        if not reconnect.is_set():
+            raise AutoReconnect("down")
+        return changes
+
+    storage.watch_identities.side_effect = watch_identities
+    snapshot = PartiesSnapshot(storage, ttl=60, retry_delay=0.01)
+
+    try:
+        snapshot.get()
+        assert not snapshot.watching
+        reconnect.set()
+        wait_for(lambda: snapshot.watching)
+        # snapshot built before the stream was opened is stale
+        snapshot.get()
+        assert storage.iter_parties.call_count == 2
+    finally:
+        snapshot.close()
+    assert storage.watch_identities.call_count >= 2
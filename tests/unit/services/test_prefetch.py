@@ -0,0 +1,50 @@
+import threading
+import time
+import pytest
+from services.prefetch import Prefetcher
+
+
+def test_prefetcher():
+    prefetcher = Prefetcher(iter(range(10)), queue_size=3)
+    assert list(prefetcher) == list(range(10))
+    # exhausted
+    assert list(prefetcher) == []
+    prefetcher.close()
+
+
+def test_prefetcher_bounded():
+    fetched = []
+    closed = threading.Event()
+
+    def pages():
+        try:
+            for page_index in range(10):
+                fetched.append(page_index)
+                yield [page_index]
+        finally:
+            closed.set()
+
+    with Prefetcher(pages(), queue_size=1) as prefetcher:
+        # fetching starts before the first item is requested
+        time.sleep(0.2)
+        assert fetched == [0, 1]
+        assert next(prefetcher) == [0]
+        time.sleep(0.2)
+        # fetching waits for the consumer
+        assert fetched == [0, 1, 2]
+
+    assert closed.is_set()
+    assert len(fetched) <= 4
+
+
+def test_prefetcher_failure():
+    def pages():
+        yield [1]
+        raise RuntimeError("Twitter API error")
+
+    with Prefetcher(pages(), queue_size=4) as prefetcher:
+        assert next(prefetcher) == [1]
+        with pytest.raises(RuntimeError, match="Twitter API error"):
+            next(prefetcher)
+        with pytest.raises(StopIteration):
+            next(prefetcher)
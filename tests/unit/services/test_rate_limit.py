@@ -0,0 +1,107 @@
+from unittest import mock
+import pytest
+from twython.exceptions import TwythonRateLimitError
+from services.rate_limit import RateLimiter, api_endpoint
+
+
+class Clock(object):
+    def __init__(self, now: float = 1000) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+def headers(limit, remaining, reset):
+    return {
+        "x-rate-limit-limit": str(limit),
+        "x-rate-limit-remaining": str(remaining),
+        "x-rate-limit-reset": str(reset),
+    }
+
+
+def test_api_endpoint():
+    assert (
+        api_endpoint("https://api.twitter.com/1.1/search/tweets.json?q=a")
+        == "search/tweets"
+    )
+    assert (
+        api_endpoint("https://api.twitter.com/1.1/statuses/show/123.json")
+        == "statuses/show"
+    )
+    assert (
+        api_endpoint(
+            "https://api.twitter.com/1.1/statuses/mentions_timeline.json"
+        )
+        == "statuses/mentions_timeline"
+    )
+
+
+def test_rate_limiter_unknown_limit():
+    clock = Clock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+
+    for _ in range(10):
+        limiter.acquire("search/tweets")
+
+    assert clock.now == 1000
+    assert limiter.stats() == {
+        "search/tweets": {"limit": None, "remaining": None, "reset": None}
+    }
+
+
+def test_rate_limiter():
+    clock = Clock()
+    limiter = RateLimiter(max_wait=60, clock=clock, sleep=clock.sleep)
+    limiter.update("search/tweets", headers(180, 2, 1030), 200)
+
+    limiter.acquire("search/tweets")
+    limiter.acquire("search/tweets")
+    assert clock.now == 1000
+    assert limiter.stats()["search/tweets"]["remaining"] == 0
+    # other endpoints have own limits
+    limiter.acquire("statuses/mentions_timeline")
+    assert clock.now == 1000
+
+    # waits for reset
+    limiter.acquire("search/tweets")
+    assert clock.now == 1030
+    assert limiter.stats()["search/tweets"] == {
+        "limit": 180,
+        "remaining": 179,
+        "reset": None,
+    }
+
+
+def test_rate_limiter_max_wait():
+    clock = Clock()
+    limiter = RateLimiter(max_wait=60, clock=clock, sleep=clock.sleep)
+    # rejected call
+    limiter.update("statuses/show", headers(900, 5, 1600), 429)
+
+    with pytest.raises(TwythonRateLimitError) as err:
+        limiter.acquire("statuses/show")
+
+    assert err.value.error_code == 429
+    assert clock.now == 1000
+
+
+def test_rate_limiter_on_response():
+    limiter = RateLimiter(clock=Clock())
+    response = mock.MagicMock()
+    response.url = "https://api.twitter.com/1.1/statuses/show/1.json"
+    response.headers = headers(900, 899, 1600)
+    response.status_code = 200
+
+    limiter.on_response(response)
+    # no rate limit headers
+    response.url = "https://api.twitter.com/1.1/statuses/update.json"
+    response.headers = {}
+    limiter.on_response(response)
+
+    assert limiter.stats() == {
+        "statuses/show": {"limit": 900, "remaining": 899, "reset": 1600}
+    }
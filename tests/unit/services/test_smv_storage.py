@@ -1,5 +1,8 @@
+from datetime import datetime, timedelta, timezone
 from unittest import mock
-from services.smv_storage import SMVStorage
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from services.smv_storage import INDEXES, SMVStorage
 
 
 def test_constructor():
@@ -59,3 +62,742 @@ def test_upsert_tweet_record():
             upsert=True,
         ),
     ]
+
+
+def test_buffer_tweet_records():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+
+    with storage.buffer_tweet_records() as records:
+        records.upsert_tweet_record(tweet_id=1, text="a", status="PROCESSING")
+        records.upsert_tweet_record(tweet_id=2, text="b", status="PROCESSING")
+        assert records.flush_tweet_records() == 2
+        records.upsert_tweet_record(tweet_id=1, reply="", status="PASSED")
+        records.upsert_tweet_record(tweet_id=3, status="PROCESSING")
+        records.upsert_tweet_record(tweet_id=3, status="BLOCKLISTED")
+
+        # buffered record is visible
+        assert records.get_tweet_record(3) == {
+            "tweet_id": 3,
+            "status": "BLOCKLISTED",
+            "last_modified": mock.ANY,
+        }
+
+    col_tweets = db.get_collection.return_value
+    assert col_tweets.update_one.mock_calls == []
+    assert col_tweets.find_one.mock_calls == []
+    assert col_tweets.bulk_write.mock_calls == [
+        mock.call(
+            [
+                UpdateOne(
+                    {"tweet_id": 1},
+                    {
+                        "$set": {
+                            "text": "a",
+                            "status": "PROCESSING",
+                            "last_modified": mock.ANY,
+                        }
+                    },
+                    upsert=True,
+                ),
+                UpdateOne(
+                    {"tweet_id": 2},
+                    {
+                        "$set": {
+                            "text": "b",
+                            "status": "PROCESSING",
+                            "last_modified": mock.ANY,
+                        }
+                    },
+                    upsert=True,
+                ),
+            ],
+            ordered=False,
+        ),
+        mock.call(
+            [
+                UpdateOne(
+                    {"tweet_id": 1},
+                    {
+                        "$set": {
+                            "reply": "",
+                            "status": "PASSED",
+                            "last_modified": mock.ANY,
+                        }
+                    },
+                    upsert=True,
+                ),
+                UpdateOne(
+                    {"tweet_id": 3},
+                    {
+                        "$set": {
+                            "status": "BLOCKLISTED",
+                            "last_modified": mock.ANY,
+                        }
+                    },
+                    upsert=True,
+                ),
+            ],
+            ordered=False,
+        ),
+    ]
+
+    # outside of the context records are written immediately
+    storage.upsert_tweet_record(tweet_id=4, status="PASSED")
+    assert len(col_tweets.update_one.mock_calls) == 1
+
+
+def test_buffer_tweet_records_not_shared():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+    col_tweets = db.get_collection.return_value
+
+    with storage.buffer_tweet_records() as records:
+        records.upsert_tweet_record(tweet_id=1, status="PASSED")
+        # e.g. the stream handler using the same storage meanwhile
+        with storage.buffer_tweet_records() as other_records:
+            other_records.upsert_tweet_record(tweet_id=2, status="PASSED")
+        storage.upsert_tweet_record(tweet_id=3, status="PASSED")
+        assert len(col_tweets.bulk_write.mock_calls) == 1
+        assert len(col_tweets.update_one.mock_calls) == 1
+
+        # the buffer of the run is intact
+        assert records.flush_tweet_records() == 1
+        assert col_tweets.bulk_write.call_args[0][0] == [
+            UpdateOne(
+                {"tweet_id": 1},
+                {"$set": {"status": "PASSED", "last_modified": mock.ANY}},
+                upsert=True,
+            )
+        ]
+        # other calls go to the storage
+        assert records.col_tweets is col_tweets
+
+
+def test_buffer_tweet_records_flush_on_exception():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+
+    try:
+        with storage.buffer_tweet_records() as records:
+            records.upsert_tweet_record(tweet_id=1, status="PASSED")
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+
+    assert len(db.get_collection.return_value.bulk_write.mock_calls) == 1
+
+
+def test_remove_processing_tweet_records():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+
+    storage.remove_processing_tweet_records([])
+    storage.remove_processing_tweet_records([1, 2])
+
+    db.get_collection.return_value.delete_many.assert_called_once_with(
+        {"tweet_id": {"$in": [1, 2]}, "status": "PROCESSING"}
+    )
+
+
+def test_get_signature_variant_counts():
+    db = mock.MagicMock()
+    db.get_collection.return_value.find.return_value = [
+        {"_id": "@handle", "count": 12},
+        {"_id": "handle+LF", "count": 3},
+    ]
+    storage = SMVStorage(db)
+
+    assert storage.get_signature_variant_counts() == {
+        "@handle": 12,
+        "handle+LF": 3,
+    }
+    db.get_collection.assert_called_with("signature_variants")
+
+
+def test_increment_signature_variant_counts():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+
+    storage.increment_signature_variant_counts({})
+    assert db.mock_calls == []
+
+    storage.increment_signature_variant_counts({"@handle": 2, "handle": 1})
+    assert db.mock_calls == [
+        mock.call.get_collection("signature_variants"),
+        mock.call.get_collection().bulk_write(
+            [
+                UpdateOne(
+                    {"_id": "@handle"}, {"$inc": {"count": 2}}, upsert=True
+                ),
+                UpdateOne(
+                    {"_id": "handle"}, {"$inc": {"count": 1}}, upsert=True
+                ),
+            ],
+            ordered=False,
+        ),
+    ]
+
+
+def test_get_verification_results():
+    db = mock.MagicMock()
+    db.get_collection.return_value.find.return_value = [
+        {"_id": "pubkey1|sig1|handle1", "variant": "@handle"},
+        {"_id": "pubkey2|sig2|handle2", "variant": None},
+    ]
+    storage = SMVStorage(db)
+
+    assert storage.get_verification_results(
+        [
+            ("pubkey1", "sig1", "handle1"),
+            ("pubkey2", "sig2", "handle2"),
+            ("pubkey3", "sig3", "handle3"),
+        ]
+    ) == {
+        ("pubkey1", "sig1", "handle1"): "@handle",
+        ("pubkey2", "sig2", "handle2"): None,
+    }
+    db.get_collection.return_value.find.assert_called_once_with(
+        {
+            "_id": {
+                "$in": [
+                    "pubkey1|sig1|handle1",
+                    "pubkey2|sig2|handle2",
+                    "pubkey3|sig3|handle3",
+                ]
+            }
+        }
+    )
+
+
+def test_save_verification_results():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+
+    storage.save_verification_results(
+        {("pubkey1", "sig1", "handle1"): "@handle"}
+    )
+    assert db.mock_calls == [
+        mock.call.get_collection("verification_results"),
+        mock.call.get_collection().bulk_write(
+            [
+                UpdateOne(
+                    {"_id": "pubkey1|sig1|handle1"},
+                    {
+                        "$set": {
+                            "variant": "@handle",
+                            "last_modified": mock.ANY,
+                        }
+                    },
+                    upsert=True,
+                ),
+            ],
+            ordered=False,
+        ),
+    ]
+
+
+def test_get_processed_tweet_ids():
+    db = mock.MagicMock()
+    db.get_collection.return_value.find.return_value = [
+        {"tweet_id": 12},
+        {"tweet_id": 30},
+    ]
+    storage = SMVStorage(db)
+
+    assert storage.get_processed_tweet_ids([12, 20, 30, 12]) == {12, 30}
+    db.get_collection.return_value.find.assert_called_once_with(
+        {"tweet_id": {"$in": [12, 20, 30]}, "status": {"$ne": "RETRY"}},
+        projection={"tweet_id": 1, "_id": False},
+    )
+
+    # no query for empty list
+    assert storage.get_processed_tweet_ids([]) == set()
+    assert db.get_collection.return_value.find.call_count == 1
+
+
+def test_enqueue_reply():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+
+    storage.enqueue_reply(
+        tweet_id=12, user_id=3, screen_name="user", text="Hi", message="Bad"
+    )
+
+    db.get_collection.assert_called_once_with("reply_outbox")
+    db.get_collection.return_value.update_one.assert_called_once_with(
+        {"_id": 12},
+        {
+            "$setOnInsert": {
+                "tweet_id": 12,
+                "user_id": 3,
+                "screen_name": "user",
+                "text": "Hi",
+                "message": "Bad",
+                "status": "PENDING",
+                "attempts": 0,
+                "next_attempt": mock.ANY,
+                "created": mock.ANY,
+                "last_modified": mock.ANY,
+            },
+        },
+        upsert=True,
+    )
+
+
+def test_get_pending_replies():
+    db = mock.MagicMock()
+    db.get_collection.return_value.find.return_value = iter([{"_id": 1}])
+    storage = SMVStorage(db)
+
+    assert storage.get_pending_replies(limit=0) == []
+    assert storage.get_pending_replies(limit=5) == [{"_id": 1}]
+    db.get_collection.return_value.find.assert_called_once_with(
+        {"status": "PENDING", "next_attempt": {"$lte": mock.ANY}},
+        sort=[("next_attempt", 1)],
+        limit=5,
+    )
+
+
+def test_mark_reply_failed():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+    next_attempt = datetime(2021, 5, 1, tzinfo=timezone.utc)
+
+    storage.mark_reply_failed(1, "error", next_attempt)
+    storage.mark_reply_failed(2, "error")
+
+    assert db.get_collection.return_value.update_one.mock_calls == [
+        mock.call(
+            {"_id": 1},
+            {
+                "$set": {
+                    "status": "PENDING",
+                    "next_attempt": next_attempt,
+                    "error": "error",
+                    "last_modified": mock.ANY,
+                },
+                "$inc": {"attempts": 1},
+            },
+        ),
+        mock.call(
+            {"_id": 2},
+            {
+                "$set": {
+                    "status": "FAILED",
+                    "next_attempt": None,
+                    "error": "error",
+                    "last_modified": mock.ANY,
+                },
+                "$inc": {"attempts": 1},
+            },
+        ),
+    ]
+
+
+def test_upsert_retry_tweet():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+    next_attempt = datetime(2021, 5, 1, tzinfo=timezone.utc)
+
+    storage.upsert_retry_tweet(1, 2, "error", next_attempt, user_id=7)
+    storage.upsert_retry_tweet(1, 5, "error")
+
+    db.get_collection.assert_called_with("retry_tweets")
+    assert db.get_collection.return_value.update_one.mock_calls == [
+        mock.call(
+            {"_id": 1},
+            {
+                "$set": {
+                    "tweet_id": 1,
+                    "status": status,
+                    "attempts": attempts,
+                    "next_attempt": expected_next_attempt,
+                    "error": "error",
+                    "last_modified": mock.ANY,
+                    **user,
+                },
+                "$setOnInsert": {"created": mock.ANY},
+            },
+            upsert=True,
+        )
+        for status, attempts, expected_next_attempt, user in [
+            ("RETRY", 2, next_attempt, {"user_id": 7}),
+            # an unknown user does not overwrite the known one
+            ("DEAD_LETTER", 5, None, {}),
+        ]
+    ]
+
+
+def test_get_due_retry_tweets():
+    db = mock.MagicMock()
+    db.get_collection.return_value.find.return_value = [
+        {"tweet_id": 3, "attempts": 1},
+        {"tweet_id": 1, "attempts": 4},
+    ]
+    storage = SMVStorage(db)
+
+    assert storage.get_due_retry_tweets(limit=10) == {3: 1, 1: 4}
+    db.get_collection.return_value.find.assert_called_once_with(
+        {"status": "RETRY", "next_attempt": {"$lte": mock.ANY}},
+        sort=[("next_attempt", 1)],
+        limit=10,
+    )
+
+
+def test_iter_parties():
+    db = mock.MagicMock()
+    created = datetime(2021, 9, 13, 10, 34, 20)
+    db.get_collection.return_value.find.return_value = [
+        {
+            "pub_key": "pub key 1",
+            "twitter_handle": "handle 1",
+            "twitter_user_id": 1,
+            "created": created,
+            "last_modified": created,
+        }
+    ]
+
+    assert list(SMVStorage(db).iter_parties()) == [
+        {
+            "party_id": "pub key 1",
+            "twitter_handle": "handle 1",
+            "twitter_user_id": 1,
+            "created": 1631529260,
+            "last_modified": 1631529260,
+        }
+    ]
+    db.get_collection.assert_called_once_with("identities")
+    # blocked parties are filtered out by the query
+    db.get_collection.return_value.find.assert_called_once_with(
+        {"blocked": None},
+        projection={
+            "_id": False,
+            "pub_key": 1,
+            "twitter_handle": 1,
+            "twitter_user_id": 1,
+            "last_modified": 1,
+            "created": 1,
+        },
+        sort=[("_id", 1)],
+    )
+
+
+def test_iter_party_changes():
+    db = mock.MagicMock()
+    modified = datetime(2021, 9, 13, 10, 34, 20)
+    db.get_collection.return_value.find.return_value = [
+        {
+            "pub_key": f"pub key {i}",
+            "twitter_handle": f"handle {i}",
+            "twitter_user_id": i,
+            "created": modified,
+            "last_modified": modified,
+            "blocked": blocked,
+        }
+        for i, blocked in enumerate([None, "Sign up matched"])
+    ]
+    since = datetime(2021, 9, 13, tzinfo=timezone.utc)
+
+    assert list(SMVStorage(db).iter_party_changes(since)) == [
+        {
+            "party_id": f"pub key {i}",
+            "twitter_handle": f"handle {i}",
+            "twitter_user_id": i,
+            "created": 1631529260,
+            "last_modified": 1631529260,
+            "blocked": blocked,
+            "removed": blocked,
+        }
+        for i, blocked in enumerate([False, True])
+    ]
+    db.get_collection.assert_called_once_with("identities")
+    db.get_collection.return_value.find.assert_called_once_with(
+        {"last_modified": {"$gt": since}},
+        projection={
+            "_id": False,
+            "blocked": 1,
+            "replaced_pub_keys": 1,
+            "pub_key": 1,
+            "twitter_handle": 1,
+            "twitter_user_id": 1,
+            "last_modified": 1,
+            "created": 1,
+        },
+        sort=[("last_modified", 1), ("_id", 1)],
+    )
+
+
+def test_upsert_verified_party_replaced_pub_key():
+    db = mock.MagicMock()
+    col_identities = db.get_collection.return_value
+    col_identities.count_documents.return_value = 1
+    col_identities.find_one.return_value = None
+    storage = SMVStorage(db)
+
+    # the same pub key
+    col_identities.find_one_and_update.return_value = {
+        "_id": "id",
+        "pub_key": "pub key 1",
+    }
+    storage.upsert_verified_party("pub key 1", 1, "handle")
+    assert col_identities.update_one.mock_calls == []
+
+    # a new pub key
+    storage.upsert_verified_party("pub key 2", 1, "handle")
+    assert col_identities.find_one_and_update.call_args.kwargs == {
+        "projection": {"pub_key": True},
+        "upsert": True,
+        "return_document": ReturnDocument.BEFORE,
+    }
+    col_identities.update_one.assert_called_once_with(
+        {"_id": "id"},
+        {
+            "$push": {
+                "replaced_pub_keys": {
+                    "pub_key": "pub key 1",
+                    "replaced": mock.ANY,
+                }
+            }
+        },
+    )
+
+
+def test_iter_party_changes_replaced_pub_keys():
+    db = mock.MagicMock()
+    modified = datetime(2021, 9, 13, 10, 34, 20)
+    db.get_collection.return_value.find.return_value = [
+        {
+            "pub_key": "pub key 3",
+            "twitter_handle": "handle",
+            "twitter_user_id": 1,
+            "created": modified - timedelta(days=2),
+            "last_modified": modified,
+            "replaced_pub_keys": [
+                # before `since`, removed by a previous delta
+                {
+                    "pub_key": "pub key 1",
+                    "replaced": modified - timedelta(days=1),
+                },
+                {"pub_key": "pub key 2", "replaced": modified},
+            ],
+        }
+    ]
+    since = datetime(2021, 9, 13, tzinfo=timezone.utc)
+
+    assert list(SMVStorage(db).iter_party_changes(since)) == [
+        {
+            "party_id": party_id,
+            "twitter_handle": "handle",
+            "twitter_user_id": 1,
+            "created": 1631529260 - 2 * 24 * 3600,
+            "last_modified": 1631529260,
+            "blocked": False,
+            "removed": removed,
+        }
+        for party_id, removed in [("pub key 2", True), ("pub key 3", False)]
+    ]
+
+
+def test_watch_identities():
+    db = mock.MagicMock()
+    col_identities = db.get_collection.return_value
+
+    assert (
+        SMVStorage(db).watch_identities() == col_identities.watch.return_value
+    )
+    db.get_collection.assert_called_once_with("identities")
+    col_identities.watch.assert_called_once_with(max_await_time_ms=1000)
+
+
+def test_ensure_indexes():
+    db = mock.MagicMock()
+    assert SMVStorage(db).ensure_indexes() == []
+
+    assert db.get_collection.call_args_list == [
+        mock.call(collection_name) for collection_name in INDEXES
+    ]
+    create_indexes = db.get_collection.return_value.create_indexes
+    assert create_indexes.call_args_list == [
+        mock.call(indexes) for indexes in INDEXES.values()
+    ]
+    tweets_indexes = {
+        index.document["name"]: index.document for index in INDEXES["tweets"]
+    }
+    assert tweets_indexes["tweet_id"]["unique"]
+
+
+def test_ensure_indexes_failed():
+    db = mock.MagicMock()
+    tweets_index, other_index = INDEXES["tweets"]
+
+    def create_indexes(indexes):
+        if tweets_index in indexes:
+            raise OperationFailure("E11000 duplicate key error", code=11000)
+        return [index.document["name"] for index in indexes]
+
+    db.get_collection.return_value.create_indexes.side_effect = create_indexes
+
+    # the other indexes are created
+    assert SMVStorage(db).ensure_indexes() == ["tweets.tweet_id"]
+    db.get_collection.return_value.create_indexes.assert_any_call(
+        [other_index]
+    )
+
+
+def test_get_stale_processing_tweets():
+    db = mock.MagicMock()
+    db.get_collection.return_value.find.return_value = [
+        {"tweet_id": 5, "user_id": 15},
+        {"tweet_id": 2},
+    ]
+    storage = SMVStorage(db)
+    older_than = datetime(2021, 5, 1, tzinfo=timezone.utc)
+
+    assert storage.get_stale_processing_tweets(older_than, limit=10) == {
+        5: 15,
+        2: None,
+    }
+    db.get_collection.return_value.find.assert_called_once_with(
+        {"status": "PROCESSING", "last_modified": {"$lt": older_than}},
+        projection={"tweet_id": 1, "user_id": 1, "_id": False},
+        sort=[("last_modified", 1)],
+        limit=10,
+    )
+
+
+def test_acquire_lease():
+    db = mock.MagicMock()
+    col_leases = db.get_collection.return_value
+    col_leases.find_one_and_update.side_effect = [
+        {"_id": "job", "owner": "me", "token": 3},
+        DuplicateKeyError("E11000 duplicate key error"),
+    ]
+    storage = SMVStorage(db)
+
+    assert storage.acquire_lease("job", "me", 60) == 3
+    # held by someone else
+    assert storage.acquire_lease("job", "me", 60) is None
+
+    db.get_collection.assert_called_with("leases")
+    assert col_leases.find_one_and_update.call_args == mock.call(
+        {
+            "_id": "job",
+            "$or": [{"expires": {"$lte": mock.ANY}}, {"owner": "me"}],
+        },
+        {
+            "$set": {
+                "owner": "me",
+                "expires": mock.ANY,
+                "acquired": mock.ANY,
+            },
+            "$inc": {"token": 1},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def test_renew_lease():
+    db = mock.MagicMock()
+    col_leases = db.get_collection.return_value
+    storage = SMVStorage(db)
+
+    col_leases.update_one.return_value.matched_count = 1
+    assert storage.renew_lease("job", "me", 3, 60)
+    col_leases.update_one.return_value.matched_count = 0
+    assert not storage.renew_lease("job", "me", 3, 60)
+
+    col_leases.update_one.assert_called_with(
+        {"_id": "job", "owner": "me", "token": 3},
+        {"$set": {"expires": mock.ANY}},
+    )
+
+
+def test_shard_filter():
+    db = mock.MagicMock()
+    db.get_collection.return_value.find.return_value = [{"tweet_id": 3}]
+    storage = SMVStorage(db)
+
+    assert storage.get_todo_tweets(limit=10, shard=(4, 3)) == [3]
+    assert storage.get_todo_tweets(limit=10, shard=(4, 0)) == [3]
+    assert storage.get_todo_tweets(limit=10, shard=(1, 0)) == [3]
+    assert storage.get_todo_tweets(limit=10) == [3]
+    assert db.get_collection.return_value.find.mock_calls == [
+        mock.call({"user_id": {"$mod": [4, 3]}}, limit=10),
+        # and tweets of unknown users
+        mock.call(
+            {"$or": [{"user_id": {"$mod": [4, 0]}}, {"user_id": None}]},
+            limit=10,
+        ),
+        mock.call({}, limit=10),
+        mock.call({}, limit=10),
+    ]
+
+
+def test_add_inbox_tweets():
+    db = mock.MagicMock()
+    storage = SMVStorage(db)
+
+    storage.add_inbox_tweets([])
+    storage.add_inbox_tweets([{"tweet_id": 5, "shard": 1}])
+
+    db.get_collection.assert_called_once_with("tweet_inbox")
+    db.get_collection.return_value.bulk_write.assert_called_once_with(
+        [
+            UpdateOne(
+                {"_id": 5},
+                {
+                    "$setOnInsert": {
+                        "tweet_id": 5,
+                        "shard": 1,
+                        "created": mock.ANY,
+                    }
+                },
+                upsert=True,
+            )
+        ],
+        ordered=False,
+    )
+
+
+def test_ingestion_cursor():
+    db = mock.MagicMock()
+    col_cursors = db.get_collection.return_value
+    col_cursors.find_one.return_value = None
+    storage = SMVStorage(db)
+
+    assert storage.get_ingestion_cursor("search") == {"_id": "search"}
+    storage.save_ingestion_page("search", 29, 40)
+    storage.advance_ingestion_cursor("search", 40)
+    storage.advance_ingestion_cursor("mentions", None)
+
+    db.get_collection.assert_called_with("ingestion_cursors")
+    assert col_cursors.update_one.mock_calls == [
+        mock.call(
+            {"_id": "search"},
+            {
+                "$set": {"max_id": 29, "last_modified": mock.ANY},
+                "$max": {"next_since_id": 40},
+            },
+            upsert=True,
+        ),
+        mock.call(
+            {"_id": "search"},
+            {
+                "$set": {"last_modified": mock.ANY},
+                "$unset": {"max_id": "", "next_since_id": ""},
+                "$max": {"since_id": 40},
+            },
+            upsert=True,
+        ),
+        mock.call(
+            {"_id": "mentions"},
+            {
+                "$set": {"last_modified": mock.ANY},
+                "$unset": {"max_id": "", "next_since_id": ""},
+                "$setOnInsert": {"since_id": None},
+            },
+            upsert=True,
+        ),
+    ]
@@ -1,5 +1,8 @@
 from unittest import mock
 import os
+import pytest
+from twython.exceptions import TwythonError, TwythonRateLimitError
+from services.rate_limit import RateLimiter
 from services.twitter import Tweet, TwitterClient
 
 
@@ -32,15 +35,20 @@ def test_twitter_client_constructor(
     tw_auth = mock.MagicMock()
     TwythonMock.return_value = tw_auth
     tw_auth.obtain_access_token.return_value = "abc"
-    assert TwitterClient(gcp_secret_name="TWITTER_SECRET_NAME")
+    twclient = TwitterClient(gcp_secret_name="TWITTER_SECRET_NAME")
+    assert twclient
 
     get_json_secret_from_gcp_mock.assert_called_once_with(
         "projects/12/secrets/twt-secret/versions/last"
     )
 
-    assert TwythonMock.mock_calls == [
+    assert TwythonMock.call_args_list == [
         mock.call("pa55w0rd", "5ecret", "accessT", "a5ecrettt"),
     ]
+    # rate limits are read from all responses
+    tw_auth.client.hooks["response"].append.assert_called_once_with(
+        twclient.rate_limits.on_response
+    )
 
 
 tweet_1 = {
@@ -53,8 +61,15 @@ tweet_1 = {
 }
 
 
+def mock_twitter_client() -> TwitterClient:
+    twclient = TwitterClient.__new__(TwitterClient)
+    twclient.twapi = mock.MagicMock()
+    twclient.rate_limits = RateLimiter()
+    return twclient
+
+
 def test_search():
-    twclient = mock.MagicMock()
+    twclient = mock_twitter_client()
     twclient.twapi.search.side_effect = [
         {
             "statuses": [tweet_1],
@@ -67,25 +82,25 @@ def test_search():
         {"statuses": [tweet_1], "search_metadata": {}},
     ]
 
-    result = list(TwitterClient.search(twclient, "search"))
+    result = list(twclient.search("search"))
 
     assert len(result) == 3
 
-    assert twclient.mock_calls == [
-        mock.call.twapi.search(
+    assert twclient.twapi.mock_calls == [
+        mock.call.search(
             q="search",
             count=100,
             include_entities=True,
             tweet_mode="extended",
         ),
-        mock.call.twapi.search(
+        mock.call.search(
             q="search",
             count=100,
             include_entities=True,
             tweet_mode="extended",
             max_id=1381726215963168768,
         ),
-        mock.call.twapi.search(
+        mock.call.search(
             q="search",
             count=100,
             include_entities=True,
@@ -96,25 +111,25 @@ def test_search():
 
 
 def test_mentions():
-    twclient = mock.MagicMock()
+    twclient = mock_twitter_client()
     twclient.twapi.get_mentions_timeline.side_effect = [
         [tweet_1],
         [],
     ]
     since_id = 123
 
-    result = list(TwitterClient.mentions(twclient, since_id))
+    result = list(twclient.mentions(since_id))
 
     assert len(result) == 1
 
-    assert twclient.mock_calls == [
-        mock.call.twapi.get_mentions_timeline(
+    assert twclient.twapi.mock_calls == [
+        mock.call.get_mentions_timeline(
             count=100,
             include_entities=True,
             tweet_mode="extended",
             since_id=since_id,
         ),
-        mock.call.twapi.get_mentions_timeline(
+        mock.call.get_mentions_timeline(
             count=100,
             include_entities=True,
             tweet_mode="extended",
@@ -122,3 +137,143 @@ def test_mentions():
             max_id=tweet_1["id"] - 1,
         ),
     ]
+
+
+def test_search_pages():
+    tweet_2 = {**tweet_1, "id": 2}
+    twclient = mock_twitter_client()
+    twclient.twapi.search.side_effect = [
+        {
+            "statuses": [tweet_1, tweet_2],
+            "search_metadata": {"next_results": "something"},
+        },
+        # no more tweets, despite next_results
+        {"statuses": [], "search_metadata": {"next_results": "something"}},
+    ]
+
+    pages = list(twclient.search_pages("search", 1, max_tweet_id=10**20))
+
+    assert [[tweet.tweet_id for tweet in page] for page in pages] == [
+        [tweet_1["id"], 2]
+    ]
+    assert twclient.twapi.mock_calls == [
+        mock.call.search(
+            q="search",
+            count=100,
+            include_entities=True,
+            tweet_mode="extended",
+            since_id=1,
+            max_id=10**20,
+        ),
+        mock.call.search(
+            q="search",
+            count=100,
+            include_entities=True,
+            tweet_mode="extended",
+            since_id=1,
+            max_id=1,
+        ),
+    ]
+
+
+def test_mentions_pages():
+    twclient = mock_twitter_client()
+    twclient.twapi.get_mentions_timeline.side_effect = [[tweet_1], []]
+
+    pages = list(twclient.mentions_pages(max_tweet_id=tweet_1["id"]))
+
+    assert pages == [
+        [Tweet(tweet_1["id"], 24324324242432, "test_user", "test tweet")]
+    ]
+    assert twclient.twapi.get_mentions_timeline.mock_calls[0] == mock.call(
+        count=100,
+        include_entities=True,
+        tweet_mode="extended",
+        max_id=tweet_1["id"],
+    )
+
+
+def test_get_by_ids():
+    tweet_2 = {**tweet_1, "id": 2}
+    tweet_3 = {**tweet_1, "id": 3}
+    twclient = mock.MagicMock()
+    twclient.twapi.lookup_status.side_effect = [
+        # missing tweets are omitted, order is not guaranteed
+        [tweet_3, tweet_1],
+        TwythonError("Rate limit exceeded"),
+        [tweet_2],
+    ]
+
+    result = TwitterClient.get_by_ids(
+        twclient, [tweet_1["id"], 3, 4, 5, 6, 2], batch_size=2
+    )
+
+    assert [tweet.tweet_id for tweet in result] == [tweet_1["id"], 3, 2]
+    assert twclient.twapi.mock_calls == [
+        mock.call.lookup_status(
+            id=f"{tweet_1['id']},3",
+            include_entities=True,
+            tweet_mode="extended",
+        ),
+        mock.call.lookup_status(
+            id="4,5",
+            include_entities=True,
+            tweet_mode="extended",
+        ),
+        mock.call.lookup_status(
+            id="6,2",
+            include_entities=True,
+            tweet_mode="extended",
+        ),
+    ]
+
+    # no API calls
+    assert TwitterClient.get_by_ids(twclient, []) == []
+    assert len(twclient.twapi.mock_calls) == 3
+
+
+def test_get_by_ids_rate_limited():
+    twclient = mock.MagicMock()
+    twclient.twapi.lookup_status.side_effect = TwythonRateLimitError(
+        "Rate limit exceeded", 429
+    )
+
+    with pytest.raises(TwythonRateLimitError):
+        TwitterClient.get_by_ids(twclient, [1, 2])
+
+
+def test_search_pages_rate_limited():
+    twclient = mock_twitter_client()
+    twclient.rate_limits = RateLimiter(max_wait=0)
+    twclient.rate_limits.update(
+        "search/tweets",
+        {"x-rate-limit-remaining": "1", "x-rate-limit-reset": "9e12"},
+        200,
+    )
+    twclient.twapi.search.return_value = {
+        "statuses": [tweet_1],
+        "search_metadata": {"next_results": "something"},
+    }
+
+    pages = twclient.search_pages("search")
+    assert len(next(pages)) == 1
+    # the next call is not made
+    with pytest.raises(TwythonRateLimitError):
+        next(pages)
+    assert len(twclient.twapi.search.mock_calls) == 1
+
+
+def test_rate_limit_remaining():
+    twclient = mock.MagicMock()
+    twclient.twapi.get_lastfunction_header.side_effect = [
+        "12",
+        None,
+        TwythonError("This function must be called after an API call."),
+    ]
+
+    assert TwitterClient.rate_limit_remaining(twclient) == 12
+    assert TwitterClient.rate_limit_remaining(twclient) is None
+    assert TwitterClient.rate_limit_remaining(twclient) is None
+    twclient.twapi.get_lastfunction_header.assert_called_with(
+        "x-rate-limit-remaining"
+    )
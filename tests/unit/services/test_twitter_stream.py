@@ -0,0 +1,89 @@
+from unittest import mock
+import pytest
+from twython.exceptions import TwythonStreamError
+from services.twitter import Tweet
+from services.twitter_stream import TwitterStream
+
+
+def status(tweet_id: int, text: str, **kwargs) -> dict:
+    return {
+        "id": tweet_id,
+        "text": text,
+        "user": {"id": tweet_id * 10, "screen_name": f"user_{tweet_id}"},
+        **kwargs,
+    }
+
+
+def mock_twclient():
+    twclient = mock.MagicMock()
+    twclient.twapi.client.auth = None
+    twclient.twapi.client.headers = {"User-Agent": "test"}
+    return twclient
+
+
+def test_twitter_stream(stream_server):
+    stream_server.connections = [
+        (
+            200,
+            [
+                None,
+                status(11, "short"),
+                status(
+                    12,
+                    "long…",
+                    extended_tweet={"full_text": "long text"},
+                ),
+                {"limit": {"track": 2, "timestamp_ms": "1"}},
+                status(13, "after limit"),
+            ],
+        ),
+    ]
+    stream = TwitterStream(mock_twclient(), "@hello", stream_server.url)
+
+    items = []
+    with pytest.raises(TwythonStreamError, match="closed"):
+        for item in stream.connect():
+            items.append(item)
+    stream.close()
+
+    assert items == [
+        None,
+        Tweet(11, 110, "user_11", "short"),
+        Tweet(12, 120, "user_12", "long text"),
+        Tweet(13, 130, "user_13", "after limit"),
+    ]
+    assert stream.dropped_count == 2
+    assert stream_server.requests == [
+        {"track": ["@hello"], "stall_warnings": ["true"]}
+    ]
+
+
+def test_twitter_stream_connect_failed(stream_server):
+    stream_server.connections = [(420, [])]
+    stream = TwitterStream(mock_twclient(), "@hello", stream_server.url)
+
+    with pytest.raises(TwythonStreamError) as exc_info:
+        stream.connect()
+    assert exc_info.value.error_code == 420
+
+
+def test_twitter_stream_disconnect_message(stream_server):
+    stream_server.connections = [
+        (
+            200,
+            [
+                status(11, "first"),
+                {"disconnect": {"code": 7, "reason": "admin logout"}},
+                status(12, "never received"),
+            ],
+        ),
+    ]
+    stream = TwitterStream(mock_twclient(), "@hello", stream_server.url)
+
+    items = []
+    with pytest.raises(TwythonStreamError, match="admin logout"):
+        for item in stream.connect():
+            items.append(item)
+    stream.close()
+
+    assert items == [Tweet(11, 110, "user_11", "first")]
@@ -0,0 +1,67 @@
+from unittest import mock
+from services.verification_cache import VerificationCache
+
+KEY_1 = ("pubkey1", "sig1", "handle1")
+KEY_2 = ("pubkey2", "sig2", "handle2")
+KEY_3 = ("pubkey3", "sig3", "handle3")
+
+
+def test_get_many():
+    cache = VerificationCache(max_size=10)
+    cache.put(KEY_1, "@handle")
+    cache.put(KEY_2, None)
+
+    assert cache.get_many([KEY_1, KEY_2, KEY_3]) == {
+        KEY_1: "@handle",
+        KEY_2: None,
+    }
+    assert cache.stats() == {
+        "size": 2,
+        "hits": 2,
+        "persistent_hits": 0,
+        "misses": 1,
+    }
+
+
+def test_lru_eviction():
+    cache = VerificationCache(max_size=2)
+    cache.put(KEY_1, "@handle")
+    cache.put(KEY_2, "handle")
+    # KEY_1 becomes the most recently used
+    assert cache.get_many([KEY_1]) == {KEY_1: "@handle"}
+    cache.put(KEY_3, None)
+
+    assert len(cache) == 2
+    assert cache.get_many([KEY_1, KEY_2, KEY_3]) == {
+        KEY_1: "@handle",
+        KEY_3: None,
+    }
+
+
+def test_persistent_layer():
+    storage = mock.MagicMock()
+    storage.get_verification_results.return_value = {KEY_2: "handle"}
+    cache = VerificationCache(max_size=10, storage=storage)
+    cache.put(KEY_1, "@handle")
+
+    assert cache.get_many([KEY_1, KEY_2, KEY_3]) == {
+        KEY_1: "@handle",
+        KEY_2: "handle",
+    }
+    assert cache.stats() == {
+        "size": 2,
+        "hits": 1,
+        "persistent_hits": 1,
+        "misses": 1,
+    }
+
+    # from memory now
+    assert cache.get_many([KEY_2]) == {KEY_2: "handle"}
+
+    cache.flush()
+    cache.flush()
+
+    assert storage.mock_calls == [
+        mock.call.get_verification_results([KEY_2, KEY_3]),
+        mock.call.save_verification_results({KEY_1: "@handle"}),
+    ]
@@ -0,0 +1,74 @@
+import pytest
+import ed25519
+from services.verifier import (
+    ED25519_L,
+    VERIFIERS,
+    get_verifier,
+    is_strict_signature,
+)
+
+MESSAGE = b"\x01" * 32
+SIGNING_KEY, VERIFYING_KEY = ed25519.create_keypair()
+PUB_KEY = VERIFYING_KEY.to_bytes()
+SIGNATURE = SIGNING_KEY.sign(MESSAGE)
+
+# identity point: small order key and R
+IDENTITY = bytes([1] + [0] * 31)
+
+
+def non_canonical(signature: bytes) -> bytes:
+    s = int.from_bytes(signature[32:], "little") + ED25519_L
+    return signature[:32] + s.to_bytes(32, "little")
+
+
+def flip_bit(data: bytes, index: int) -> bytes:
+    flipped = bytearray(data)
+    flipped[index] ^= 1
+    return bytes(flipped)
+
+
+CASES = [
+    # pub_key, signature, message, expected
+    (PUB_KEY, SIGNATURE, MESSAGE, True),
+    (PUB_KEY, SIGNATURE, b"\x02" * 32, False),
+    (PUB_KEY, flip_bit(SIGNATURE, 0), MESSAGE, False),
+    (PUB_KEY, flip_bit(SIGNATURE, 40), MESSAGE, False),
+    (flip_bit(PUB_KEY, 5), SIGNATURE, MESSAGE, False),
+    (PUB_KEY, SIGNATURE[:63], MESSAGE, False),
+    (PUB_KEY[:31], SIGNATURE, MESSAGE, False),
+    # ed25519==1.5 alone accepts these two
+    (PUB_KEY, non_canonical(SIGNATURE), MESSAGE, False),
+    (IDENTITY, IDENTITY + bytes(32), MESSAGE, False),
+    # non-canonical key encoding (y >= p)
+    (b"\xee" + b"\xff" * 30 + b"\x7f", SIGNATURE, MESSAGE, False),
+]
+
+
+def verify(name, pub_key, signature, message) -> bool:
+    verifier = get_verifier(name)
+    if not is_strict_signature(pub_key, signature):
+        return False
+    key = verifier.load_key(pub_key)
+    if key is None:
+        return False
+    return verifier.verify(key, signature, message)
+
+
+@pytest.mark.parametrize("name", VERIFIERS.keys())
+@pytest.mark.parametrize("pub_key, signature, message, expected", CASES)
+def test_verifiers_agree(name, pub_key, signature, message, expected):
+    assert verify(name, pub_key, signature, message) == expected
+
+
+def test_strict_signature():
+    assert is_strict_signature(PUB_KEY, SIGNATURE)
+    assert not is_strict_signature(PUB_KEY, non_canonical(SIGNATURE))
+    assert not is_strict_signature(IDENTITY, SIGNATURE)
+    assert not is_strict_signature(PUB_KEY, IDENTITY + SIGNATURE[32:])
+
+
+def test_get_verifier():
+    assert get_verifier().name == "nacl"
+    assert get_verifier("nacl") is get_verifier("nacl")
+    with pytest.raises(ValueError):
+        get_verifier("unknown")
@@ -0,0 +1,37 @@
+from common import SMVConfig
+
+ENVIRON = {
+    "TWITTER_SEARCH_TEXT": "I'm taking a ride with",
+    "TWITTER_REPLY_SUCCESS": "",
+    "TWITTER_REPLY_INVALID_FORMAT": "Tweet has invalid format.",
+    "TWITTER_REPLY_INVALID_SIGNATURE": "Tweet has invalid signature.",
+}
+
+
+def test_from_env_leases():
+    config = SMVConfig.from_env(ENVIRON)
+    # the default Cloud Functions timeout
+    assert config.function_timeout == 60
+    # expire soon after a killed run
+    assert config.processing_lease == 90
+    assert config.lease_ttl == 90
+
+    config = SMVConfig.from_env({**ENVIRON, "FUNCTION_TIMEOUT": "300"})
+    assert config.processing_lease == 330
+    assert config.lease_ttl == 330
+
+    config = SMVConfig.from_env(
+        {**ENVIRON, "PROCESSING_LEASE": "600", "LEASE_TTL": "120"}
+    )
+    assert config.processing_lease == 600
+    assert config.lease_ttl == 120
+
+
+def test_from_env_time_budget():
+    # below the function timeout
+    assert SMVConfig.from_env(ENVIRON).time_budget == 45
+    assert (
+        SMVConfig.from_env({**ENVIRON, "FUNCTION_TIMEOUT": "300"}).time_budget
+        == 225
+    )
+    assert SMVConfig.from_env({**ENVIRON, "TIME_BUDGET": "0"}).time_budget == 0